@@ -3,6 +3,7 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 import sqlite3
 import os
+import sys
 import hashlib
 import jwt
 from datetime import datetime, timedelta
@@ -21,7 +22,14 @@ admin_app.config["SECRET_KEY"] = "cyberbot_admin_secret_key_2024"
 admin_app.config["JWT_SECRET_KEY"] = "cyberbot_jwt_secret_key_2024"
 
 # مسار قاعدة البيانات
-DB_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'telegram_bot', 'cyberbot.db')
+BOT_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'telegram_bot')
+DB_PATH = os.path.join(BOT_DIR, 'cyberbot.db')
+
+# البحث يستخدم نفس فهرس البوت وتوحيد النص العربي
+sys.path.insert(0, BOT_DIR)
+from search_index import search, SEARCH_TABLES
+from points_ledger import APPLIED, DUPLICATE, INSUFFICIENT, LedgerEntry, post_entries
+from referrals import referral_levels, referral_members, referral_upline
 
 def get_db_connection():
     """الحصول على اتصال قاعدة البيانات"""
@@ -186,7 +194,7 @@ def get_dashboard_stats(current_admin):
         cursor.execute('SELECT COUNT(*) as total_purchases FROM purchases')
         total_purchases = cursor.fetchone()['total_purchases']
         
-        cursor.execute('SELECT SUM(amount_usd) as total_revenue FROM purchases WHERE status = "completed"')
+        cursor.execute('SELECT SUM(revenue) as total_revenue FROM revenue_rollups')
         total_revenue = cursor.fetchone()['total_revenue'] or 0
         
         conn.close()
@@ -328,6 +336,13 @@ def get_user_details(current_admin, user_id):
         ''', (user_id,))
         purchases = [dict(row) for row in cursor.fetchall()]
         
+        # شجرة الإحالات من جدول الإغلاق: المحيلون فوقه، وعدد كل مستوى تحته، وإحالاته المباشرة
+        referral_tree = {
+            'upline': [{'user_id': ancestor_id, 'depth': depth} for ancestor_id, depth in referral_upline(conn, user_id)],
+            'levels': referral_levels(conn, user_id, request.args.get('referral_depth', 3, type=int)),
+            'direct': referral_members(conn, user_id, 1)
+        }
+        
         conn.close()
         
         return jsonify({
@@ -335,7 +350,8 @@ def get_user_details(current_admin, user_id):
             'user': dict(user),
             'points_history': points_history,
             'lessons_progress': lessons_progress,
-            'purchases': purchases
+            'purchases': purchases,
+            'referral_tree': referral_tree
         })
         
     except Exception as e:
@@ -355,34 +371,28 @@ def update_user_points(current_admin, user_id):
         if not isinstance(points, int) or points <= 0:
             return jsonify({'error': 'Invalid points value'}), 400
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        # مفتاح اختياري يمنع تطبيق نفس التعديل مرتين عند إعادة إرسال الطلب
+        idempotency_key = data.get('idempotency_key') or request.headers.get('Idempotency-Key')
+        if idempotency_key:
+            idempotency_key = f'admin:{idempotency_key}'
         
-        # التحقق من وجود المستخدم
-        cursor.execute('SELECT points FROM users WHERE user_id = ?', (user_id,))
-        user = cursor.fetchone()
+        entry = LedgerEntry(user_id, points if action == 'add' else -points, reason, idempotency_key)
         
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        if action == 'add':
-            cursor.execute('UPDATE users SET points = points + ? WHERE user_id = ?', (points, user_id))
-            cursor.execute('''
-                INSERT INTO points_history (user_id, points, reason, transaction_type)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, points, reason, 'earned'))
-        else:  # subtract
-            if user['points'] < points:
-                return jsonify({'error': 'Insufficient points'}), 400
-            
-            cursor.execute('UPDATE users SET points = points - ? WHERE user_id = ?', (points, user_id))
-            cursor.execute('''
-                INSERT INTO points_history (user_id, points, reason, transaction_type)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, -points, reason, 'spent'))
+        conn = get_db_connection()
+        try:
+            # حجز الكتابة من البداية حتى لا يتغير الرصيد بين التحقق والتحديث
+            conn.execute('BEGIN IMMEDIATE')
+            result = post_entries(conn, [entry])[0]
+            conn.commit()
+        finally:
+            conn.close()
         
-        conn.commit()
-        conn.close()
+        if result == INSUFFICIENT:
+            return jsonify({'error': 'Insufficient points'}), 400
+        if result == DUPLICATE:
+            return jsonify({'success': True, 'message': 'Points already updated'})
+        if result != APPLIED:
+            return jsonify({'error': 'User not found'}), 404
         
         return jsonify({'success': True, 'message': 'Points updated successfully'})
         
@@ -461,6 +471,40 @@ def get_news(current_admin):
         logger.error(f"Get news error: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@admin_app.route('/api/admin/search', methods=['GET'])
+@token_required
+def search_content(current_admin):
+    """البحث النصي في الأخبار والدروس"""
+    try:
+        search_query = request.args.get('q', '').strip()
+        kind = request.args.get('type') or None
+        page = int(request.args.get('page', 1))
+        limit = max(1, min(int(request.args.get('limit', 20)), 50))
+        
+        if not search_query:
+            return jsonify({'error': 'Search query is required'}), 400
+        if kind is not None and kind not in SEARCH_TABLES:
+            return jsonify({'error': 'Invalid search type'}), 400
+        
+        conn = get_db_connection()
+        found = search(conn, search_query, kind=kind, page=page, per_page=limit, highlight=('<mark>', '</mark>'))
+        conn.close()
+        
+        return jsonify({
+            'success': True,
+            'results': found['results'],
+            'pagination': {
+                'page': found['page'],
+                'limit': limit,
+                'total': found['total'],
+                'pages': found['pages']
+            }
+        })
+        
+    except Exception as e:
+        logger.error(f"Search error: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 if __name__ == '__main__':
     init_admin_table()
     admin_app.run(host='0.0.0.0', port=5001, debug=True)
@@ -0,0 +1,124 @@
+import logging
+
+from database import db
+from i18n import catalog
+from notification_system import notification_system
+
+logger = logging.getLogger(__name__)
+
+class AchievementRule:
+    """إنجاز يُفتح عندما يبلغ مقياس المستخدم حداً معيناً"""
+
+    __slots__ = ('id', 'emoji', 'metric', 'threshold')
+
+    def __init__(self, id, emoji, metric, threshold):
+        self.id = id
+        self.emoji = emoji
+        self.metric = metric
+        self.threshold = threshold
+
+# بترتيب العرض؛ نص الاسم والوصف من مفاتيح id و id_desc في مجال points
+ACHIEVEMENTS = (
+    AchievementRule('first_lesson', '📚', 'lessons', 1),
+    AchievementRule('five_lessons', '📚', 'lessons', 5),
+    AchievementRule('first_referral', '👥', 'referrals', 1),
+    AchievementRule('points_collector', '💰', 'points', 100),
+    AchievementRule('week_streak', '🔥', 'streak', 7)
+)
+
+# قيمة كل مقياس من صف المستخدم
+METRIC_COLUMNS = {
+    'lessons': 'total_lessons_completed',
+    'points': 'points',
+    'streak': 'streak_days',
+    'referrals': 'referral_count'
+}
+
+# المقاييس التي قد يغيّرها كل حدث (لا تُقيَّم قواعد غيرها)
+EVENT_METRICS = {
+    'lesson_completed': ('lessons', 'points'),
+    'points_changed': ('points',),
+    'referral_added': ('referrals',),
+    'daily_login': ('streak',)
+}
+
+class AchievementEngine:
+    """تقييم الإنجازات عند الأحداث بدلاً من إعادة حسابها عند كل عرض
+
+    كل حدث يقيّم فقط القواعد المرتبطة بمقاييسه ولم يفتحها المستخدم بعد؛ الإنجاز الجديد وإشعاره
+    يُحفظان في معاملة واحدة ومفتاح (user_id, achievement_id) يمنع تكرار الإشعار.
+    """
+
+    def __init__(self, database, notifications, rules=ACHIEVEMENTS):
+        self.db = database
+        self.notifications = notifications
+        self.rules = rules
+        self._rules_by_event = {
+            event: tuple(rule for rule in rules if rule.metric in metrics)
+            for event, metrics in EVENT_METRICS.items()
+        }
+        database.points_listeners.append(self._on_points_changed)
+        database.event_listeners.append(self.handle)
+
+    def _on_points_changed(self, user_id, points, lessons, history_id=None):
+        if lessons > 0:
+            self.handle('lesson_completed', user_id)
+        elif points > 0:
+            self.handle('points_changed', user_id)
+
+    def _pending(self, event, user_id):
+        """القواعد التي استوفاها المستخدم بعد الحدث ولم تُفتح له، مع لغته"""
+        rules = self._rules_by_event.get(event)
+        if not rules:
+            return [], None
+        with self.db.connection() as conn:
+            unlocked = {row[0] for row in conn.execute(
+                'SELECT achievement_id FROM user_achievements WHERE user_id = ?', (user_id,)
+            )}
+            rules = [rule for rule in rules if rule.id not in unlocked]
+            if not rules:
+                return [], None
+            metrics = sorted({rule.metric for rule in rules})
+            row = conn.execute(
+                f"SELECT language, {', '.join(f'{METRIC_COLUMNS[metric]} AS {metric}' for metric in metrics)} "
+                f"FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        if row is None:
+            return [], None
+        return [rule for rule in rules if (row[rule.metric] or 0) >= rule.threshold], row['language']
+
+    def handle(self, event, user_id):
+        """تقييم حدث للمستخدم؛ يعيد معرّفات الإنجازات التي فُتحت الآن"""
+        earned, language = self._pending(event, user_id)
+        if not earned:
+            return []
+
+        unlocked = []
+        title = catalog.get_text(language, 'points', 'achievement_unlocked')
+        with self.db.transaction() as conn:
+            for rule in earned:
+                inserted = conn.execute('''
+                    INSERT OR IGNORE INTO user_achievements (user_id, achievement_id) VALUES (?, ?)
+                ''', (user_id, rule.id)).rowcount
+                if not inserted:
+                    # فتحه حدث متزامن آخر وأرسل إشعاره
+                    continue
+                message = (f"{catalog.get_text(language, 'points', rule.id)}\n"
+                           f"{catalog.get_text(language, 'points', f'{rule.id}_desc')}")
+                self.notifications.insert_notifications(conn, [user_id], title, message, 'achievement')
+                unlocked.append(rule.id)
+
+        if unlocked:
+            self.notifications.queue.wake()
+            logger.info(f"User {user_id} unlocked {', '.join(unlocked)}")
+        return unlocked
+
+    def get_unlocked(self, user_id):
+        """{achievement_id: unlocked_at} في قراءة واحدة بالمفتاح الأساسي"""
+        with self.db.connection() as conn:
+            return dict(conn.execute(
+                'SELECT achievement_id, unlocked_at FROM user_achievements WHERE user_id = ?', (user_id,)
+            ).fetchall())
+
+# محرك الإنجازات المشترك
+achievement_engine = AchievementEngine(db, notification_system)
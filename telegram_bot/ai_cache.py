@@ -0,0 +1,249 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+import logging
+
+logger = logging.getLogger(__name__)
+
+_ARABIC_DIACRITICS = re.compile(r'[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+_ARABIC_LETTERS = str.maketrans({'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ى': 'ي', 'ة': 'ه', 'ؤ': 'و', 'ئ': 'ي'})
+_NON_WORD = re.compile(r'[^\w\s]+')
+_SPACES = re.compile(r'\s+')
+
+# كلمات السؤال التي لا تغيّر معناه؛ أدوات النفي (not, no, لا, ليس, غير...) ليست منها عمداً
+_STOP_WORDS = frozenset('''
+    a an the is are was were be what whats which who how do does did can could would should
+    i me my you your it its this that there of to in on for about with and or please explain tell
+    s ما ماذا ماهو ماهي هل كيف هو هي في من علي عن الي او و ان انا لي اشرح معني يعني
+'''.split())
+
+def normalize_arabic(text):
+    """إزالة التشكيل والتطويل وتوحيد أشكال الألف والياء والتاء المربوطة"""
+    return _ARABIC_DIACRITICS.sub('', text).translate(_ARABIC_LETTERS)
+
+def normalize_question(question):
+    """توحيد صيغة السؤال: حالة الأحرف والتشكيل وأشكال الألف وعلامات الترقيم"""
+    text = normalize_arabic(unicodedata.normalize('NFKC', question).lower())
+    text = _NON_WORD.sub(' ', text)
+    return _SPACES.sub(' ', text).strip()
+
+def char_ngrams(text, n=3):
+    """مجموعة n-gram الحرفية للنص الموحّد (تُستخدم لقياس التشابه)"""
+    padded = f' {text} '
+    if len(padded) <= n:
+        return frozenset((padded,))
+    return frozenset(padded[i:i + n] for i in range(len(padded) - n + 1))
+
+def content_words(text):
+    """كلمات المحتوى في النص الموحّد بترتيبها (بما فيها أدوات النفي)
+
+    سؤالان متشابهان حرفياً يختلفان في كلمة واحدة (phishing/vishing، safe/unsafe، enable/disable)
+    لهما إجابتان مختلفتان، فالتشابه يُقبل فقط بين أسئلة لها نفس كلمات المحتوى.
+    """
+    return [word for word in text.split() if word not in _STOP_WORDS]
+
+class _Entry:
+    __slots__ = ('id', 'answer', 'created_at', 'ngrams', 'words')
+
+    def __init__(self, entry_id, answer, created_at, key):
+        self.id = entry_id
+        self.answer = answer
+        self.created_at = created_at
+        words = content_words(key)
+        self.words = frozenset(words)
+        # التشابه يُقاس على كلمات المحتوى بترتيبها فلا تؤثر أدوات السؤال ويؤثر تبديل الكلمات
+        self.ngrams = char_ngrams(' '.join(words))
+
+class AnswerCache:
+    """ذاكرة مؤقتة لإجابات الذكاء الاصطناعي مفهرسة بـ (اللغة، المستوى، السؤال الموحّد)
+
+    البحث بالتطابق التام أولاً ثم بتشابه n-gram (Jaccard) بين الأسئلة التي لها نفس كلمات المحتوى
+    ضمن نفس اللغة والمستوى (فاختلاف الترتيب أو أدوات السؤال لا يمنع الإصابة، واختلاف كلمة لا يسمح بها).
+    الإجابات محفوظة في جدول ai_answer_cache وتُحمَّل إلى الذاكرة عند أول استخدام، وعدادات الاستخدام
+    تُجمع في الذاكرة وتُحفظ دفعة واحدة عبر flush_hits().
+    """
+
+    def __init__(self, database, max_entries=5000, ttl=7 * 24 * 3600, similarity_threshold=0.85):
+        self.db = database
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+
+        # (language, level, key) -> _Entry بترتيب آخر استخدام
+        self._entries = OrderedDict()
+        # (language, level, كلمات المحتوى) -> set(key) لإيجاد المرشحين للتشابه
+        self._word_index = {}
+        # id -> (عدد الإصابات، آخر استخدام) بانتظار الحفظ
+        self._pending_hits = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    def _load(self):
+        """تحميل الإجابات الصالحة من قاعدة البيانات مرة واحدة"""
+        cutoff = time.time() - self.ttl
+        with self.db.connection() as conn:
+            rows = conn.execute('''
+                SELECT id, language, level, question_key, answer, created_at
+                FROM ai_answer_cache
+                WHERE created_at >= ?
+                ORDER BY last_used_at DESC
+                LIMIT ?
+            ''', (cutoff, self.max_entries)).fetchall()
+
+        with self._lock:
+            if self._loaded:
+                return
+            # الصفوف مرتبة من الأحدث استخداماً، لذا تُدرج معكوسة ليبقى الأحدث في نهاية الترتيب
+            for row in reversed(rows):
+                self._add(row['language'], row['level'], row['question_key'],
+                          _Entry(row['id'], row['answer'], row['created_at'], row['question_key']))
+            self._loaded = True
+        logger.info(f"Loaded {len(rows)} cached AI answers")
+
+    def _add(self, language, level, key, entry):
+        full_key = (language, level, key)
+        if full_key in self._entries:
+            self._remove(full_key)
+        self._entries[full_key] = entry
+        if entry.words:
+            self._word_index.setdefault((language, level, entry.words), set()).add(key)
+
+    def _remove(self, full_key):
+        entry = self._entries.pop(full_key)
+        language, level, key = full_key
+        index_key = (language, level, entry.words)
+        keys = self._word_index.get(index_key)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._word_index[index_key]
+        self._pending_hits.pop(entry.id, None)
+        return entry
+
+    def _find_similar(self, language, level, key):
+        """أقرب سؤال مخزن له نفس كلمات المحتوى حسب معامل Jaccard، أو None إذا كان دون العتبة"""
+        words = content_words(key)
+        candidates = self._word_index.get((language, level, frozenset(words))) if words else None
+        if not candidates:
+            return None
+
+        ngrams = char_ngrams(' '.join(words))
+        best_key, best_score = None, 0.0
+        for candidate in candidates:
+            other = self._entries[(language, level, candidate)].ngrams
+            score = len(ngrams & other) / len(ngrams | other)
+            if score > best_score:
+                best_key, best_score = candidate, score
+        return best_key if best_score >= self.similarity_threshold else None
+
+    def get(self, language, level, question):
+        """البحث عن إجابة مخزنة للسؤال، أو None"""
+        if not self._loaded:
+            self._load()
+
+        key = normalize_question(question)
+        now = time.time()
+        with self._lock:
+            full_key = (language, level, key)
+            entry = self._entries.get(full_key)
+            similar = False
+
+            if entry is None and self.similarity_threshold > 0:
+                similar_key = self._find_similar(language, level, key)
+                if similar_key is not None:
+                    full_key = (language, level, similar_key)
+                    entry = self._entries[full_key]
+                    similar = True
+
+            if entry is not None and entry.created_at < now - self.ttl:
+                self._remove(full_key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(full_key)
+            self.hits += 1
+            if similar:
+                self.similar_hits += 1
+            count, _ = self._pending_hits.get(entry.id, (0, now))
+            self._pending_hits[entry.id] = (count + 1, now)
+        return entry.answer
+
+    def put(self, language, level, question, answer):
+        """تخزين إجابة السؤال مع إزالة الأقدم استخداماً عند تجاوز الحد"""
+        if not self._loaded:
+            self._load()
+
+        key = normalize_question(question)
+        if not key or not answer:
+            return
+
+        now = time.time()
+        with self.db.transaction() as conn:
+            conn.execute('''
+                INSERT INTO ai_answer_cache (language, level, question_key, question, answer, created_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (language, level, question_key) DO UPDATE SET
+                    question = excluded.question,
+                    answer = excluded.answer,
+                    created_at = excluded.created_at,
+                    last_used_at = excluded.last_used_at
+            ''', (language, level, key, question, answer, now, now))
+            entry_id = conn.execute('''
+                SELECT id FROM ai_answer_cache WHERE language = ? AND level = ? AND question_key = ?
+            ''', (language, level, key)).fetchone()[0]
+
+            with self._lock:
+                self._add(language, level, key, _Entry(entry_id, answer, now, key))
+                evicted = []
+                while len(self._entries) > self.max_entries:
+                    evicted.append(self._remove(next(iter(self._entries))).id)
+
+            if evicted:
+                conn.executemany('DELETE FROM ai_answer_cache WHERE id = ?', [(i,) for i in evicted])
+
+    def flush_hits(self):
+        """حفظ عدادات الإصابات المتراكمة في معاملة واحدة؛ تُفقد عند الفشل (إحصائية فقط)"""
+        with self._lock:
+            pending, self._pending_hits = self._pending_hits, {}
+        if not pending:
+            return 0
+        try:
+            with self.db.transaction() as conn:
+                conn.executemany('''
+                    UPDATE ai_answer_cache SET hits = hits + ?, last_used_at = MAX(last_used_at, ?) WHERE id = ?
+                ''', [(count, last_used, entry_id) for entry_id, (count, last_used) in pending.items()])
+        except Exception as e:
+            logger.warning(f"Failed to save {len(pending)} AI cache hit counters: {e}")
+            return 0
+        return len(pending)
+
+    def purge_expired(self):
+        """حذف الإجابات منتهية الصلاحية من الذاكرة والقاعدة"""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [k for k, entry in self._entries.items() if entry.created_at < cutoff]
+            for full_key in expired:
+                self._remove(full_key)
+        with self.db.transaction() as conn:
+            # تشمل الإجابات التي لم تُحمَّل إلى الذاكرة
+            return conn.execute('DELETE FROM ai_answer_cache WHERE created_at < ?', (cutoff,)).rowcount
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'similar_hits': self.similar_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+            }
@@ -1,7 +1,14 @@
 import openai
+import httpx
+import asyncio
+import weakref
 import os
 from database import db
-from datetime import datetime
+from async_database import async_db
+from ai_cache import AnswerCache
+from conversation_store import ConversationStore
+from prompt_builder import PromptBuilder
+from i18n import catalog
 import logging
 
 logger = logging.getLogger(__name__)
@@ -9,59 +16,94 @@ logger = logging.getLogger(__name__)
 class AIChatSystem:
     def __init__(self):
         self.db = db
-        self.openai_client = openai.OpenAI(
+        self.async_db = async_db
+
+        # حدود التزامن ومهلة الطلب
+        self.max_concurrency = int(os.getenv('AI_MAX_CONCURRENCY', 16))
+        self.per_user_concurrency = int(os.getenv('AI_PER_USER_CONCURRENCY', 1))
+        self.request_timeout = float(os.getenv('AI_REQUEST_TIMEOUT', 60))
+
+        # بث الإجابة أثناء توليدها مع حد أدنى للفترة بين تعديلات الرسالة
+        self.streaming_enabled = os.getenv('AI_STREAMING', 'True').lower() == 'true'
+        self.stream_edit_interval = float(os.getenv('AI_STREAM_EDIT_INTERVAL', 1.0))
+
+        # عميل غير متزامن بمجمّع اتصالات HTTP مشترك بين جميع الطلبات
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=self.max_concurrency
+            ),
+            timeout=httpx.Timeout(self.request_timeout, connect=10.0)
+        )
+        self.openai_client = openai.AsyncOpenAI(
             api_key=os.getenv('OPENAI_API_KEY'),
-            base_url=os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
+            base_url=os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1'),
+            http_client=self.http_client,
+            max_retries=2
         )
+
+        self._global_slots = asyncio.Semaphore(self.max_concurrency)
+        self._user_slots = weakref.WeakValueDictionary()
+
+        # ذاكرة مؤقتة دائمة لإجابات الأسئلة المتكررة
+        self.answer_cache = AnswerCache(
+            self.db,
+            max_entries=int(os.getenv('AI_CACHE_SIZE', 5000)),
+            ttl=int(os.getenv('AI_CACHE_TTL', 7 * 24 * 3600)),
+            similarity_threshold=float(os.getenv('AI_CACHE_SIMILARITY', 0.85))
+        )
+
+        # طلبات الذكاء الاصطناعي الجارية لكل مستخدم (تُلغى عند مسح المحادثة)
+        self._user_tasks = {}
         
-        # حفظ تاريخ المحادثات
-        self.conversation_history = {}
+        # حفظ تاريخ المحادثات (ذاكرة محدودة مع حفظ مؤجل في قاعدة البيانات)
+        self.conversations = ConversationStore(
+            self.db,
+            memory_budget=int(os.getenv('AI_HISTORY_MEMORY_MB', 64)) * 1024 * 1024,
+            max_messages=20,
+            flush_interval=float(os.getenv('AI_HISTORY_FLUSH_INTERVAL', 5))
+        )
+        self.conversations.start()
+
+        # بناء الطلبات ضمن ميزانية رموز مع ملخص متراكم للرسائل الأقدم
+        self.prompts = PromptBuilder(
+            model="gpt-4o-mini",
+            token_budget=int(os.getenv('AI_PROMPT_TOKEN_BUDGET', 2500)),
+            summary_max_tokens=int(os.getenv('AI_SUMMARY_MAX_TOKENS', 250))
+        )
+        self._summary_tasks = {}
     
     def get_text(self, user_id, key):
         """الحصول على النص حسب لغة المستخدم"""
-        user_info = self.db.get_user_info(user_id)
-        lang = user_info[4] if user_info else 'ar'
-        
-        texts = {
+        return catalog.get_text(self.db.get_user_language(user_id), 'ai_chat', key)
+    
+    def get_system_prompt(self, user_id):
+        """الحصول على prompt النظام حسب لغة المستخدم ومستواه (محفوظ لكل لغة ومستوى)"""
+        profile = self.db.get_user_profile(user_id)
+        lang = profile.language if profile else 'ar'
+        level = profile.level if profile else 'beginner'
+        return self.prompts.system_prompt(lang, level, self.build_system_prompt)
+    
+    def build_system_prompt(self, lang, level):
+        """بناء نص prompt النظام للغة والمستوى"""
+        level_notes = {
             'ar': {
-                'ai_chat': '🤖 الذكاء الاصطناعي',
-                'ask_question': 'اسأل سؤالك حول الأمن السيبراني:',
-                'thinking': '🤔 جاري التفكير...',
-                'error_occurred': '❌ حدث خطأ، حاول مرة أخرى',
-                'clear_chat': '🗑️ مسح المحادثة',
-                'back_to_menu': '🔙 العودة للقائمة',
-                'chat_cleared': '✅ تم مسح المحادثة',
-                'sample_questions': 'أسئلة مقترحة:',
-                'what_is_phishing': 'ما هو التصيد الإلكتروني؟',
-                'how_to_secure_password': 'كيف أحمي كلمة المرور؟',
-                'latest_threats': 'ما أحدث التهديدات؟',
-                'security_tips': 'نصائح أمنية للمبتدئين',
-                'main_menu': '🏠 القائمة الرئيسية'
+                'beginner': 'المستخدم مبتدئ: تجنب المصطلحات المعقدة واشرح الأساسيات.',
+                'intermediate': 'المستخدم في مستوى متوسط: يمكنك استخدام المصطلحات الشائعة مع شرح موجز.',
+                'advanced': 'المستخدم متقدم: ركز على التفاصيل التقنية والممارسات المتقدمة.'
             },
             'en': {
-                'ai_chat': '🤖 AI Chat',
-                'ask_question': 'Ask your cybersecurity question:',
-                'thinking': '🤔 Thinking...',
-                'error_occurred': '❌ An error occurred, please try again',
-                'clear_chat': '🗑️ Clear Chat',
-                'back_to_menu': '🔙 Back to Menu',
-                'chat_cleared': '✅ Chat cleared',
-                'sample_questions': 'Suggested questions:',
-                'what_is_phishing': 'What is phishing?',
-                'how_to_secure_password': 'How to secure passwords?',
-                'latest_threats': 'What are the latest threats?',
-                'security_tips': 'Security tips for beginners',
-                'main_menu': '🏠 Main Menu'
+                'beginner': 'The user is a beginner: avoid jargon and explain the basics.',
+                'intermediate': 'The user is intermediate: common terminology is fine with brief explanations.',
+                'advanced': 'The user is advanced: focus on technical depth and advanced practices.'
             }
         }
+        notes = level_notes.get(lang, level_notes['en'])
+        level_note = notes.get(level, notes['beginner'])
         
-        return texts.get(lang, texts['ar']).get(key, key)
+        return f"{self._base_system_prompt(lang)}\n- {level_note}"
     
-    def get_system_prompt(self, user_id):
-        """الحصول على prompt النظام حسب لغة المستخدم"""
-        user_info = self.db.get_user_info(user_id)
-        lang = user_info[4] if user_info else 'ar'
-        
+    def _base_system_prompt(self, lang):
         if lang == 'ar':
             return """أنت CyberBot AI، خبير في الأمن السيبراني ومساعد تعليمي ذكي.
 
@@ -126,35 +168,128 @@ Important rules:
     
     def get_conversation_history(self, user_id, limit=5):
         """الحصول على تاريخ المحادثة"""
-        if user_id not in self.conversation_history:
-            self.conversation_history[user_id] = []
-        
-        return self.conversation_history[user_id][-limit*2:]  # آخر 5 أسئلة وإجابات
+        # آخر 5 أسئلة وإجابات
+        return [
+            {"role": role, "content": content, "timestamp": timestamp}
+            for role, content, timestamp in self.conversations.get_history(user_id, limit * 2)
+        ]
     
     def add_to_conversation(self, user_id, role, content):
-        """إضافة رسالة لتاريخ المحادثة"""
-        if user_id not in self.conversation_history:
-            self.conversation_history[user_id] = []
+        """إضافة رسالة لتاريخ المحادثة (يحتفظ المخزن بآخر 20 رسالة فقط)"""
+        self.conversations.add(user_id, role, content)
+    
+    async def clear_conversation(self, user_id):
+        """مسح تاريخ المحادثة وإلغاء طلبات المستخدم الجارية"""
+        for task in self._user_tasks.pop(user_id, ()):
+            task.cancel()
+        
+        summary_task = self._summary_tasks.pop(user_id, None)
+        if summary_task is not None:
+            summary_task.cancel()
+        self.prompts.clear(user_id)
+        
+        await self.async_db.run(self.conversations.clear, user_id)
+    
+    def _get_user_slots(self, user_id):
+        """سيمافور المستخدم؛ يُحذف تلقائياً عندما لا يكون له طلبات"""
+        slots = self._user_slots.get(user_id)
+        if slots is None:
+            slots = asyncio.Semaphore(self.per_user_concurrency)
+            self._user_slots[user_id] = slots
+        return slots
+    
+    async def _complete(self, user_id, messages, on_update=None):
+        """استدعاء OpenAI ضمن حدود التزامن العامة وحدود المستخدم"""
+        stream = on_update is not None and self.streaming_enabled
+        async with self._get_user_slots(user_id), self._global_slots:
+            response = await self.openai_client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                max_tokens=800,
+                temperature=0.7,
+                presence_penalty=0.1,
+                frequency_penalty=0.1,
+                stream=stream
+            )
+            if not stream:
+                return response.choices[0].message.content.strip()
+            return await self._consume_stream(response, on_update)
+    
+    async def _consume_stream(self, response, on_update):
+        """تجميع أجزاء الإجابة المتدفقة وتمرير النص الجزئي على فترات متباعدة"""
+        loop = asyncio.get_running_loop()
+        parts = []
+        last_update = loop.time()
         
-        self.conversation_history[user_id].append({
-            "role": role,
-            "content": content,
-            "timestamp": datetime.now()
-        })
+        async for chunk in response:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            parts.append(delta)
+            
+            # أول جزء يُعرض فوراً، وبعده تعديل واحد على الأكثر كل stream_edit_interval
+            now = loop.time()
+            if len(parts) == 1 or now - last_update >= self.stream_edit_interval:
+                last_update = now
+                await on_update(''.join(parts))
         
-        # الاحتفاظ بآخر 20 رسالة فقط
-        if len(self.conversation_history[user_id]) > 20:
-            self.conversation_history[user_id] = self.conversation_history[user_id][-20:]
+        # النص الكامل يعرضه المستدعي في التعديل الأخير مع لوحة الأزرار
+        return ''.join(parts).strip()
     
-    def clear_conversation(self, user_id):
-        """مسح تاريخ المحادثة"""
-        if user_id in self.conversation_history:
-            del self.conversation_history[user_id]
+    def get_summary_label(self, lang):
+        return 'ملخص المحادثة السابقة' if lang == 'ar' else 'Summary of the earlier conversation'
     
-    def get_predefined_answer(self, user_id, question_type):
+    def _schedule_summary(self, user_id, overflow, language):
+        """تحديث ملخص المستخدم في الخلفية (تحديث واحد على الأكثر في نفس الوقت)"""
+        if user_id in self._summary_tasks:
+            return
+        task = asyncio.ensure_future(self._update_summary(user_id, overflow, language))
+        self._summary_tasks[user_id] = task
+        
+        def _done(finished):
+            if self._summary_tasks.get(user_id) is finished:
+                del self._summary_tasks[user_id]
+        
+        task.add_done_callback(_done)
+    
+    async def _update_summary(self, user_id, overflow, language):
+        messages = self.prompts.summary_request(user_id, overflow, language)
+        try:
+            async with self._global_slots:
+                response = await asyncio.wait_for(
+                    self.openai_client.chat.completions.create(
+                        model="gpt-4o-mini",
+                        messages=messages,
+                        max_tokens=self.prompts.summary_max_tokens,
+                        temperature=0.3
+                    ),
+                    timeout=self.request_timeout
+                )
+            summary = response.choices[0].message.content.strip()
+            self.prompts.set_summary(user_id, summary, overflow[-1]["timestamp"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Failed to update conversation summary for user {user_id}: {e}")
+    
+    async def _run_user_task(self, user_id, coro):
+        """تشغيل طلب كمهمة مسجلة باسم المستخدم حتى يمكن إلغاؤها"""
+        task = asyncio.ensure_future(coro)
+        tasks = self._user_tasks.setdefault(user_id, set())
+        tasks.add(task)
+        try:
+            # wait_for يلغي المهمة عند انتهاء المهلة أو عند إلغاء المعالج
+            return await asyncio.wait_for(task, timeout=self.request_timeout)
+        finally:
+            tasks.discard(task)
+            if not tasks and self._user_tasks.get(user_id) is tasks:
+                del self._user_tasks[user_id]
+    
+    async def get_predefined_answer(self, user_id, question_type, on_update=None):
         """الحصول على إجابات محددة مسبقاً للأسئلة الشائعة"""
-        user_info = self.db.get_user_info(user_id)
-        lang = user_info[4] if user_info else 'ar'
+        lang = self.db.get_user_language(user_id)
         
         predefined_questions = {
             'ar': {
@@ -174,64 +309,84 @@ Important rules:
         question = predefined_questions.get(lang, predefined_questions['ar']).get(question_type, '')
         
         if question:
-            return self.ask_ai(user_id, question)
+            return await self.ask_ai(user_id, question, on_update=on_update, standalone=True)
         
         return None
     
-    def ask_ai(self, user_id, question):
-        """طرح سؤال على الذكاء الاصطناعي"""
+    async def ask_ai(self, user_id, question, on_update=None, standalone=False):
+        """طرح سؤال على الذكاء الاصطناعي
+
+        on_update: دالة غير متزامنة تستقبل النص الجزئي أثناء بث الإجابة
+        standalone: السؤال لا يعتمد على سياق المحادثة (مثل الأسئلة الجاهزة)
+        """
+        charged = False
         try:
-            # إضافة السؤال لتاريخ المحادثة
-            self.add_to_conversation(user_id, "user", question)
-            
-            # بناء رسائل المحادثة
-            messages = [
-                {"role": "system", "content": self.get_system_prompt(user_id)}
-            ]
+            profile = await self.async_db.get_user_profile(user_id)
+            language = profile.language if profile else 'ar'
+            level = profile.level if profile else 'beginner'
             
-            # إضافة تاريخ المحادثة
-            history = self.get_conversation_history(user_id)
-            for msg in history:
-                if msg["role"] in ["user", "assistant"]:
-                    messages.append({
-                        "role": msg["role"],
-                        "content": msg["content"]
-                    })
+            # حجز نقطة السؤال قبل بث الإجابة (إذا لم يكن VIP)، وتُسترد إذا فشل الطلب
+            is_vip = profile.is_vip if profile else False
             
-            # إضافة السؤال الحالي إذا لم يكن في التاريخ
-            if not history or history[-1]["content"] != question:
-                messages.append({"role": "user", "content": question})
+            if not is_vip:
+                success, message = await self.async_db.spend_points(user_id, 1, "AI Chat Question")
+                if not success:
+                    return "⚠️ نقاطك غير كافية لاستخدام الذكاء الاصطناعي. احصل على المزيد من النقاط من خلال إكمال الدروس!"
+                charged = True
             
-            # استدعاء OpenAI
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                max_tokens=800,
-                temperature=0.7,
-                presence_penalty=0.1,
-                frequency_penalty=0.1
-            )
+            # الإجابة قابلة للتخزين فقط إذا لم تعتمد على رسائل سابقة
+            history = await self.async_db.run(self.get_conversation_history, user_id, 10)
+            cacheable = standalone or not history
             
-            answer = response.choices[0].message.content.strip()
+            # إضافة السؤال لتاريخ المحادثة
+            # (قد يحمّل المحادثة من القاعدة إذا أُزيلت من الذاكرة، فيُنفذ خارج حلقة الأحداث)
+            await self.async_db.run(self.add_to_conversation, user_id, "user", question)
             
-            # إضافة الإجابة لتاريخ المحادثة
-            self.add_to_conversation(user_id, "assistant", answer)
+            answer = None
+            if cacheable:
+                answer = await self.async_db.run(self.answer_cache.get, language, level, question)
             
-            # خصم نقاط للاستخدام (إذا لم يكن VIP)
-            user_info = self.db.get_user_info(user_id)
-            is_vip = user_info[11] if len(user_info) > 11 else False
+            if answer is None:
+                # بناء رسائل المحادثة ضمن ميزانية الرموز
+                system_prompt = self.prompts.system_prompt(language, level, self.build_system_prompt)
+                messages, overflow = self.prompts.build(
+                    user_id, system_prompt, [] if standalone else history, question,
+                    summary_label=self.get_summary_label(language)
+                )
+                
+                # الرسائل التي تجاوزت الميزانية تُدمج في الملخص بالخلفية للطلبات التالية
+                if overflow:
+                    self._schedule_summary(user_id, overflow, language)
+                
+                # استدعاء OpenAI دون حجب حلقة الأحداث
+                answer = await self._run_user_task(user_id, self._complete(user_id, messages, on_update))
+                
+                if cacheable:
+                    await self.async_db.run(self.answer_cache.put, language, level, question, answer)
             
-            if not is_vip:
-                # خصم نقطة واحدة لكل سؤال
-                success, message = self.db.spend_points(user_id, 1, "AI Chat Question")
-                if not success:
-                    return "⚠️ نقاطك غير كافية لاستخدام الذكاء الاصطناعي. احصل على المزيد من النقاط من خلال إكمال الدروس!"
+            # إضافة الإجابة لتاريخ المحادثة
+            await self.async_db.run(self.add_to_conversation, user_id, "assistant", answer)
             
+            charged = False
             return answer
             
+        except asyncio.CancelledError:
+            # الإلغاء بسبب مسح المحادثة لا يعني إيقاف المعالج نفسه
+            current = asyncio.current_task()
+            if current is not None and current.cancelling():
+                raise
+            logger.info(f"AI request cancelled for user {user_id}")
+            return await self.async_db.run(self.get_text, user_id, 'request_cancelled')
+        except asyncio.TimeoutError:
+            logger.warning(f"AI request timed out for user {user_id}")
+            return await self.async_db.run(self.get_text, user_id, 'request_timeout')
         except Exception as e:
             logger.error(f"Error in AI chat: {e}")
-            return self.get_text(user_id, 'error_occurred')
+            return await self.async_db.run(self.get_text, user_id, 'error_occurred')
+        finally:
+            if charged:
+                # الطلب لم يُكمل (خطأ أو مهلة أو إلغاء): استرداد النقطة المحجوزة
+                await asyncio.shield(self.async_db.add_points(user_id, 1, "AI Chat Refund"))
     
     def create_ai_response_menu(self, user_id):
         """إنشاء قائمة بعد الإجابة"""
@@ -252,14 +407,34 @@ Important rules:
     
     def get_usage_stats(self, user_id):
         """الحصول على إحصائيات الاستخدام"""
-        history = self.get_conversation_history(user_id)
-        user_questions = [msg for msg in history if msg["role"] == "user"]
-        
-        return {
-            'total_questions': len(user_questions),
-            'today_questions': len([q for q in user_questions 
-                                  if q["timestamp"].date() == datetime.now().date()])
-        }
+        return self.conversations.usage(user_id)
+
+    def get_cache_stats(self):
+        """إحصائيات ذاكرة الإجابات المؤقتة (إصابات وإخفاقات)"""
+        return self.answer_cache.stats()
+
+    def maintain_answer_cache(self):
+        """حفظ عدادات الإصابات وحذف الإجابات المنتهية وتسجيل إحصائيات الذاكرة المؤقتة"""
+        self.answer_cache.flush_hits()
+        purged = self.answer_cache.purge_expired()
+        stats = self.get_cache_stats()
+        logger.info(
+            f"AI answer cache: {stats['size']} entries, {stats['hits']} hits "
+            f"({stats['similar_hits']} similar), {stats['misses']} misses, "
+            f"hit rate {stats['hit_rate']}, {purged} expired removed"
+        )
+        return stats
+    
+    async def close(self):
+        """إغلاق اتصالات HTTP وإلغاء الطلبات الجارية"""
+        for user_id in list(self._user_tasks):
+            for task in self._user_tasks.pop(user_id, ()):
+                task.cancel()
+        for task in list(self._summary_tasks.values()):
+            task.cancel()
+        await self.openai_client.close()
+        await self.async_db.run(self.answer_cache.flush_hits)
+        await self.async_db.run(self.conversations.close)
 
 # إنشاء مثيل من نظام الذكاء الاصطناعي
 ai_chat_system = AIChatSystem()
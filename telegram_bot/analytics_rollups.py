@@ -0,0 +1,141 @@
+"""تجميعات التحليلات المحدّثة تدريجياً مع كل حدث
+
+activity_rollups: لكل ساعة ولكل يوم ونوع نشاط ومستوى مستخدم عدد الأحداث ومخطط HyperLogLog
+للمستخدمين المميزين (المخططات تُدمج لحساب المستخدمين النشطين في أي فترة).
+revenue_rollups: الإيرادات وعدد المبيعات لكل منتج في كل يوم.
+
+التقارير تقرأ صفوف التجميع (عددها يتبع طول الفترة وعدد الأنواع لا عدد الأحداث)، وجدولا
+user_activities و purchases يبقيان للتفاصيل الفردية.
+"""
+import hashlib
+import math
+from collections import defaultdict
+
+# 2^11 سجل (2 كيلوبايت لكل مخطط) بخطأ معياري ~2.3%
+HLL_PRECISION = 11
+
+class HyperLogLog:
+    """مخطط HyperLogLog لتقدير عدد العناصر المميزة؛ يُحفظ كسجلات بايت واحد"""
+
+    precision = HLL_PRECISION
+    size = 1 << HLL_PRECISION
+
+    def __init__(self, registers=None):
+        self.registers = bytearray(registers or self.size)
+
+    @classmethod
+    def position(cls, value):
+        """(رقم السجل، الرتبة) للقيمة؛ التجزئة ثابتة بين العمليات بخلاف hash()"""
+        x = int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+        bits = 64 - cls.precision
+        return x >> bits, bits - (x & ((1 << bits) - 1)).bit_length() + 1
+
+    @classmethod
+    def of(cls, value):
+        sketch = cls()
+        sketch.add(value)
+        return sketch
+
+    @classmethod
+    def union(cls, blobs):
+        """دمج عدة مخططات محفوظة (أقصى قيمة لكل سجل)"""
+        blobs = [blob for blob in blobs if blob]
+        if not blobs:
+            return cls()
+        return cls(bytes(map(max, *blobs)) if len(blobs) > 1 else blobs[0])
+
+    def add(self, value):
+        """إضافة قيمة؛ يعيد True إذا تغير المخطط"""
+        index, rank = self.position(value)
+        if self.registers[index] >= rank:
+            return False
+        self.registers[index] = rank
+        return True
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        m = self.size
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # تصحيح الأعداد الصغيرة (linear counting)
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+def hour_bucket(timestamp):
+    return timestamp.strftime('%Y-%m-%d %H')
+
+def day_bucket(timestamp):
+    return timestamp.strftime('%Y-%m-%d')
+
+def record_activity(conn, user_id, activity_type, level, timestamp):
+    """تحديث تجميع الساعة واليوم لنشاط داخل معاملة الكتابة الحالية"""
+    index, rank = HyperLogLog.position(user_id)
+    for granularity, bucket in (('hour', hour_bucket(timestamp)), ('day', day_bucket(timestamp))):
+        key = (granularity, bucket, activity_type, level)
+        sketch = conn.execute('''
+            INSERT INTO activity_rollups (granularity, bucket, activity_type, level, events, users)
+            VALUES (?, ?, ?, ?, 1, ?)
+            ON CONFLICT (granularity, bucket, activity_type, level) DO UPDATE SET events = events + 1
+            RETURNING users
+        ''', key + (HyperLogLog.of(user_id).to_bytes(),)).fetchone()[0]
+        # المخطط يُعاد كتابته فقط عندما يرفع المستخدم أحد سجلاته (نادر بعد أول الأحداث)
+        if sketch[index] < rank:
+            sketch = bytearray(sketch)
+            sketch[index] = rank
+            conn.execute('''
+                UPDATE activity_rollups SET users = ?
+                WHERE granularity = ? AND bucket = ? AND activity_type = ? AND level = ?
+            ''', (bytes(sketch),) + key)
+
+def record_purchase(conn, item_id, amount_usd, amount_points, timestamp):
+    """إضافة شراء مكتمل إلى إيرادات المنتج في يومه"""
+    conn.execute('''
+        INSERT INTO revenue_rollups (day, item_id, revenue, points, sales)
+        VALUES (?, ?, ?, ?, 1)
+        ON CONFLICT (day, item_id) DO UPDATE SET
+            revenue = revenue + excluded.revenue,
+            points = points + excluded.points,
+            sales = sales + 1
+    ''', (day_bucket(timestamp), item_id, amount_usd or 0, amount_points or 0))
+
+def prune_hourly(conn, before):
+    """حذف تجميعات الساعات الأقدم من before (تجميعات الأيام تبقى)"""
+    return conn.execute('''
+        DELETE FROM activity_rollups WHERE granularity = 'hour' AND bucket < ?
+    ''', (hour_bucket(before),)).rowcount
+
+def rebuild_rollups(cursor):
+    """إعادة بناء كل التجميعات من user_activities و purchases (للترحيل أو الإصلاح)"""
+    cursor.execute('DELETE FROM activity_rollups')
+    cursor.execute('DELETE FROM revenue_rollups')
+
+    rollups = defaultdict(lambda: [0, HyperLogLog()])
+    for hour, activity_type, level, user_id in cursor.execute('''
+        SELECT substr(ua.timestamp, 1, 13), ua.activity_type, COALESCE(u.level, 'unknown'), ua.user_id
+        FROM user_activities ua
+        LEFT JOIN users u ON ua.user_id = u.user_id
+        WHERE ua.timestamp IS NOT NULL AND ua.activity_type IS NOT NULL
+    ''').fetchall():
+        for key in (('hour', hour, activity_type, level), ('day', hour[:10], activity_type, level)):
+            rollup = rollups[key]
+            rollup[0] += 1
+            rollup[1].add(user_id)
+    cursor.executemany('''
+        INSERT INTO activity_rollups (granularity, bucket, activity_type, level, events, users)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [key + (events, sketch.to_bytes()) for key, (events, sketch) in rollups.items()])
+
+    cursor.execute('''
+        INSERT INTO revenue_rollups (day, item_id, revenue, points, sales)
+        SELECT substr(purchase_date, 1, 10), item_id, COALESCE(SUM(amount_usd), 0),
+               COALESCE(SUM(amount_points), 0), COUNT(*)
+        FROM purchases
+        WHERE status = 'completed' AND purchase_date IS NOT NULL AND item_id IS NOT NULL
+        GROUP BY substr(purchase_date, 1, 10), item_id
+    ''')
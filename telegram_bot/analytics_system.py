@@ -1,8 +1,9 @@
 import sqlite3
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import json
 import logging
 from database import db
+from analytics_rollups import HyperLogLog, day_bucket, prune_hourly, record_activity
 
 logger = logging.getLogger(__name__)
 
@@ -11,70 +12,111 @@ class AnalyticsSystem:
         self.db = db
     
     def track_user_activity(self, user_id, activity_type, details=None):
-        """تتبع نشاط المستخدم"""
+        """تتبع نشاط المستخدم (مع تحديث تجميعات الساعة واليوم في نفس المعاملة)"""
         try:
-            conn = self.db.get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO user_activities (user_id, activity_type, details, timestamp)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, activity_type, json.dumps(details) if details else None, datetime.now()))
-            
-            conn.commit()
-            conn.close()
+            profile = self.db.get_user_profile(user_id)
+            level = profile.level if profile else 'unknown'
+            timestamp = datetime.now()
+            
+            with self.db.transaction() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    INSERT INTO user_activities (user_id, activity_type, details, timestamp)
+                    VALUES (?, ?, ?, ?)
+                ''', (user_id, activity_type, json.dumps(details) if details else None, timestamp))
+                record_activity(conn, user_id, activity_type, level, timestamp)
             
         except Exception as e:
             logger.error(f"Error tracking user activity: {e}")
     
+    def _active_users(self, conn, start_day, end_day=None, activity_type=None):
+        """تقدير المستخدمين المميزين في أيام [start_day, end_day) بدمج مخططات التجميع"""
+        query = "SELECT users FROM activity_rollups WHERE granularity = 'day' AND bucket >= ?"
+        params = [start_day]
+        if end_day is not None:
+            query += ' AND bucket < ?'
+            params.append(end_day)
+        if activity_type is not None:
+            query += ' AND activity_type = ?'
+            params.append(activity_type)
+        return HyperLogLog.union([row[0] for row in conn.execute(query, params)])
+    
+    def get_hourly_activity(self, hours=24):
+        """الأحداث والمستخدمون النشطون لكل ساعة في آخر hours ساعة"""
+        try:
+            with self.db.connection() as conn:
+                start_hour = (datetime.now() - timedelta(hours=hours)).strftime('%Y-%m-%d %H')
+                buckets = {}
+                for bucket, events, users in conn.execute('''
+                    SELECT bucket, events, users FROM activity_rollups
+                    WHERE granularity = 'hour' AND bucket > ?
+                    ORDER BY bucket
+                ''', (start_hour,)):
+                    entry = buckets.setdefault(bucket, [0, []])
+                    entry[0] += events
+                    entry[1].append(users)
+            
+            return [
+                {'hour': bucket, 'events': events, 'active_users': HyperLogLog.union(sketches).count()}
+                for bucket, (events, sketches) in buckets.items()
+            ]
+            
+        except Exception as e:
+            logger.error(f"Error getting hourly activity: {e}")
+            return None
+    
+    def prune_hourly_rollups(self, days=14):
+        """حذف تجميعات الساعات الأقدم من days يوماً"""
+        with self.db.transaction() as conn:
+            deleted = prune_hourly(conn, datetime.now() - timedelta(days=days))
+        logger.info(f"Pruned {deleted} hourly analytics rollups")
+        return deleted
+    
     def get_user_engagement_stats(self, days=30):
         """إحصائيات تفاعل المستخدمين"""
         try:
-            conn = self.db.get_connection()
-            cursor = conn.cursor()
-            
-            start_date = datetime.now() - timedelta(days=days)
-            
-            # المستخدمين النشطين
-            cursor.execute('''
-                SELECT COUNT(DISTINCT user_id) as active_users
-                FROM user_activities 
-                WHERE timestamp >= ?
-            ''', (start_date,))
-            active_users = cursor.fetchone()[0]
-            
-            # المستخدمين الجدد
-            cursor.execute('''
-                SELECT COUNT(*) as new_users
-                FROM users 
-                WHERE registration_date >= ?
-            ''', (start_date,))
-            new_users = cursor.fetchone()[0]
-            
-            # الأنشطة الأكثر شعبية
-            cursor.execute('''
-                SELECT activity_type, COUNT(*) as count
-                FROM user_activities 
-                WHERE timestamp >= ?
-                GROUP BY activity_type
-                ORDER BY count DESC
-                LIMIT 10
-            ''', (start_date,))
-            popular_activities = cursor.fetchall()
-            
-            # معدل الاحتفاظ
-            cursor.execute('''
-                SELECT 
-                    COUNT(CASE WHEN last_activity >= ? THEN 1 END) * 100.0 / COUNT(*) as retention_rate
-                FROM (
-                    SELECT user_id, MAX(timestamp) as last_activity
-                    FROM user_activities
-                    GROUP BY user_id
-                )
-            ''', (datetime.now() - timedelta(days=7),))
-            retention_rate = cursor.fetchone()[0] or 0
-            
-            conn.close()
+            with self.db.connection() as conn:
+                cursor = conn.cursor()
+                
+                now = datetime.now()
+                start_date = now - timedelta(days=days)
+                start_day = day_bucket(start_date)
+                
+                # المستخدمين النشطين
+                active_users = self._active_users(conn, start_day).count()
+                
+                # المستخدمين الجدد
+                cursor.execute('''
+                    SELECT COUNT(*) as new_users
+                    FROM users 
+                    WHERE registration_date >= ?
+                ''', (start_date,))
+                new_users = cursor.fetchone()[0]
+                
+                # الأنشطة الأكثر شعبية
+                cursor.execute('''
+                    SELECT activity_type, SUM(events) as count
+                    FROM activity_rollups
+                    WHERE granularity = 'day' AND bucket >= ?
+                    GROUP BY activity_type
+                    ORDER BY count DESC
+                    LIMIT 10
+                ''', (start_day,))
+                popular_activities = cursor.fetchall()
+                
+                # معدل الاحتفاظ: من نشطوا في الفترة السابقة لآخر 7 أيام (بطول days) وعادوا خلالها
+                # التقاطع = |السابقة| + |الأخيرة| - |الاتحاد| من المخططات
+                recent_day = day_bucket(now - timedelta(days=7))
+                previous = self._active_users(conn, day_bucket(now - timedelta(days=7 + days)), recent_day)
+                recent = self._active_users(conn, recent_day)
+                previous_count = previous.count()
+                retention_rate = 0
+                if previous_count:
+                    union = HyperLogLog(previous.registers)
+                    union.merge(recent)
+                    retained = previous_count + recent.count() - union.count()
+                    retention_rate = min(100.0, max(0.0, retained * 100.0 / previous_count))
             
             return {
                 'active_users': active_users,
@@ -90,56 +132,54 @@ class AnalyticsSystem:
     def get_learning_analytics(self):
         """تحليلات التعلم"""
         try:
-            conn = self.db.get_connection()
-            cursor = conn.cursor()
-            
-            # معدل إكمال الدروس
-            cursor.execute('''
-                SELECT 
-                    l.level,
-                    COUNT(up.user_id) as enrolled,
-                    COUNT(CASE WHEN up.completed = TRUE THEN 1 END) as completed,
-                    COUNT(CASE WHEN up.completed = TRUE THEN 1 END) * 100.0 / COUNT(up.user_id) as completion_rate
-                FROM lessons l
-                LEFT JOIN user_progress up ON l.id = up.lesson_id
-                GROUP BY l.level
-            ''')
-            completion_by_level = [dict(row) for row in cursor.fetchall()]
-            
-            # الدروس الأكثر صعوبة
-            cursor.execute('''
-                SELECT 
-                    l.title_ar,
-                    l.level,
-                    AVG(up.quiz_score) as avg_score,
-                    COUNT(up.user_id) as attempts
-                FROM lessons l
-                JOIN user_progress up ON l.id = up.lesson_id
-                WHERE up.completed = TRUE
-                GROUP BY l.id
-                ORDER BY avg_score ASC
-                LIMIT 5
-            ''')
-            difficult_lessons = [dict(row) for row in cursor.fetchall()]
-            
-            # توزيع النقاط
-            cursor.execute('''
-                SELECT 
-                    CASE 
-                        WHEN points < 100 THEN '0-99'
-                        WHEN points < 500 THEN '100-499'
-                        WHEN points < 1000 THEN '500-999'
-                        WHEN points < 2000 THEN '1000-1999'
-                        ELSE '2000+'
-                    END as points_range,
-                    COUNT(*) as user_count
-                FROM users
-                GROUP BY points_range
-                ORDER BY MIN(points)
-            ''')
-            points_distribution = [dict(row) for row in cursor.fetchall()]
-            
-            conn.close()
+            with self.db.connection() as conn:
+                cursor = conn.cursor()
+                
+                # معدل إكمال الدروس
+                cursor.execute('''
+                    SELECT 
+                        l.level,
+                        COUNT(up.user_id) as enrolled,
+                        COUNT(CASE WHEN up.completed = TRUE THEN 1 END) as completed,
+                        COUNT(CASE WHEN up.completed = TRUE THEN 1 END) * 100.0 / COUNT(up.user_id) as completion_rate
+                    FROM lessons l
+                    LEFT JOIN user_progress up ON l.id = up.lesson_id
+                    GROUP BY l.level
+                ''')
+                completion_by_level = [dict(row) for row in cursor.fetchall()]
+                
+                # الدروس الأكثر صعوبة
+                cursor.execute('''
+                    SELECT 
+                        l.title_ar,
+                        l.level,
+                        AVG(up.quiz_score) as avg_score,
+                        COUNT(up.user_id) as attempts
+                    FROM lessons l
+                    JOIN user_progress up ON l.id = up.lesson_id
+                    WHERE up.completed = TRUE
+                    GROUP BY l.id
+                    ORDER BY avg_score ASC
+                    LIMIT 5
+                ''')
+                difficult_lessons = [dict(row) for row in cursor.fetchall()]
+                
+                # توزيع النقاط
+                cursor.execute('''
+                    SELECT 
+                        CASE 
+                            WHEN points < 100 THEN '0-99'
+                            WHEN points < 500 THEN '100-499'
+                            WHEN points < 1000 THEN '500-999'
+                            WHEN points < 2000 THEN '1000-1999'
+                            ELSE '2000+'
+                        END as points_range,
+                        COUNT(*) as user_count
+                    FROM users
+                    GROUP BY points_range
+                    ORDER BY MIN(points)
+                ''')
+                points_distribution = [dict(row) for row in cursor.fetchall()]
             
             return {
                 'completion_by_level': completion_by_level,
@@ -154,51 +194,50 @@ class AnalyticsSystem:
     def get_revenue_analytics(self, days=30):
         """تحليلات الإيرادات"""
         try:
-            conn = self.db.get_connection()
-            cursor = conn.cursor()
-            
-            start_date = datetime.now() - timedelta(days=days)
-            
-            # إجمالي الإيرادات
-            cursor.execute('''
-                SELECT 
-                    SUM(amount_usd) as total_revenue,
-                    COUNT(*) as total_purchases
-                FROM purchases 
-                WHERE purchase_date >= ? AND status = 'completed'
-            ''', (start_date,))
-            revenue_data = cursor.fetchone()
-            
-            # الإيرادات حسب المنتج
-            cursor.execute('''
-                SELECT 
-                    s.name_ar,
-                    s.category,
-                    SUM(p.amount_usd) as revenue,
-                    COUNT(p.id) as sales_count
-                FROM purchases p
-                JOIN shop_items s ON p.item_id = s.id
-                WHERE p.purchase_date >= ? AND p.status = 'completed'
-                GROUP BY s.id
-                ORDER BY revenue DESC
-            ''', (start_date,))
-            revenue_by_product = [dict(row) for row in cursor.fetchall()]
-            
-            # الإيرادات اليومية
-            cursor.execute('''
-                SELECT 
-                    DATE(purchase_date) as date,
-                    SUM(amount_usd) as daily_revenue,
-                    COUNT(*) as daily_sales
-                FROM purchases 
-                WHERE purchase_date >= ? AND status = 'completed'
-                GROUP BY DATE(purchase_date)
-                ORDER BY date DESC
-                LIMIT 30
-            ''', (start_date,))
-            daily_revenue = [dict(row) for row in cursor.fetchall()]
-            
-            conn.close()
+            with self.db.connection() as conn:
+                cursor = conn.cursor()
+                
+                # تواريخ الشراء محفوظة بتوقيت UTC
+                start_day = day_bucket(datetime.now(timezone.utc) - timedelta(days=days))
+                
+                # إجمالي الإيرادات
+                cursor.execute('''
+                    SELECT 
+                        SUM(revenue) as total_revenue,
+                        SUM(sales) as total_purchases
+                    FROM revenue_rollups 
+                    WHERE day >= ?
+                ''', (start_day,))
+                revenue_data = cursor.fetchone()
+                
+                # الإيرادات حسب المنتج
+                cursor.execute('''
+                    SELECT 
+                        s.name_ar,
+                        s.category,
+                        SUM(r.revenue) as revenue,
+                        SUM(r.sales) as sales_count
+                    FROM revenue_rollups r
+                    JOIN shop_items s ON r.item_id = s.id
+                    WHERE r.day >= ?
+                    GROUP BY s.id
+                    ORDER BY revenue DESC
+                ''', (start_day,))
+                revenue_by_product = [dict(row) for row in cursor.fetchall()]
+                
+                # الإيرادات اليومية
+                cursor.execute('''
+                    SELECT 
+                        day as date,
+                        SUM(revenue) as daily_revenue,
+                        SUM(sales) as daily_sales
+                    FROM revenue_rollups 
+                    WHERE day >= ?
+                    GROUP BY day
+                    ORDER BY date DESC
+                    LIMIT 30
+                ''', (start_day,))
+                daily_revenue = [dict(row) for row in cursor.fetchall()]
             
             return {
                 'total_revenue': revenue_data[0] or 0,
@@ -214,53 +253,45 @@ class AnalyticsSystem:
     def get_ai_usage_analytics(self, days=30):
         """تحليلات استخدام الذكاء الاصطناعي"""
         try:
-            conn = self.db.get_connection()
-            cursor = conn.cursor()
-            
-            start_date = datetime.now() - timedelta(days=days)
-            
-            # إجمالي الاستخدام
-            cursor.execute('''
-                SELECT COUNT(*) as total_queries
-                FROM user_activities 
-                WHERE activity_type = 'ai_chat' AND timestamp >= ?
-            ''', (start_date,))
-            total_queries = cursor.fetchone()[0]
-            
-            # المستخدمين النشطين في الذكاء الاصطناعي
-            cursor.execute('''
-                SELECT COUNT(DISTINCT user_id) as active_ai_users
-                FROM user_activities 
-                WHERE activity_type = 'ai_chat' AND timestamp >= ?
-            ''', (start_date,))
-            active_ai_users = cursor.fetchone()[0]
-            
-            # الاستخدام حسب المستوى
-            cursor.execute('''
-                SELECT 
-                    u.level,
-                    COUNT(ua.id) as queries_count
-                FROM user_activities ua
-                JOIN users u ON ua.user_id = u.user_id
-                WHERE ua.activity_type = 'ai_chat' AND ua.timestamp >= ?
-                GROUP BY u.level
-            ''', (start_date,))
-            usage_by_level = [dict(row) for row in cursor.fetchall()]
-            
-            # الاستخدام اليومي
-            cursor.execute('''
-                SELECT 
-                    DATE(timestamp) as date,
-                    COUNT(*) as daily_queries
-                FROM user_activities 
-                WHERE activity_type = 'ai_chat' AND timestamp >= ?
-                GROUP BY DATE(timestamp)
-                ORDER BY date DESC
-                LIMIT 30
-            ''', (start_date,))
-            daily_usage = [dict(row) for row in cursor.fetchall()]
-            
-            conn.close()
+            with self.db.connection() as conn:
+                cursor = conn.cursor()
+                
+                start_day = day_bucket(datetime.now() - timedelta(days=days))
+                
+                # إجمالي الاستخدام
+                cursor.execute('''
+                    SELECT COALESCE(SUM(events), 0) as total_queries
+                    FROM activity_rollups 
+                    WHERE granularity = 'day' AND bucket >= ? AND activity_type = 'ai_chat'
+                ''', (start_day,))
+                total_queries = cursor.fetchone()[0]
+                
+                # المستخدمين النشطين في الذكاء الاصطناعي
+                active_ai_users = self._active_users(conn, start_day, activity_type='ai_chat').count()
+                
+                # الاستخدام حسب المستوى
+                cursor.execute('''
+                    SELECT 
+                        level,
+                        SUM(events) as queries_count
+                    FROM activity_rollups
+                    WHERE granularity = 'day' AND bucket >= ? AND activity_type = 'ai_chat' AND level != 'unknown'
+                    GROUP BY level
+                ''', (start_day,))
+                usage_by_level = [dict(row) for row in cursor.fetchall()]
+                
+                # الاستخدام اليومي
+                cursor.execute('''
+                    SELECT 
+                        bucket as date,
+                        SUM(events) as daily_queries
+                    FROM activity_rollups 
+                    WHERE granularity = 'day' AND bucket >= ? AND activity_type = 'ai_chat'
+                    GROUP BY bucket
+                    ORDER BY date DESC
+                    LIMIT 30
+                ''', (start_day,))
+                daily_usage = [dict(row) for row in cursor.fetchall()]
             
             return {
                 'total_queries': total_queries,
@@ -291,16 +322,13 @@ class AnalyticsSystem:
             }
             
             # حفظ التقرير
-            conn = self.db.get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO analytics_reports (report_type, period, data, generated_at)
-                VALUES (?, ?, ?, ?)
-            ''', ('weekly', 'last_7_days', json.dumps(report), datetime.now()))
-            
-            conn.commit()
-            conn.close()
+            with self.db.transaction() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    INSERT INTO analytics_reports (report_type, period, data, generated_at)
+                    VALUES (?, ?, ?, ?)
+                ''', ('weekly', 'last_7_days', json.dumps(report), datetime.now()))
             
             return report
             
@@ -311,50 +339,48 @@ class AnalyticsSystem:
     def get_user_behavior_insights(self, user_id):
         """تحليل سلوك مستخدم محدد"""
         try:
-            conn = self.db.get_connection()
-            cursor = conn.cursor()
-            
-            # نشاط المستخدم
-            cursor.execute('''
-                SELECT activity_type, COUNT(*) as count
-                FROM user_activities 
-                WHERE user_id = ?
-                GROUP BY activity_type
-                ORDER BY count DESC
-            ''', (user_id,))
-            activity_breakdown = [dict(row) for row in cursor.fetchall()]
-            
-            # تقدم التعلم
-            cursor.execute('''
-                SELECT 
-                    COUNT(*) as total_lessons,
-                    COUNT(CASE WHEN completed = TRUE THEN 1 END) as completed_lessons,
-                    AVG(quiz_score) as avg_score
-                FROM user_progress 
-                WHERE user_id = ?
-            ''', (user_id,))
-            learning_progress = dict(cursor.fetchone())
-            
-            # تاريخ النقاط
-            cursor.execute('''
-                SELECT 
-                    transaction_type,
-                    SUM(points) as total_points
-                FROM points_history 
-                WHERE user_id = ?
-                GROUP BY transaction_type
-            ''', (user_id,))
-            points_breakdown = [dict(row) for row in cursor.fetchall()]
-            
-            # آخر نشاط
-            cursor.execute('''
-                SELECT MAX(timestamp) as last_activity
-                FROM user_activities 
-                WHERE user_id = ?
-            ''', (user_id,))
-            last_activity = cursor.fetchone()[0]
-            
-            conn.close()
+            with self.db.connection() as conn:
+                cursor = conn.cursor()
+                
+                # نشاط المستخدم
+                cursor.execute('''
+                    SELECT activity_type, COUNT(*) as count
+                    FROM user_activities 
+                    WHERE user_id = ?
+                    GROUP BY activity_type
+                    ORDER BY count DESC
+                ''', (user_id,))
+                activity_breakdown = [dict(row) for row in cursor.fetchall()]
+                
+                # تقدم التعلم
+                cursor.execute('''
+                    SELECT 
+                        COUNT(*) as total_lessons,
+                        COUNT(CASE WHEN completed = TRUE THEN 1 END) as completed_lessons,
+                        AVG(quiz_score) as avg_score
+                    FROM user_progress 
+                    WHERE user_id = ?
+                ''', (user_id,))
+                learning_progress = dict(cursor.fetchone())
+                
+                # تاريخ النقاط
+                cursor.execute('''
+                    SELECT 
+                        transaction_type,
+                        SUM(points) as total_points
+                    FROM points_history 
+                    WHERE user_id = ?
+                    GROUP BY transaction_type
+                ''', (user_id,))
+                points_breakdown = [dict(row) for row in cursor.fetchall()]
+                
+                # آخر نشاط
+                cursor.execute('''
+                    SELECT MAX(timestamp) as last_activity
+                    FROM user_activities 
+                    WHERE user_id = ?
+                ''', (user_id,))
+                last_activity = cursor.fetchone()[0]
             
             return {
                 'activity_breakdown': activity_breakdown,
@@ -0,0 +1,99 @@
+import asyncio
+import functools
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from database import db
+from points_ledger import LedgerBatcher, LedgerEntry, spend_outcome
+
+logger = logging.getLogger(__name__)
+
+class AsyncDatabaseManager:
+    """واجهة غير متزامنة فوق DatabaseManager تنفّذ الاستعلامات في خيوط قاعدة البيانات"""
+
+    def __init__(self, database, max_workers=None):
+        self.db = database
+        # خيط لكل اتصال قراءة في المجمّع + خيط لاتصال الكتابة
+        self.max_workers = max_workers or database.pool.max_readers + 1
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='db')
+        # قيود النقاط من المعالجات المتزامنة تُحفظ معاً في معاملة واحدة
+        self.ledger = LedgerBatcher(database.ledger, self.run)
+
+    async def run(self, func, *args, **kwargs):
+        """تنفيذ دالة متزامنة تستخدم قاعدة البيانات دون حجب حلقة الأحداث"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def fetchone(self, query, params=()):
+        """تنفيذ استعلام قراءة وإرجاع صف واحد"""
+        def _fetchone():
+            with self.db.connection() as conn:
+                return conn.execute(query, params).fetchone()
+        return await self.run(_fetchone)
+
+    async def fetchall(self, query, params=()):
+        """تنفيذ استعلام قراءة وإرجاع جميع الصفوف"""
+        def _fetchall():
+            with self.db.connection() as conn:
+                return conn.execute(query, params).fetchall()
+        return await self.run(_fetchall)
+
+    async def execute(self, query, params=()):
+        """تنفيذ استعلام كتابة داخل معاملة وإرجاع عدد الصفوف المتأثرة"""
+        def _execute():
+            with self.db.transaction() as conn:
+                return conn.execute(query, params).rowcount
+        return await self.run(_execute)
+
+    async def register_user(self, user_id, username, first_name, last_name, referred_by=None):
+        """تسجيل مستخدم جديد"""
+        return await self.run(self.db.register_user, user_id, username, first_name, last_name, referred_by)
+
+    async def get_user_info(self, user_id):
+        """الحصول على معلومات المستخدم"""
+        return await self.run(self.db.get_user_info, user_id)
+
+    async def get_user_profile(self, user_id):
+        """الحصول على ملف المستخدم (من الذاكرة المؤقتة إن وجد)"""
+        profile = self.db.profiles.get(user_id)
+        if profile is not None:
+            return profile
+        return await self.run(self.db.get_user_profile, user_id)
+
+    async def record_daily_activity(self, user_id):
+        """تسجيل نشاط المستخدم اليومي (دون الانتقال لخيط قاعدة البيانات إذا سُجل اليوم مسبقاً)"""
+        profile = self.db.profiles.get(user_id)
+        if profile is not None and str(profile.last_activity_date) == datetime.now(timezone.utc).date().isoformat():
+            return False
+        return await self.run(self.db.record_daily_activity, user_id)
+
+    async def update_user_language(self, user_id, language):
+        """تحديث لغة المستخدم"""
+        return await self.run(self.db.update_user_language, user_id, language)
+
+    async def add_points(self, user_id, points, reason, idempotency_key=None):
+        """إضافة نقاط للمستخدم (ضمن دفعة قيود)"""
+        return await self.ledger.submit(LedgerEntry(user_id, points, reason, idempotency_key))
+
+    async def spend_points(self, user_id, points, reason, idempotency_key=None):
+        """خصم نقاط من المستخدم (ضمن دفعة قيود)"""
+        return spend_outcome(await self.ledger.submit(LedgerEntry(user_id, -points, reason, idempotency_key)))
+
+    async def get_user_by_referral_code(self, referral_code):
+        """الحصول على المستخدم بواسطة كود الإحالة"""
+        return await self.run(self.db.get_user_by_referral_code, referral_code)
+
+    async def insert_sample_lessons(self):
+        """إدراج دروس تجريبية"""
+        return await self.run(self.db.insert_sample_lessons)
+
+    async def backup(self, backup_path):
+        """نسخ احتياطي متسق لقاعدة البيانات"""
+        return await self.run(self.db.backup, backup_path)
+
+    def close(self):
+        """إيقاف خيوط قاعدة البيانات"""
+        self._executor.shutdown(wait=True)
+
+# إنشاء مثيل من الواجهة غير المتزامنة لقاعدة البيانات
+async_db = AsyncDatabaseManager(db)
@@ -4,6 +4,7 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
 from dotenv import load_dotenv
 import sqlite3
+from i18n import catalog
 from datetime import datetime
 
 # تحميل المتغيرات البيئية
@@ -80,60 +81,23 @@ def init_database():
     conn.commit()
     conn.close()
 
-# دالة للحصول على النصوص حسب اللغة
-def get_text(user_id, key):
+# دالة للحصول على لغة المستخدم
+def get_language(user_id):
     conn = sqlite3.connect('cyberbot.db')
     cursor = conn.cursor()
     cursor.execute('SELECT language FROM users WHERE user_id = ?', (user_id,))
     result = cursor.fetchone()
     conn.close()
     
-    lang = result[0] if result else 'ar'
-    
-    texts = {
-        'ar': {
-            'welcome': '🔐 مرحباً بك في CyberBot AI!\n\nبوت تعليمي متقدم للأمن السيبراني مدعوم بالذكاء الاصطناعي.\n\nاختر ما تريد فعله:',
-            'main_menu': '🏠 القائمة الرئيسية',
-            'lessons': '📚 الدروس التعليمية',
-            'news': '📰 الأخبار اليومية',
-            'points': '⭐ النقاط والجوائز',
-            'shop': '🛒 المتجر',
-            'ai_chat': '🤖 الذكاء الاصطناعي',
-            'settings': '⚙️ الإعدادات',
-            'profile': '👤 الملف الشخصي',
-            'language': '🌐 اللغة',
-            'help': '❓ المساعدة',
-            'points_balance': 'رصيد النقاط: {} نقطة',
-            'level_status': 'المستوى: {}',
-            'registration_success': '✅ تم تسجيلك بنجاح!\nحصلت على 10 نقاط كمكافأة ترحيب.',
-            'choose_language': 'اختر لغتك المفضلة:',
-            'language_changed': '✅ تم تغيير اللغة بنجاح!',
-            'arabic': '🇸🇦 العربية',
-            'english': '🇺🇸 English'
-        },
-        'en': {
-            'welcome': '🔐 Welcome to CyberBot AI!\n\nAdvanced cybersecurity educational bot powered by AI.\n\nChoose what you want to do:',
-            'main_menu': '🏠 Main Menu',
-            'lessons': '📚 Educational Lessons',
-            'news': '📰 Daily News',
-            'points': '⭐ Points & Rewards',
-            'shop': '🛒 Shop',
-            'ai_chat': '🤖 AI Chat',
-            'settings': '⚙️ Settings',
-            'profile': '👤 Profile',
-            'language': '🌐 Language',
-            'help': '❓ Help',
-            'points_balance': 'Points Balance: {} points',
-            'level_status': 'Level: {}',
-            'registration_success': '✅ Registration successful!\nYou received 10 points as welcome bonus.',
-            'choose_language': 'Choose your preferred language:',
-            'language_changed': '✅ Language changed successfully!',
-            'arabic': '🇸🇦 العربية',
-            'english': '🇺🇸 English'
-        }
-    }
-    
-    return texts.get(lang, texts['ar']).get(key, key)
+    return result[0] if result else 'ar'
+
+# دالة للحصول على النصوص حسب اللغة
+def get_text(user_id, key):
+    return catalog.get_text(get_language(user_id), 'bot', key)
+
+# دالة للحصول على النص بعد ملء حقوله
+def format_text(user_id, key, *args):
+    return catalog.format(get_language(user_id), 'bot', key, *args)
 
 # دالة لإنشاء القائمة الرئيسية
 def create_main_menu(user_id):
@@ -231,8 +195,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             points = user_info[5]
             level = user_info[6]
             text = f"👤 {get_text(user_id, 'profile')}\n\n"
-            text += f"{get_text(user_id, 'points_balance').format(points)}\n"
-            text += f"{get_text(user_id, 'level_status').format(level)}"
+            text += f"{format_text(user_id, 'points_balance', points)}\n"
+            text += f"{format_text(user_id, 'level_status', level)}"
             
             keyboard = [[InlineKeyboardButton(get_text(user_id, 'main_menu'), callback_data='main_menu')]]
             reply_markup = InlineKeyboardMarkup(keyboard)
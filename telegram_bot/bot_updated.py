@@ -4,6 +4,7 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
 from dotenv import load_dotenv
 from database import db
+from i18n import catalog
 from lessons import lessons_manager
 from points_system import points_system
 from datetime import datetime
@@ -20,55 +21,11 @@ logger = logging.getLogger(__name__)
 
 # دالة للحصول على النصوص حسب اللغة
 def get_text(user_id, key):
-    user_info = db.get_user_info(user_id)
-    lang = user_info[4] if user_info else 'ar'
-    
-    texts = {
-        'ar': {
-            'welcome': '🔐 مرحباً بك في CyberBot AI!\n\nبوت تعليمي متقدم للأمن السيبراني مدعوم بالذكاء الاصطناعي.\n\nاختر ما تريد فعله:',
-            'main_menu': '🏠 القائمة الرئيسية',
-            'lessons': '📚 الدروس التعليمية',
-            'news': '📰 الأخبار اليومية',
-            'points': '⭐ النقاط والجوائز',
-            'shop': '🛒 المتجر',
-            'ai_chat': '🤖 الذكاء الاصطناعي',
-            'settings': '⚙️ الإعدادات',
-            'profile': '👤 الملف الشخصي',
-            'language': '🌐 اللغة',
-            'help': '❓ المساعدة',
-            'points_balance': 'رصيد النقاط: {} نقطة',
-            'level_status': 'المستوى: {}',
-            'registration_success': '✅ تم تسجيلك بنجاح!\nحصلت على 10 نقاط كمكافأة ترحيب.',
-            'choose_language': 'اختر لغتك المفضلة:',
-            'language_changed': '✅ تم تغيير اللغة بنجاح!',
-            'arabic': '🇸🇦 العربية',
-            'english': '🇺🇸 English',
-            'under_development': '🚧 قيد التطوير\n\nسيتم إضافة هذه الميزة قريباً!'
-        },
-        'en': {
-            'welcome': '🔐 Welcome to CyberBot AI!\n\nAdvanced cybersecurity educational bot powered by AI.\n\nChoose what you want to do:',
-            'main_menu': '🏠 Main Menu',
-            'lessons': '📚 Educational Lessons',
-            'news': '📰 Daily News',
-            'points': '⭐ Points & Rewards',
-            'shop': '🛒 Shop',
-            'ai_chat': '🤖 AI Chat',
-            'settings': '⚙️ Settings',
-            'profile': '👤 Profile',
-            'language': '🌐 Language',
-            'help': '❓ Help',
-            'points_balance': 'Points Balance: {} points',
-            'level_status': 'Level: {}',
-            'registration_success': '✅ Registration successful!\nYou received 10 points as welcome bonus.',
-            'choose_language': 'Choose your preferred language:',
-            'language_changed': '✅ Language changed successfully!',
-            'arabic': '🇸🇦 العربية',
-            'english': '🇺🇸 English',
-            'under_development': '🚧 Under Development\n\nThis feature will be added soon!'
-        }
-    }
-    
-    return texts.get(lang, texts['ar']).get(key, key)
+    return catalog.get_text(db.get_user_language(user_id), 'bot', key)
+
+# دالة للحصول على النص بعد ملء حقوله
+def format_text(user_id, key, *args):
+    return catalog.format(db.get_user_language(user_id), 'bot', key, *args)
 
 # دالة لإنشاء القائمة الرئيسية
 def create_main_menu(user_id):
@@ -135,15 +92,15 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             await query.edit_message_text(text, reply_markup=reply_markup)
         
         elif data == 'profile':
-            user_info = db.get_user_info(user_id)
-            if user_info:
-                points = user_info[5]
-                level = user_info[6]
-                lessons_completed = user_info[10] if len(user_info) > 10 else 0
+            profile = db.get_user_profile(user_id)
+            if profile:
+                points = profile.points
+                level = profile.level
+                lessons_completed = profile.total_lessons_completed
                 
                 text = f"👤 {get_text(user_id, 'profile')}\n\n"
-                text += f"{get_text(user_id, 'points_balance').format(points)}\n"
-                text += f"{get_text(user_id, 'level_status').format(level)}\n"
+                text += f"{format_text(user_id, 'points_balance', points)}\n"
+                text += f"{format_text(user_id, 'level_status', level)}\n"
                 text += f"📚 الدروس المكتملة: {lessons_completed}"
                 
                 keyboard = [[InlineKeyboardButton(get_text(user_id, 'main_menu'), callback_data='main_menu')]]
@@ -251,7 +208,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                         # إكمال الدرس ومنح النقاط
                         completed, points_earned = lessons_manager.complete_lesson(user_id, lesson_id, score)
                         
-                        result_text = lessons_manager.get_text(user_id, 'quiz_completed').format(score, total, points_earned)
+                        result_text = lessons_manager.format_text(user_id, 'quiz_completed', score, total, points_earned)
                         
                         keyboard = [
                             [InlineKeyboardButton(lessons_manager.get_text(user_id, 'back_to_lessons'), 
@@ -0,0 +1,329 @@
+import asyncio
+import json
+import os
+import time
+import logging
+from datetime import datetime
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+from async_database import async_db
+from notification_planner import delivery_planner
+
+logger = logging.getLogger(__name__)
+
+# نتائج إرسال رسالة واحدة
+SENT = 'sent'
+BLOCKED = 'blocked'
+FAILED = 'failed'
+# خطأ مؤقت (شبكة أو مهلة) استمر بعد كل المحاولات؛ يمكن إعادة المحاولة لاحقاً
+RETRY = 'retry'
+
+class TokenBucket:
+    """محدد معدل عام: rate رسالة في الثانية مع سماح بدفعة حتى capacity
+
+    عند RetryAfter يتوقف الإرسال وينخفض المعدل، ثم يعود تدريجياً إلى max_rate مع كل إرسال ناجح
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """إيقاف الإرسال مؤقتاً للجميع وتخفيض المعدل (عند RetryAfter من تيليجرام)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+        self.rate = max(1.0, self.rate * 0.75)
+
+    def recover(self):
+        """رفع المعدل تدريجياً بعد إرسال ناجح"""
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + 0.05)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class BroadcastEngine:
+    """إرسال جماعي متوازٍ ضمن حدود تيليجرام مع حفظ التقدم لاستئنافه
+
+    - محدد معدل عام (~30 رسالة/ثانية) وفاصل أدنى بين رسالتين لنفس المحادثة
+    - عدة مرسلين متوازين؛ المستلمون يُقرؤون من جدول users على صفحات مرتبة بـ user_id
+    - بعد كل دفعة من checkpoint_size مستلماً يُحفظ آخر user_id مكتمل في جدول broadcasts، فيُستأنف البث منه
+      بعد إعادة التشغيل ولا يُعاد الإرسال إلا لدفعة واحدة على الأكثر
+    - RetryAfter يوقف الإرسال للجميع ثم تُعاد المحاولة، والمستخدم الذي حظر البوت يُلغى اشتراكه
+    - من يقع البث ضمن ساعات هدوئه يُضاف لطابور الإشعارات بموعد نهايتها بدلاً من الإرسال الآن،
+      ومن استمر معه خطأ مؤقت (RETRY) يُضاف للطابور بعد retry_delay ثانية ليتولى إعادة المحاولة
+    """
+
+    def __init__(self, async_database, planner, rate=30, per_chat_interval=1.0, concurrency=16,
+                 page_size=500, checkpoint_size=50, max_attempts=3, retry_delay=60):
+        self.async_db = async_database
+        self.planner = planner
+        self.bot = None
+        # يُستدعى بعد إضافة رسائل مؤجلة إلى طابور الإشعارات (لتنبيه عامل الطابور)
+        self.on_deferred = None
+        self.bucket = TokenBucket(rate)
+        self.per_chat_interval = per_chat_interval
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.checkpoint_size = checkpoint_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+        self._chat_next = {}
+        self._running = {}
+
+        self.counters = {SENT: 0, BLOCKED: 0, FAILED: 0, RETRY: 0, 'retry_after': 0}
+
+    async def _wait_for_chat(self, chat_id):
+        """الالتزام بحد الرسائل لكل محادثة"""
+        now = time.monotonic()
+        ready_at = self._chat_next.get(chat_id, 0.0)
+        self._chat_next[chat_id] = max(now, ready_at) + self.per_chat_interval
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+        if len(self._chat_next) > 10000:
+            self._chat_next = {chat: at for chat, at in self._chat_next.items() if at > now}
+
+    async def send(self, chat_id, text, parse_mode=None, max_attempts=None):
+        """إرسال رسالة واحدة مع احترام الحدود؛ يعيد SENT أو BLOCKED أو FAILED أو RETRY"""
+        if self.bot is None:
+            raise RuntimeError("Broadcast engine has no bot")
+
+        max_attempts = max_attempts or self.max_attempts
+        for attempt in range(1, max_attempts + 1):
+            await self._wait_for_chat(chat_id)
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+                self.bucket.recover()
+                self.counters[SENT] += 1
+                return SENT
+            except RetryAfter as e:
+                # تجاوز الحد العام: إيقاف جميع المرسلين ثم إعادة المحاولة
+                self.counters['retry_after'] += 1
+                retry_after = getattr(e.retry_after, 'total_seconds', lambda: e.retry_after)()
+                self.bucket.pause(retry_after)
+                logger.warning(f"Flood limit reached, pausing broadcasts for {retry_after}s")
+            except Forbidden:
+                self.counters[BLOCKED] += 1
+                return BLOCKED
+            except BadRequest as e:
+                if 'chat not found' in str(e).lower():
+                    self.counters[BLOCKED] += 1
+                    return BLOCKED
+                logger.error(f"Failed to send message to {chat_id}: {e}")
+                self.counters[FAILED] += 1
+                return FAILED
+            except (TimedOut, NetworkError) as e:
+                if attempt < max_attempts:
+                    await asyncio.sleep(2 ** attempt)
+                    continue
+                logger.error(f"Failed to send message to {chat_id}: {e}")
+                break
+
+        self.counters[RETRY] += 1
+        return RETRY
+
+    @staticmethod
+    def pick_message(messages, language):
+        """نص الرسالة بلغة المستخدم أو النص الافتراضي"""
+        return messages.get(language) or messages.get('default') or next(iter(messages.values()))
+
+    @staticmethod
+    def _audience_clause(audience):
+        """شرط SQL على جدول المستخدمين (u) لاختيار المستلمين حسب المعايير"""
+        conditions = ['1']
+        params = []
+        if audience.get('newsletter'):
+            conditions.append('u.newsletter_subscribed = TRUE')
+        if audience.get('level'):
+            conditions.append('u.level = ?')
+            params.append(audience['level'])
+        if audience.get('is_vip') is not None:
+            conditions.append('u.is_vip = ?')
+            params.append(audience['is_vip'])
+        if audience.get('min_points'):
+            conditions.append('u.points >= ?')
+            params.append(audience['min_points'])
+        if audience.get('language'):
+            conditions.append('u.language = ?')
+            params.append(audience['language'])
+        return ' AND '.join(conditions), params
+
+    def _next_page(self, audience, after_user_id):
+        """الصفحة التالية من المستلمين مع موعد التأجيل لمن هم في ساعات الهدوء"""
+        where, params = self._audience_clause(audience)
+        with self.async_db.db.connection() as conn:
+            sql, sql_params = self.planner.recipients_query(
+                conn, time.time(), audience.get('notification_type'), where, params,
+                after_user_id=after_user_id, limit=self.page_size
+            )
+            return conn.execute(sql, sql_params).fetchall()
+
+    def add_broadcast(self, kind, messages, audience=None, parse_mode=None, scheduled_at=None):
+        """تسجيل بث جديد (سجل واحد مهما كان عدد المستلمين)؛ messages نص واحد أو قاموس {اللغة: النص}"""
+        if isinstance(messages, str):
+            messages = {'default': messages}
+        with self.async_db.db.transaction() as conn:
+            return conn.execute('''
+                INSERT INTO broadcasts (kind, messages, audience, parse_mode, status, created_at, scheduled_at)
+                VALUES (?, ?, ?, ?, 'pending', ?, ?)
+            ''', (kind, json.dumps(messages, ensure_ascii=False), json.dumps(audience or {}),
+                  parse_mode, time.time(), scheduled_at)).lastrowid
+
+    async def create_broadcast(self, kind, messages, audience=None, parse_mode=None, scheduled_at=None):
+        return await self.async_db.run(self.add_broadcast, kind, messages, audience, parse_mode, scheduled_at)
+
+    async def run(self, broadcast_id):
+        """تنفيذ البث (أو استئنافه من آخر نقطة محفوظة)؛ يعيد عدادات البث"""
+        if broadcast_id in self._running:
+            return await asyncio.shield(self._running[broadcast_id])
+        task = asyncio.ensure_future(self._run(broadcast_id))
+        self._running[broadcast_id] = task
+        try:
+            return await task
+        finally:
+            self._running.pop(broadcast_id, None)
+
+    async def _run(self, broadcast_id):
+        if self.bot is None:
+            logger.warning(f"Broadcast {broadcast_id} postponed: bot is not set")
+            return None
+        broadcast = await self.async_db.fetchone('SELECT * FROM broadcasts WHERE id = ?', (broadcast_id,))
+        if broadcast is None or broadcast['status'] in ('completed', 'cancelled'):
+            return None
+
+        messages = json.loads(broadcast['messages'])
+        audience = json.loads(broadcast['audience'])
+        totals = {SENT: broadcast['sent'], BLOCKED: broadcast['blocked'], FAILED: broadcast['failed'],
+                  'deferred': broadcast['deferred']}
+        last_user_id = broadcast['last_user_id']
+        started = time.time()
+
+        await self.async_db.execute('''
+            UPDATE broadcasts SET status = 'running', started_at = COALESCE(started_at, ?) WHERE id = ?
+        ''', (started, broadcast_id))
+        logger.info(f"Broadcast {broadcast_id} ({broadcast['kind']}) started after user {last_user_id}")
+
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        results = {}
+
+        async def sender():
+            while True:
+                user_id, language = await queue.get()
+                try:
+                    text = self.pick_message(messages, language)
+                    results[user_id] = await self.send(user_id, text, broadcast['parse_mode'])
+                except Exception as e:
+                    logger.error(f"Broadcast {broadcast_id} failed for {user_id}: {e}")
+                    results[user_id] = FAILED
+                finally:
+                    queue.task_done()
+
+        senders = [asyncio.create_task(sender()) for _ in range(self.concurrency)]
+        try:
+            while True:
+                page = await self.async_db.run(self._next_page, audience, last_user_id)
+                if not page:
+                    break
+
+                for start in range(0, len(page), self.checkpoint_size):
+                    chunk = page[start:start + self.checkpoint_size]
+                    results.clear()
+                    deferred = []
+                    for row in chunk:
+                        if row['defer_until'] is not None:
+                            deferred.append((row['user_id'], row['defer_until']))
+                        else:
+                            await queue.put((row['user_id'], row['language']))
+                    await queue.join()
+
+                    blocked = [(user_id,) for user_id, outcome in results.items() if outcome == BLOCKED]
+                    retry_at = time.time() + self.retry_delay
+                    for user_id, outcome in results.items():
+                        if outcome == RETRY:
+                            deferred.append((user_id, retry_at))
+                        else:
+                            totals[outcome] += 1
+                    totals['deferred'] += len(deferred)
+                    last_user_id = chunk[-1]['user_id']
+                    await self._checkpoint(broadcast, last_user_id, totals, blocked, deferred)
+                    if deferred and self.on_deferred:
+                        self.on_deferred()
+        finally:
+            for task in senders:
+                task.cancel()
+            await asyncio.gather(*senders, return_exceptions=True)
+
+        await self.async_db.execute('''
+            UPDATE broadcasts SET status = 'completed', finished_at = ? WHERE id = ?
+        ''', (time.time(), broadcast_id))
+        elapsed = time.time() - started
+        logger.info(f"Broadcast {broadcast_id} completed in {elapsed:.1f}s: {totals}")
+        return totals
+
+    async def _checkpoint(self, broadcast, last_user_id, totals, blocked, deferred):
+        """حفظ التقدم، وإلغاء اشتراك من حظر البوت، وإضافة المؤجلين ومن تُعاد محاولتهم للطابور في معاملة واحدة"""
+        notification_type = json.loads(broadcast['audience']).get('notification_type') or broadcast['kind']
+        def _save():
+            with self.async_db.db.transaction() as conn:
+                if blocked:
+                    conn.executemany('''
+                        UPDATE users SET blocked_at = CURRENT_TIMESTAMP, newsletter_subscribed = FALSE
+                        WHERE user_id = ?
+                    ''', blocked)
+                if deferred:
+                    # نص الرسالة يُقرأ من سجل البث عند الإرسال
+                    conn.executemany('''
+                        INSERT INTO notifications (user_id, title, message, notification_type, scheduled_time,
+                                                   available_at, broadcast_id)
+                        VALUES (?, '', '', ?, ?, ?, ?)
+                    ''', [(user_id, notification_type, datetime.fromtimestamp(defer_until), defer_until, broadcast['id'])
+                          for user_id, defer_until in deferred])
+                conn.execute('''
+                    UPDATE broadcasts SET last_user_id = ?, sent = ?, blocked = ?, failed = ?, deferred = ? WHERE id = ?
+                ''', (last_user_id, totals[SENT], totals[BLOCKED], totals[FAILED], totals['deferred'], broadcast['id']))
+        await self.async_db.run(_save)
+
+    async def run_due(self):
+        """بدء البث المجدول الذي حان موعده"""
+        rows = await self.async_db.fetchall('''
+            SELECT id FROM broadcasts
+            WHERE status = 'pending' AND (scheduled_at IS NULL OR scheduled_at <= ?)
+            ORDER BY id
+        ''', (time.time(),))
+        return [asyncio.create_task(self.run(row['id'])) for row in rows if row['id'] not in self._running]
+
+    async def resume_unfinished(self):
+        """استئناف البث الذي توقف بسبب إيقاف البوت"""
+        rows = await self.async_db.fetchall("SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id")
+        return [asyncio.create_task(self.run(row['id'])) for row in rows]
+
+    def stats(self):
+        return dict(self.counters, rate=round(self.bucket.rate, 2), active_broadcasts=len(self._running))
+
+# محرك الإرسال الجماعي المشترك (يُربط بالبوت عند تشغيل التطبيق)
+broadcast_engine = BroadcastEngine(
+    async_db,
+    delivery_planner,
+    rate=float(os.getenv('BROADCAST_RATE', 30)),
+    per_chat_interval=float(os.getenv('BROADCAST_PER_CHAT_INTERVAL', 1.0)),
+    concurrency=int(os.getenv('BROADCAST_CONCURRENCY', 16))
+)
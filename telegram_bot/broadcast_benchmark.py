@@ -0,0 +1,142 @@
+"""قياس أداء البث الجماعي مقابل خادم Bot API وهمي محلي
+
+يشغّل خادماً يحاكي sendMessage (مع رفض 429 عند تجاوز الحد، و403 لنسبة من المستخدمين)،
+وينشئ قاعدة بيانات مؤقتة بعدد المستخدمين المطلوب ثم يبث إليهم عبر BroadcastEngine.
+
+    python broadcast_benchmark.py --users 3000 --rate 30 --server-limit 30
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+from database import DatabaseManager
+from async_database import AsyncDatabaseManager
+from broadcast import BroadcastEngine
+from notification_planner import delivery_planner
+
+class FakeBotAPI(BaseHTTPRequestHandler):
+    """خادم يحاكي الحد العام لتيليجرام وحظر بعض المستخدمين للبوت"""
+
+    limit = 30
+    blocked_every = 50
+    latency = 0.05
+    _window = deque()
+    _lock = threading.Lock()
+    stats = {'ok': 0, '429': 0, '403': 0}
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _params(self):
+        raw = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0)).decode()
+        if 'json' in self.headers.get('Content-Type', ''):
+            return json.loads(raw or '{}')
+        return {key: values[0] for key, values in parse_qs(raw).items()}
+
+    def do_POST(self):
+        method = self.path.rsplit('/', 1)[-1]
+        params = self._params()
+        if method == 'getMe':
+            return self._reply(200, {'ok': True, 'result': {
+                'id': 1, 'is_bot': True, 'first_name': 'Benchmark', 'username': 'benchmark_bot'
+            }})
+
+        time.sleep(self.latency)
+        chat_id = int(params.get('chat_id', 0))
+        with self._lock:
+            now = time.monotonic()
+            while self._window and self._window[0] < now - 1:
+                self._window.popleft()
+            limited = len(self._window) >= self.limit
+            if not limited:
+                self._window.append(now)
+
+        if limited:
+            self.stats['429'] += 1
+            return self._reply(429, {'ok': False, 'error_code': 429,
+                                     'description': 'Too Many Requests: retry after 1',
+                                     'parameters': {'retry_after': 1}})
+        if self.blocked_every and chat_id % self.blocked_every == 0:
+            self.stats['403'] += 1
+            return self._reply(403, {'ok': False, 'error_code': 403,
+                                     'description': 'Forbidden: bot was blocked by the user'})
+
+        self.stats['ok'] += 1
+        self._reply(200, {'ok': True, 'result': {
+            'message_id': self.stats['ok'], 'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', '')
+        }})
+
+    do_GET = do_POST
+
+async def benchmark(args):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBotAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}/bot'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = DatabaseManager(os.path.join(tmp, 'benchmark.db'))
+        with database.transaction() as conn:
+            conn.executemany(
+                'INSERT INTO users (user_id, username, language) VALUES (?, ?, ?)',
+                [(user_id, f'user{user_id}', 'ar' if user_id % 3 else 'en') for user_id in range(1, args.users + 1)]
+            )
+
+        engine = BroadcastEngine(AsyncDatabaseManager(database), delivery_planner, rate=args.rate,
+                                 concurrency=args.concurrency, page_size=args.page_size,
+                                 checkpoint_size=args.checkpoint_size)
+        request = HTTPXRequest(connection_pool_size=args.concurrency)
+        async with Bot('123:benchmark', base_url=base_url, request=request) as bot:
+            engine.bot = bot
+            broadcast_id = await engine.create_broadcast('benchmark', {'ar': 'رسالة تجريبية', 'en': 'Benchmark message'})
+            started = time.monotonic()
+            totals = await engine.run(broadcast_id)
+            elapsed = time.monotonic() - started
+
+        with database.connection() as conn:
+            blocked_users = conn.execute('SELECT COUNT(*) FROM users WHERE blocked_at IS NOT NULL').fetchone()[0]
+        database.close()
+    server.shutdown()
+
+    print(f"users={args.users} rate={args.rate}/s concurrency={args.concurrency}")
+    print(f"elapsed={elapsed:.1f}s throughput={(totals['sent'] + totals['blocked'] + totals['failed']) / elapsed:.1f} msg/s")
+    print(f"results={totals} blocked_users={blocked_users}")
+    print(f"server={FakeBotAPI.stats} engine={engine.stats()}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Broadcast engine benchmark against a fake Bot API')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=30)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--checkpoint-size', type=int, default=50)
+    parser.add_argument('--server-limit', type=int, default=30, help='messages per second before the server answers 429')
+    parser.add_argument('--latency', type=float, default=0.05, help='simulated API latency in seconds')
+    parser.add_argument('--blocked-every', type=int, default=50, help='every Nth user has blocked the bot (0 to disable)')
+    args = parser.parse_args()
+
+    FakeBotAPI.limit = args.server_limit
+    FakeBotAPI.latency = args.latency
+    FakeBotAPI.blocked_every = args.blocked_every
+    asyncio.run(benchmark(args))
+
+if __name__ == '__main__':
+    main()
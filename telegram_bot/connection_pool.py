@@ -0,0 +1,162 @@
+import sqlite3
+import threading
+import queue
+from contextlib import contextmanager
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ConnectionPool:
+    """مجمّع اتصالات SQLite: اتصالات قراءة محدودة العدد واتصال كتابة واحد متسلسل"""
+
+    def __init__(self, db_path, max_readers=8, cache_size_kb=16384, mmap_size=256 * 1024 * 1024,
+                 busy_timeout_ms=5000, acquire_timeout=30):
+        self.db_path = db_path
+        self.max_readers = max_readers
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.busy_timeout_ms = busy_timeout_ms
+        self.acquire_timeout = acquire_timeout
+
+        # اتصالات القراءة الخاملة، وعدد الخانات المتاحة يحدّ إجمالي اتصالات القراءة
+        self._idle_readers = queue.LifoQueue()
+        self._reader_slots = threading.BoundedSemaphore(max_readers)
+
+        # اتصال الكتابة الوحيد ومعاملاته متسلسلة عبر القفل
+        self._writer = None
+        self._writer_lock = threading.RLock()
+
+        # حالة كل خيط: اتصال القراءة الحالي وعمق معاملة الكتابة
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def configure(self, conn, readonly=False):
+        """تطبيق إعدادات الأداء على الاتصال مرة واحدة عند إنشائه"""
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{int(self.cache_size_kb)}')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout_ms)}')
+        if readonly:
+            conn.execute('PRAGMA query_only=ON')
+        return conn
+
+    def connect(self, readonly=False, autocommit=False):
+        """إنشاء اتصال جديد مُعدّ مسبقاً"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            isolation_level=None if autocommit else ''
+        )
+        return self.configure(conn, readonly=readonly)
+
+    def _get_writer(self):
+        """الحصول على اتصال الكتابة وإنشاؤه مع تفعيل WAL عند أول استخدام"""
+        if self._writer is None:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Connection pool is closed")
+            conn = self.connect(autocommit=True)
+            mode = conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+            if str(mode).lower() != 'wal':
+                logger.warning(f"WAL journal mode not available for {self.db_path}, using {mode}")
+            self._writer = conn
+        return self._writer
+
+    def _acquire_reader(self):
+        if not self._reader_slots.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError("Timed out waiting for a database reader connection")
+        try:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Connection pool is closed")
+            try:
+                return self._idle_readers.get_nowait()
+            except queue.Empty:
+                # التأكد من تفعيل WAL قبل فتح أول اتصال قراءة
+                with self._writer_lock:
+                    self._get_writer()
+                return self.connect(readonly=True, autocommit=True)
+        except BaseException:
+            self._reader_slots.release()
+            raise
+
+    def _release_reader(self, conn):
+        try:
+            if self._closed:
+                conn.close()
+            else:
+                self._idle_readers.put(conn)
+        finally:
+            self._reader_slots.release()
+
+    @contextmanager
+    def reader(self):
+        """اتصال قراءة من المجمّع، يُعاد استخدامه داخل نفس الخيط عند التداخل"""
+        # داخل معاملة كتابة في نفس الخيط نقرأ من اتصال الكتابة لرؤية التغييرات غير المؤكدة
+        if getattr(self._local, 'writer_depth', 0):
+            yield self._writer
+            return
+
+        conn = getattr(self._local, 'reader', None)
+        if conn is not None:
+            yield conn
+            return
+
+        conn = self._acquire_reader()
+        self._local.reader = conn
+        try:
+            yield conn
+        finally:
+            self._local.reader = None
+            self._release_reader(conn)
+
+    @contextmanager
+    def transaction(self):
+        """معاملة كتابة متسلسلة؛ المعاملات المتداخلة تستخدم SAVEPOINT"""
+        with self._writer_lock:
+            conn = self._get_writer()
+            depth = getattr(self._local, 'writer_depth', 0)
+
+            if depth:
+                savepoint = f'sp_{depth}'
+                conn.execute(f'SAVEPOINT {savepoint}')
+                self._local.writer_depth = depth + 1
+                try:
+                    yield conn
+                except BaseException:
+                    conn.execute(f'ROLLBACK TO {savepoint}')
+                    conn.execute(f'RELEASE {savepoint}')
+                    raise
+                else:
+                    conn.execute(f'RELEASE {savepoint}')
+                finally:
+                    self._local.writer_depth = depth
+                return
+
+            conn.execute('BEGIN IMMEDIATE')
+            self._local.writer_depth = 1
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+            finally:
+                self._local.writer_depth = 0
+
+    def close(self):
+        """إغلاق جميع الاتصالات"""
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle_readers.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
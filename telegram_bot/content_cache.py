@@ -0,0 +1,88 @@
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+import logging
+
+logger = logging.getLogger(__name__)
+
+_SPACES = re.compile(r'\s+')
+
+def content_hash(kind, language, prompt_version, text):
+    """مفتاح ثابت للنص بعد توحيد المسافات وحالة الأحرف، مع نوع المعالجة واللغة وإصدار الطلب"""
+    normalized = _SPACES.sub(' ', unicodedata.normalize('NFKC', text)).strip().lower()
+    digest = hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+    return f'{kind}:{language}:v{prompt_version}:{digest}'
+
+class ContentCache:
+    """ذاكرة دائمة لنتائج التلخيص والترجمة مفهرسة ببصمة المحتوى
+
+    الحجم الإجمالي للنتائج محدود بـ max_bytes، وعند تجاوزه تُحذف الأقدم استخداماً.
+    """
+
+    def __init__(self, database, max_bytes=50 * 1024 * 1024):
+        self.db = database
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind, language, prompt_version, text):
+        key = content_hash(kind, language, prompt_version, text)
+        with self.db.connection() as conn:
+            row = conn.execute('SELECT result FROM ai_content_cache WHERE cache_key = ?', (key,)).fetchone()
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        with self.db.transaction() as conn:
+            conn.execute('UPDATE ai_content_cache SET last_used_at = ? WHERE cache_key = ?', (time.time(), key))
+        return row['result']
+
+    def put(self, kind, language, prompt_version, text, result):
+        key = content_hash(kind, language, prompt_version, text)
+        size = len(result.encode('utf-8'))
+        now = time.time()
+
+        with self.db.transaction() as conn:
+            previous = conn.execute('SELECT size FROM ai_content_cache WHERE cache_key = ?', (key,)).fetchone()
+            conn.execute('''
+                INSERT INTO ai_content_cache (cache_key, kind, language, prompt_version, result, size, created_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (cache_key) DO UPDATE SET
+                    result = excluded.result,
+                    size = excluded.size,
+                    last_used_at = excluded.last_used_at
+            ''', (key, kind, language, prompt_version, result, size, now, now))
+
+            with self._lock:
+                if self._total_bytes is None:
+                    self._total_bytes = conn.execute('SELECT COALESCE(SUM(size), 0) FROM ai_content_cache').fetchone()[0]
+                else:
+                    self._total_bytes += size - (previous['size'] if previous else 0)
+
+                if self._total_bytes > self.max_bytes:
+                    self._evict(conn)
+
+    def _evict(self, conn):
+        """حذف الأقدم استخداماً حتى يعود الحجم إلى 90% من الحد"""
+        target = self.max_bytes * 0.9
+        rows = conn.execute('SELECT cache_key, size FROM ai_content_cache ORDER BY last_used_at').fetchall()
+        evicted = []
+        for row in rows:
+            if self._total_bytes <= target:
+                break
+            evicted.append((row['cache_key'],))
+            self._total_bytes -= row['size']
+        conn.executemany('DELETE FROM ai_content_cache WHERE cache_key = ?', evicted)
+        logger.info(f"Evicted {len(evicted)} cached summaries/translations")
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'total_bytes': self._total_bytes}
@@ -0,0 +1,270 @@
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import date, datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+ROLES = ('user', 'assistant')
+_ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+
+# تكلفة تقريبية لكل رسالة في الذاكرة إضافة إلى حجم النص (tuple + float + int)
+_MESSAGE_OVERHEAD = 96
+
+class _Conversation:
+    """محادثة مستخدم في الذاكرة: الرسائل بصيغة (role_code, content, timestamp) مع عدادات الاستخدام"""
+
+    __slots__ = ('messages', 'size', 'total_questions', 'usage_date', 'today_questions')
+
+    def __init__(self, max_messages):
+        self.messages = deque(maxlen=max_messages)
+        self.size = 0
+        self.total_questions = 0
+        self.usage_date = None
+        self.today_questions = 0
+
+    def append(self, message):
+        if len(self.messages) == self.messages.maxlen:
+            self.size -= _message_size(self.messages[0])
+        self.messages.append(message)
+        self.size += _message_size(message)
+
+def _message_size(message):
+    return _MESSAGE_OVERHEAD + sys.getsizeof(message[1])
+
+class ConversationStore:
+    """مخزن محادثات الذكاء الاصطناعي بميزانية ذاكرة عامة وحفظ مؤجل في SQLite
+
+    المستخدمون الخاملون يُزالون من الذاكرة حسب LRU عند تجاوز الميزانية، ويُعاد
+    تحميل محادثاتهم من جدول ai_conversations عند أول وصول لاحق.
+    """
+
+    def __init__(self, database, memory_budget=64 * 1024 * 1024, max_messages=20,
+                 flush_interval=5.0, flush_batch_size=500):
+        self.db = database
+        self.memory_budget = memory_budget
+        self.max_messages = max_messages
+        self.flush_interval = flush_interval
+        self.flush_batch_size = flush_batch_size
+
+        self._conversations = OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.RLock()
+
+        # العمليات المنتظرة للحفظ بترتيب حدوثها، والمستخدمون الذين تغيرت عداداتهم
+        self._pending = []
+        self._dirty_usage = {}
+        self._flush_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._closed = threading.Event()
+        self._flusher = None
+
+        self.loads = 0
+        self.evictions = 0
+
+    def start(self):
+        """تشغيل خيط الحفظ المؤجل"""
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name='conversation-flush', daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._closed.is_set():
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing conversations: {e}")
+
+    def _load(self, user_id):
+        """إعادة تحميل محادثة مستخدم من قاعدة البيانات"""
+        # حفظ العمليات المنتظرة أولاً حتى تتضمن القراءة آخر الرسائل
+        self.flush()
+        with self.db.connection() as conn:
+            rows = conn.execute('''
+                SELECT role, content, created_at FROM ai_conversations
+                WHERE user_id = ?
+                ORDER BY id DESC
+                LIMIT ?
+            ''', (user_id, self.max_messages)).fetchall()
+            usage = conn.execute('''
+                SELECT total_questions, usage_date, today_questions FROM ai_chat_usage WHERE user_id = ?
+            ''', (user_id,)).fetchone()
+
+        conversation = _Conversation(self.max_messages)
+        for row in reversed(rows):
+            conversation.append((_ROLE_CODES[row['role']], row['content'], row['created_at']))
+        if usage:
+            conversation.total_questions = usage['total_questions']
+            conversation.usage_date = usage['usage_date']
+            conversation.today_questions = usage['today_questions']
+        self.loads += 1
+        return conversation
+
+    def _get(self, user_id):
+        """المحادثة من الذاكرة، أو تحميلها من القاعدة عند الحاجة"""
+        with self._lock:
+            conversation = self._conversations.get(user_id)
+            if conversation is not None:
+                self._conversations.move_to_end(user_id)
+                return conversation
+
+        # القراءة من القاعدة تتم خارج القفل حتى لا تتعطل المحادثات الأخرى
+        loaded = self._load(user_id)
+        with self._lock:
+            conversation = self._conversations.get(user_id)
+            if conversation is None:
+                conversation = loaded
+                self._conversations[user_id] = conversation
+                self._memory_used += conversation.size
+                self._evict()
+            return conversation
+
+    def _evict(self):
+        """إزالة المستخدمين الأقل استخداماً حتى العودة ضمن ميزانية الذاكرة"""
+        while self._memory_used > self.memory_budget and len(self._conversations) > 1:
+            user_id, conversation = self._conversations.popitem(last=False)
+            self._memory_used -= conversation.size
+            self.evictions += 1
+
+    def get_history(self, user_id, limit=None):
+        """آخر الرسائل بصيغة (role, content, datetime)"""
+        conversation = self._get(user_id)
+        with self._lock:
+            messages = list(conversation.messages)
+        if limit is not None:
+            messages = messages[-limit:]
+        return [(ROLES[code], content, datetime.fromtimestamp(ts)) for code, content, ts in messages]
+
+    def add(self, user_id, role, content):
+        """إضافة رسالة للمحادثة وجدولة حفظها"""
+        now = time.time()
+        message = (_ROLE_CODES[role], content, now)
+        conversation = self._get(user_id)
+        with self._lock:
+            before = conversation.size
+            conversation.append(message)
+            if self._conversations.get(user_id) is conversation:
+                self._memory_used += conversation.size - before
+
+            if role == 'user':
+                today = date.today().isoformat()
+                if conversation.usage_date != today:
+                    conversation.usage_date = today
+                    conversation.today_questions = 0
+                conversation.total_questions += 1
+                conversation.today_questions += 1
+                # لقطة من العدادات تُحفظ حتى لو أُزيل المستخدم من الذاكرة قبل الحفظ
+                self._dirty_usage[user_id] = (user_id, conversation.total_questions,
+                                              conversation.usage_date, conversation.today_questions)
+
+            self._pending.append(('add', user_id, role, content, now))
+            self._evict()
+            pending = len(self._pending)
+
+        if pending >= self.flush_batch_size:
+            self._flush_event.set()
+
+    def clear(self, user_id):
+        """مسح رسائل المستخدم (عدادات الاستخدام تبقى)"""
+        with self._lock:
+            conversation = self._conversations.get(user_id)
+            if conversation is not None:
+                self._memory_used -= conversation.size
+                conversation.messages.clear()
+                conversation.size = 0
+            self._pending.append(('clear', user_id))
+
+    def usage(self, user_id):
+        """عدادات أسئلة المستخدم الإجمالية واليومية"""
+        conversation = self._get(user_id)
+        with self._lock:
+            today = date.today().isoformat()
+            return {
+                'total_questions': conversation.total_questions,
+                'today_questions': conversation.today_questions if conversation.usage_date == today else 0
+            }
+
+    def flush(self):
+        """حفظ العمليات المنتظرة في معاملة واحدة"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+                usage = list(self._dirty_usage.values())
+                self._dirty_usage.clear()
+
+            if not pending and not usage:
+                return 0
+
+            try:
+                touched = set()
+                with self.db.transaction() as conn:
+                    batch = []
+                    for op in pending:
+                        if op[0] == 'add':
+                            batch.append(op[1:])
+                            touched.add(op[1])
+                            continue
+                        # المسح يُطبق بعد حفظ الرسائل السابقة له بالترتيب
+                        if batch:
+                            self._insert(conn, batch)
+                            batch = []
+                        conn.execute('DELETE FROM ai_conversations WHERE user_id = ?', (op[1],))
+                    if batch:
+                        self._insert(conn, batch)
+
+                    # الاحتفاظ بآخر max_messages رسالة فقط لكل مستخدم
+                    conn.executemany('''
+                        DELETE FROM ai_conversations
+                        WHERE user_id = ? AND id <= (
+                            SELECT id FROM ai_conversations WHERE user_id = ?
+                            ORDER BY id DESC LIMIT 1 OFFSET ?
+                        )
+                    ''', [(user_id, user_id, self.max_messages) for user_id in touched])
+
+                    if usage:
+                        conn.executemany('''
+                            INSERT INTO ai_chat_usage (user_id, total_questions, usage_date, today_questions)
+                            VALUES (?, ?, ?, ?)
+                            ON CONFLICT (user_id) DO UPDATE SET
+                                total_questions = excluded.total_questions,
+                                usage_date = excluded.usage_date,
+                                today_questions = excluded.today_questions
+                        ''', usage)
+            except Exception:
+                # إعادة العمليات والعدادات للطابور (قبل ما أُضيف أثناء الحفظ) لتُحفظ في المحاولة التالية
+                with self._lock:
+                    self._pending[:0] = pending
+                    for snapshot in usage:
+                        self._dirty_usage.setdefault(snapshot[0], snapshot)
+                raise
+            return len(pending)
+
+    @staticmethod
+    def _insert(conn, batch):
+        conn.executemany('''
+            INSERT INTO ai_conversations (user_id, role, content, created_at) VALUES (?, ?, ?, ?)
+        ''', batch)
+
+    def close(self):
+        """إيقاف خيط الحفظ وحفظ ما تبقى"""
+        self._closed.set()
+        self._flush_event.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=self.flush_interval + 5)
+            self._flusher = None
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'users': len(self._conversations),
+                'memory_used': self._memory_used,
+                'memory_budget': self.memory_budget,
+                'pending_writes': len(self._pending),
+                'loads': self.loads,
+                'evictions': self.evictions
+            }
@@ -1,20 +1,72 @@
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timezone
+import os
 import random
 import string
+import logging
+from connection_pool import ConnectionPool
+from user_cache import UserProfile, UserProfileCache
+from notification_planner import DEFAULT_TYPE_MASK
+from migrations import run_migrations
+from points_ledger import APPLIED, LedgerEntry, PointsLedger, post_entries, spend_outcome
+from referrals import record_referral
+
+logger = logging.getLogger(__name__)
 
 class DatabaseManager:
     def __init__(self, db_path='cyberbot.db'):
         self.db_path = db_path
+        self.pool = ConnectionPool(
+            db_path,
+            max_readers=int(os.getenv('DB_POOL_SIZE', '8')),
+            cache_size_kb=int(os.getenv('DB_CACHE_SIZE_KB', '16384')),
+            mmap_size=int(os.getenv('DB_MMAP_SIZE', str(256 * 1024 * 1024)))
+        )
+        self.profiles = UserProfileCache(
+            max_size=int(os.getenv('USER_CACHE_SIZE', '10000')),
+            ttl=int(os.getenv('USER_CACHE_TTL', '300'))
+        )
+        # دوال تُستدعى بعد حفظ أي تغيير في النقاط: callback(user_id, points, lessons)
+        self.points_listeners = []
+        # دوال تُستدعى بعد حفظ أحداث المستخدم الأخرى ('referral_added' و 'daily_login'): callback(event, user_id)
+        self.event_listeners = []
+        # دفتر النقاط: كل تغيير في النقاط يمر عبره
+        self.ledger = PointsLedger(self)
         self.init_database()
     
     def get_connection(self):
-        return sqlite3.connect(self.db_path)
+        """اتصال مستقل للشيفرة القديمة - يفضَّل استخدام connection() و transaction()"""
+        return self.pool.connect()
+    
+    def connection(self):
+        """اتصال قراءة من المجمّع (context manager)"""
+        return self.pool.reader()
+    
+    def transaction(self):
+        """معاملة كتابة على اتصال الكتابة الوحيد (context manager)"""
+        return self.pool.transaction()
+    
+    def close(self):
+        """إغلاق مجمّع الاتصالات"""
+        self.pool.close()
+    
+    def backup(self, backup_path):
+        """نسخ احتياطي متسق (يشمل محتوى ملف WAL)"""
+        target = sqlite3.connect(backup_path)
+        try:
+            with self.connection() as conn:
+                conn.backup(target)
+        finally:
+            target.close()
     
     def init_database(self):
         """إنشاء جداول قاعدة البيانات"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            self._create_tables(cursor)
+            run_migrations(cursor)
+    
+    def _create_tables(self, cursor):
         
         # جدول المستخدمين
         cursor.execute('''
@@ -30,9 +82,16 @@ class DatabaseManager:
                 referral_code TEXT UNIQUE,
                 referred_by INTEGER,
                 is_vip BOOLEAN DEFAULT FALSE,
+                vip_expires TIMESTAMP,
+                last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 total_lessons_completed INTEGER DEFAULT 0,
                 streak_days INTEGER DEFAULT 0,
-                last_activity_date DATE
+                last_activity_date DATE,
+                newsletter_subscribed BOOLEAN DEFAULT TRUE,
+                blocked_at TIMESTAMP,
+                referral_count INTEGER DEFAULT 0,
+                referral_points INTEGER DEFAULT 0,
+                referral_network INTEGER DEFAULT 0
             )
         ''')
         
@@ -100,6 +159,7 @@ class DatabaseManager:
                 reason TEXT,
                 transaction_type TEXT CHECK (transaction_type IN ('earned', 'spent')),
                 date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                idempotency_key TEXT,
                 FOREIGN KEY (user_id) REFERENCES users (user_id)
             )
         ''')
@@ -117,6 +177,19 @@ class DatabaseManager:
             )
         ''')
         
+        # جدول إغلاق شجرة الإحالات: كل سلف للمستخدم مع عمقه (1 = المحيل المباشر)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS referral_tree (
+                ancestor_id INTEGER NOT NULL,
+                descendant_id INTEGER NOT NULL,
+                depth INTEGER NOT NULL,
+                PRIMARY KEY (ancestor_id, depth, descendant_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_referral_tree_descendant ON referral_tree (descendant_id, ancestor_id)
+        ''')
+        
         # جدول الأخبار
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS news (
@@ -129,10 +202,132 @@ class DatabaseManager:
                 category TEXT,
                 severity TEXT CHECK (severity IN ('low', 'medium', 'high', 'critical')),
                 published_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_featured BOOLEAN DEFAULT FALSE
+                is_featured BOOLEAN DEFAULT FALSE,
+                minhash BLOB,
+                cve_ids TEXT,
+                cluster_size INTEGER DEFAULT 1
             )
         ''')
         
+        # مصادر كل خبر (الخبر الواحد قد تنشره عدة مصادر)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS news_sources (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                news_id INTEGER NOT NULL,
+                source_name TEXT,
+                source_url TEXT NOT NULL UNIQUE,
+                published_date TIMESTAMP,
+                FOREIGN KEY (news_id) REFERENCES news (id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_news_sources_news ON news_sources (news_id)
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_news_published ON news (published_date)
+        ''')
+        
+        # حالة الجلب الشرطي لمصادر الأخبار (ETag / Last-Modified)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS feed_state (
+                source_name TEXT PRIMARY KEY,
+                feed_url TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                last_checked TIMESTAMP
+            )
+        ''')
+        
+        # حالة المهام المجدولة (آخر موعد نُفذ لمعالجة المواعيد الفائتة بعد إعادة التشغيل)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scheduled_jobs (
+                name TEXT PRIMARY KEY,
+                last_scheduled_at REAL,
+                last_started_at REAL,
+                last_finished_at REAL,
+                last_status TEXT,
+                last_error TEXT
+            )
+        ''')
+        
+        # البث الجماعي: آخر مستخدم اكتمل الإرسال إليه (لاستئناف البث) وعدادات النتائج
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                messages TEXT NOT NULL,
+                audience TEXT NOT NULL DEFAULT '{}',
+                parse_mode TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                last_user_id INTEGER NOT NULL DEFAULT 0,
+                sent INTEGER NOT NULL DEFAULT 0,
+                blocked INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                deferred INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                scheduled_at REAL,
+                started_at REAL,
+                finished_at REAL
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts (status, scheduled_at)
+        ''')
+        
+        # الإشعارات الفردية (الإشعار الجماعي يُخزن سجلاً واحداً في broadcasts، ويُضاف هنا لمن أُجّل بسبب ساعات الهدوء)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS notifications (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                title TEXT NOT NULL,
+                message TEXT NOT NULL,
+                notification_type TEXT DEFAULT 'general',
+                priority TEXT DEFAULT 'normal',
+                scheduled_time TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                sent BOOLEAN DEFAULT FALSE,
+                sent_at TIMESTAMP,
+                failed BOOLEAN DEFAULT FALSE,
+                error_message TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL,
+                leased_until REAL,
+                broadcast_id INTEGER,
+                FOREIGN KEY (user_id) REFERENCES users (user_id),
+                FOREIGN KEY (broadcast_id) REFERENCES broadcasts (id)
+            )
+        ''')
+        
+        # تفضيلات الإشعارات: بت لكل نوع مسموح، وساعات الهدوء بالدقائق منذ منتصف الليل بتوقيت المستخدم
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS user_notification_preferences (
+                user_id INTEGER PRIMARY KEY,
+                type_mask INTEGER NOT NULL DEFAULT {DEFAULT_TYPE_MASK},
+                quiet_hours_start INTEGER CHECK (quiet_hours_start BETWEEN 0 AND 1439),
+                quiet_hours_end INTEGER CHECK (quiet_hours_end BETWEEN 0 AND 1439),
+                timezone TEXT,
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        ''')
+        
+        # ذاكرة نتائج تلخيص وترجمة الأخبار (مفهرسة ببصمة المحتوى)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ai_content_cache (
+                cache_key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                language TEXT NOT NULL,
+                prompt_version INTEGER NOT NULL,
+                result TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_ai_content_cache_last_used ON ai_content_cache (last_used_at)
+        ''')
+        
         # جدول المتجر
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS shop_items (
@@ -153,7 +348,7 @@ class DatabaseManager:
         # جدول المشتريات
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS purchases (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                id TEXT PRIMARY KEY,
                 user_id INTEGER,
                 item_id INTEGER,
                 payment_method TEXT,
@@ -166,20 +361,109 @@ class DatabaseManager:
             )
         ''')
         
-        conn.commit()
-        conn.close()
+        # الإنجازات المفتوحة (تُمنح مرة واحدة لكل مستخدم)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_achievements (
+                user_id INTEGER NOT NULL,
+                achievement_id TEXT NOT NULL,
+                unlocked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, achievement_id),
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        ''')
+        
+        # أنشطة المستخدمين (للتحليلات)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_activities (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                activity_type TEXT,
+                details TEXT,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        ''')
+        
+        # تقارير التحليلات المحفوظة
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS analytics_reports (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                report_type TEXT,
+                period TEXT,
+                data TEXT,
+                generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # تجميعات النشاط لكل ساعة ويوم (انظر analytics_rollups)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS activity_rollups (
+                granularity TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                activity_type TEXT NOT NULL,
+                level TEXT NOT NULL,
+                events INTEGER DEFAULT 0,
+                users BLOB,
+                PRIMARY KEY (granularity, bucket, activity_type, level)
+            ) WITHOUT ROWID
+        ''')
+        
+        # الإيرادات اليومية لكل منتج
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS revenue_rollups (
+                day TEXT NOT NULL,
+                item_id INTEGER NOT NULL,
+                revenue REAL DEFAULT 0,
+                points INTEGER DEFAULT 0,
+                sales INTEGER DEFAULT 0,
+                PRIMARY KEY (day, item_id)
+            ) WITHOUT ROWID
+        ''')
+        
+        # ذاكرة إجابات الذكاء الاصطناعي المؤقتة
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ai_answer_cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                language TEXT NOT NULL,
+                level TEXT NOT NULL,
+                question_key TEXT NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                hits INTEGER DEFAULT 0,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL,
+                UNIQUE (language, level, question_key)
+            )
+        ''')
+        
+        # رسائل محادثات الذكاء الاصطناعي (آخر الرسائل لكل مستخدم)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ai_conversations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                role TEXT NOT NULL CHECK (role IN ('user', 'assistant')),
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_ai_conversations_user ON ai_conversations (user_id, id)
+        ''')
+        
+        # عدادات استخدام الذكاء الاصطناعي
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ai_chat_usage (
+                user_id INTEGER PRIMARY KEY,
+                total_questions INTEGER DEFAULT 0,
+                usage_date DATE,
+                today_questions INTEGER DEFAULT 0,
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        ''')
     
     def register_user(self, user_id, username, first_name, last_name, referred_by=None):
         """تسجيل مستخدم جديد"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # التحقق من وجود المستخدم
-        cursor.execute('SELECT user_id FROM users WHERE user_id = ?', (user_id,))
-        if cursor.fetchone():
-            conn.close()
-            return False, "User already exists"
-        
         # إنشاء كود الإحالة
         referral_code = f"CB{user_id}"
         
@@ -189,117 +473,139 @@ class DatabaseManager:
             welcome_points += 20  # مكافأة إضافية للإحالة
         
         try:
-            # إدراج المستخدم الجديد
-            cursor.execute('''
-                INSERT INTO users (user_id, username, first_name, last_name, referral_code, points, referred_by)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (user_id, username, first_name, last_name, referral_code, welcome_points, referred_by))
-            
-            # إضافة نقاط الترحيب
-            cursor.execute('''
-                INSERT INTO points_history (user_id, points, reason, transaction_type)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, welcome_points, 'Welcome bonus', 'earned'))
-            
-            # إذا كان هناك محيل، أضف له نقاط
-            if referred_by:
-                cursor.execute('''
-                    INSERT INTO referrals (referrer_id, referred_id, points_awarded)
-                    VALUES (?, ?, ?)
-                ''', (referred_by, user_id, 50))
+            with self.transaction() as conn:
+                cursor = conn.cursor()
                 
-                # إضافة نقاط للمحيل
-                cursor.execute('''
-                    UPDATE users SET points = points + 50 WHERE user_id = ?
-                ''', (referred_by,))
+                # التحقق من وجود المستخدم
+                cursor.execute('SELECT user_id FROM users WHERE user_id = ?', (user_id,))
+                if cursor.fetchone():
+                    # عودة مستخدم كان قد حظر البوت: إعادة اشتراكه الذي أُلغي تلقائياً
+                    cursor.execute('''
+                        UPDATE users SET blocked_at = NULL, newsletter_subscribed = TRUE
+                        WHERE user_id = ? AND blocked_at IS NOT NULL
+                    ''', (user_id,))
+                    return False, "User already exists"
                 
+                # إدراج المستخدم الجديد (الرصيد يبدأ من صفر ونقاط الترحيب قيد في الدفتر)
                 cursor.execute('''
-                    INSERT INTO points_history (user_id, points, reason, transaction_type)
-                    VALUES (?, ?, ?, ?)
-                ''', (referred_by, 50, f'Referral bonus for user {user_id}', 'earned'))
+                    INSERT INTO users (user_id, username, first_name, last_name, referral_code, points, referred_by)
+                    VALUES (?, ?, ?, ?, ?, 0, ?)
+                ''', (user_id, username, first_name, last_name, referral_code, referred_by))
+                
+                # نقاط الترحيب
+                entries = [LedgerEntry(user_id, welcome_points, 'Welcome bonus', f'welcome:{user_id}')]
+                
+                # إذا كان هناك محيل، أضف له نقاط
+                upline = []
+                if referred_by and referred_by != user_id:
+                    upline = record_referral(conn, referred_by, user_id, 50)
+                    
+                    # مفتاح المكافأة مشترك مع process_referral فلا تُصرف مرتين لنفس المستخدم
+                    entries.append(LedgerEntry(referred_by, 50, f'Referral bonus for user {user_id}', f'referral:{user_id}'))
+                
+                results = post_entries(conn, entries)
             
-            conn.commit()
-            conn.close()
+            self.invalidate_user(user_id, *upline)
+            self.ledger.committed(entries, results)
+            if len(results) > 1 and results[1] == APPLIED:
+                self.emit_event('referral_added', referred_by)
             return True, "Registration successful"
             
         except Exception as e:
-            conn.rollback()
-            conn.close()
             return False, str(e)
     
     def get_user_info(self, user_id):
         """الحصول على معلومات المستخدم"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
-        conn.close()
-        return result
+        with self.connection() as conn:
+            return conn.execute('SELECT * FROM users WHERE user_id = ?', (user_id,)).fetchone()
     
-    def update_user_language(self, user_id, language):
-        """تحديث لغة المستخدم"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('UPDATE users SET language = ? WHERE user_id = ?', (language, user_id))
-        conn.commit()
-        conn.close()
+    def _load_user_profile(self, user_id):
+        row = self.get_user_info(user_id)
+        return UserProfile.from_row(row) if row else None
     
-    def add_points(self, user_id, points, reason):
-        """إضافة نقاط للمستخدم"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('UPDATE users SET points = points + ? WHERE user_id = ?', (points, user_id))
-        cursor.execute('''
-            INSERT INTO points_history (user_id, points, reason, transaction_type)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, points, reason, 'earned'))
-        
-        conn.commit()
-        conn.close()
+    def get_user_profile(self, user_id):
+        """الحصول على ملف المستخدم من الذاكرة المؤقتة (قراءة واحدة من القاعدة عند الحاجة)"""
+        return self.profiles.get_or_load(user_id, self._load_user_profile)
     
-    def spend_points(self, user_id, points, reason):
-        """خصم نقاط من المستخدم"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # التحقق من وجود نقاط كافية
-        cursor.execute('SELECT points FROM users WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
-        
-        if not result or result[0] < points:
-            conn.close()
-            return False, "Insufficient points"
+    def get_user_language(self, user_id):
+        """الحصول على لغة المستخدم"""
+        profile = self.get_user_profile(user_id)
+        return profile.language if profile else 'ar'
+    
+    def invalidate_user(self, *user_ids):
+        """إبطال ملفات المستخدمين المخزنة بعد تعديلها"""
+        self.profiles.invalidate(*[user_id for user_id in user_ids if user_id is not None])
+    
+    def points_changed(self, user_id, points=0, lessons=0, history_id=None):
+        """إبلاغ المستمعين (مثل لوحات المتصدرين) بتغيير محفوظ في نقاط المستخدم أو دروسه ورقم سجله في points_history"""
+        if user_id is None:
+            return
+        for listener in self.points_listeners:
+            try:
+                listener(user_id, points, lessons, history_id)
+            except Exception as e:
+                logger.error(f"Points listener failed for user {user_id}: {e}")
+    
+    def emit_event(self, event, user_id):
+        """إبلاغ المستمعين (مثل محرك الإنجازات) بحدث محفوظ للمستخدم"""
+        for listener in self.event_listeners:
+            try:
+                listener(event, user_id)
+            except Exception as e:
+                logger.error(f"Event listener failed for {event} of user {user_id}: {e}")
+    
+    def record_daily_activity(self, user_id):
+        """تحديث سلسلة الأيام المتتالية عند أول نشاط للمستخدم في اليوم (UTC)؛ يعيد True إذا كان الأول اليوم"""
+        today = datetime.now(timezone.utc).date().isoformat()
+        profile = self.get_user_profile(user_id)
+        if profile is None or str(profile.last_activity_date) == today:
+            return False
         
-        cursor.execute('UPDATE users SET points = points - ? WHERE user_id = ?', (points, user_id))
-        cursor.execute('''
-            INSERT INTO points_history (user_id, points, reason, transaction_type)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, -points, reason, 'spent'))
+        with self.transaction() as conn:
+            updated = conn.execute('''
+                UPDATE users SET
+                    streak_days = CASE WHEN last_activity_date = date(?, '-1 day') THEN COALESCE(streak_days, 0) + 1 ELSE 1 END,
+                    last_activity_date = ?
+                WHERE user_id = ? AND (last_activity_date IS NULL OR last_activity_date != ?)
+            ''', (today, today, user_id, today)).rowcount
         
-        conn.commit()
-        conn.close()
-        return True, "Points deducted successfully"
+        self.invalidate_user(user_id)
+        if updated:
+            self.emit_event('daily_login', user_id)
+        return bool(updated)
+    
+    def update_user_language(self, user_id, language):
+        """تحديث لغة المستخدم"""
+        with self.transaction() as conn:
+            conn.execute('UPDATE users SET language = ? WHERE user_id = ?', (language, user_id))
+        self.invalidate_user(user_id)
+    
+    def add_points(self, user_id, points, reason, idempotency_key=None):
+        """إضافة نقاط للمستخدم؛ يعيد نتيجة القيد (APPLIED أو DUPLICATE أو UNKNOWN_USER)"""
+        return self.ledger.post([LedgerEntry(user_id, points, reason, idempotency_key)])[0]
+    
+    def spend_points(self, user_id, points, reason, idempotency_key=None):
+        """خصم نقاط من المستخدم (التحقق من الرصيد والخصم في تحديث شرطي واحد)"""
+        return spend_outcome(self.ledger.post([LedgerEntry(user_id, -points, reason, idempotency_key)])[0])
     
     def get_user_by_referral_code(self, referral_code):
         """الحصول على المستخدم بواسطة كود الإحالة"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id FROM users WHERE referral_code = ?', (referral_code,))
-        result = cursor.fetchone()
-        conn.close()
+        # الأكواد بصيغة CB<user_id> تُطابق من الذاكرة المؤقتة دون قراءة القاعدة
+        if referral_code and referral_code.startswith('CB') and referral_code[2:].isdigit():
+            profile = self.profiles.get(int(referral_code[2:]))
+            if profile is not None and profile.referral_code == referral_code:
+                return profile.user_id
+        
+        with self.connection() as conn:
+            result = conn.execute('SELECT user_id FROM users WHERE referral_code = ?', (referral_code,)).fetchone()
         return result[0] if result else None
     
     def insert_sample_lessons(self):
         """إدراج دروس تجريبية"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # التحقق من وجود دروس
-        cursor.execute('SELECT COUNT(*) FROM lessons')
-        if cursor.fetchone()[0] > 0:
-            conn.close()
-            return
+        with self.connection() as conn:
+            # التحقق من وجود دروس
+            if conn.execute('SELECT COUNT(*) FROM lessons').fetchone()[0] > 0:
+                return
         
         sample_lessons = [
             {
@@ -331,15 +637,13 @@ class DatabaseManager:
             }
         ]
         
-        for lesson in sample_lessons:
-            cursor.execute('''
+        with self.transaction() as conn:
+            conn.executemany('''
                 INSERT INTO lessons (title_ar, title_en, content_ar, content_en, level, category, points_reward)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (lesson['title_ar'], lesson['title_en'], lesson['content_ar'], 
-                  lesson['content_en'], lesson['level'], lesson['category'], lesson['points_reward']))
-        
-        conn.commit()
-        conn.close()
+            ''', [(lesson['title_ar'], lesson['title_en'], lesson['content_ar'], 
+                   lesson['content_en'], lesson['level'], lesson['category'], lesson['points_reward'])
+                  for lesson in sample_lessons])
 
 # إنشاء مثيل من مدير قاعدة البيانات
 db = DatabaseManager()
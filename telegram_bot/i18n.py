@@ -0,0 +1,132 @@
+import json
+import os
+import string
+import threading
+from types import MappingProxyType
+import logging
+
+logger = logging.getLogger(__name__)
+
+LOCALES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'locales')
+DEFAULT_LANGUAGE = 'ar'
+
+class Template:
+    """قالب نص مُحلَّل مسبقاً؛ الحقول الموضعية البسيطة {} تُملأ دون إعادة التحليل"""
+
+    __slots__ = ('text', '_parts', '_simple')
+
+    def __init__(self, text):
+        self.text = text
+        parsed = list(string.Formatter().parse(text))
+        # القالب بسيط إذا كانت كل حقوله {} بلا اسم أو تنسيق أو تحويل
+        self._simple = all(
+            field is None or (field == '' and not spec and conversion is None)
+            for _, field, spec, conversion in parsed
+        )
+        self._parts = tuple((literal, field is not None) for literal, field, _, _ in parsed)
+
+    def format(self, *args, **kwargs):
+        if not self._simple or kwargs:
+            return self.text.format(*args, **kwargs)
+        pieces = []
+        values = iter(args)
+        for literal, has_field in self._parts:
+            pieces.append(literal)
+            if has_field:
+                try:
+                    pieces.append(str(next(values)))
+                except StopIteration:
+                    raise IndexError("Replacement index out of range for template") from None
+        return ''.join(pieces)
+
+    def __str__(self):
+        return self.text
+
+class Translator:
+    """مترجم مرتبط بلغة ومجال محددين؛ يعيد المفتاح نفسه إذا لم يوجد النص"""
+
+    __slots__ = ('language', 'namespace', '_messages', '_templates')
+
+    def __init__(self, language, namespace, messages, templates):
+        self.language = language
+        self.namespace = namespace
+        self._messages = messages
+        self._templates = templates
+
+    def get(self, key):
+        return self._messages.get(key, key)
+
+    __call__ = get
+
+    def format(self, key, *args, **kwargs):
+        """الحصول على النص وملء حقوله باستخدام القالب المُحلَّل مسبقاً"""
+        template = self._templates.get(key)
+        if template is None:
+            return key
+        return template.format(*args, **kwargs)
+
+    def __contains__(self, key):
+        return key in self._messages
+
+class Catalog:
+    """فهرس النصوص المترجمة: يُحمَّل مرة واحدة من ملفات locales/<lang>.json"""
+
+    def __init__(self, locales_dir=LOCALES_DIR, default_language=DEFAULT_LANGUAGE):
+        self.locales_dir = locales_dir
+        self.default_language = default_language
+        self._translators = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def _read_locales(self):
+        locales = {}
+        for filename in sorted(os.listdir(self.locales_dir)):
+            language, ext = os.path.splitext(filename)
+            if ext != '.json':
+                continue
+            with open(os.path.join(self.locales_dir, filename), encoding='utf-8') as f:
+                locales[language] = json.load(f)
+        if self.default_language not in locales:
+            raise ValueError(f"Default language '{self.default_language}' has no locale file in {self.locales_dir}")
+        return locales
+
+    def load(self):
+        """تحميل الملفات وبناء خرائط مجمدة لكل لغة ومجال مع دمج نصوص اللغة الافتراضية"""
+        locales = self._read_locales()
+        default = locales[self.default_language]
+
+        translators = {}
+        for language, namespaces in locales.items():
+            for namespace in set(default) | set(namespaces):
+                # النصوص الناقصة في اللغة تؤخذ من اللغة الافتراضية
+                messages = dict(default.get(namespace, {}))
+                messages.update(namespaces.get(namespace, {}))
+                templates = {key: Template(text) for key, text in messages.items()}
+                translators[(language, namespace)] = Translator(
+                    language, namespace, MappingProxyType(messages), MappingProxyType(templates)
+                )
+
+        with self._lock:
+            self._translators = translators
+            self.languages = tuple(sorted(locales))
+        logger.info(f"Loaded {len(self.languages)} locales: {', '.join(self.languages)}")
+
+    def translator(self, language, namespace):
+        """الحصول على مترجم اللغة، أو مترجم اللغة الافتراضية إذا لم تكن مدعومة"""
+        translators = self._translators
+        translator = translators.get((language, namespace))
+        if translator is None:
+            translator = translators.get((self.default_language, namespace))
+            if translator is None:
+                raise KeyError(f"Unknown text namespace '{namespace}'")
+        return translator
+
+    def get_text(self, language, namespace, key):
+        return self.translator(language, namespace).get(key)
+
+    def format(self, language, namespace, key, *args, **kwargs):
+        """النص بعد ملء حقوله (القوالب مُحلَّلة مرة واحدة عند التحميل)"""
+        return self.translator(language, namespace).format(key, *args, **kwargs)
+
+# إنشاء مثيل من فهرس النصوص
+catalog = Catalog()
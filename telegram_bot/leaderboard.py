@@ -0,0 +1,275 @@
+import math
+import random
+import threading
+import logging
+from datetime import datetime, timedelta, timezone
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+class IndexableSkipList:
+    """قائمة تخطٍّ مرتبة مفهرسة: كل وصلة تحفظ عدد العناصر التي تتخطاها (width)
+
+    الإدراج والحذف وترتيب مفتاح والوصول للعنصر رقم i كلها O(log n)، وقراءة k عناصر متتالية O(log n + k).
+    المفاتيح يجب أن تكون فريدة وقابلة للمقارنة.
+    """
+
+    MAX_LEVELS = 32
+
+    def __init__(self):
+        self._tail = _Node(None, 0)
+        self._head = _Node(None, self.MAX_LEVELS)
+        self._head.next = [self._tail] * self.MAX_LEVELS
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _random_levels(self):
+        return min(self.MAX_LEVELS, 1 - int(math.log(1.0 - random.random(), 2.0)))
+
+    def _predecessors(self, key):
+        """آخر عقدة قبل key في كل مستوى مع موقعها (1 = أول عنصر، 0 = الرأس)"""
+        chain = [None] * self.MAX_LEVELS
+        positions = [0] * self.MAX_LEVELS
+        node, position = self._head, 0
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not self._tail and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+            positions[level] = position
+        return chain, positions
+
+    def insert(self, key):
+        chain, positions = self._predecessors(key)
+        levels = self._random_levels()
+        node = _Node(key, levels)
+        position = positions[0] + 1
+        for level in range(levels):
+            previous = chain[level]
+            node.next[level] = previous.next[level]
+            previous.next[level] = node
+            node.width[level] = previous.width[level] - (position - positions[level]) + 1
+            previous.width[level] = position - positions[level]
+        for level in range(levels, self.MAX_LEVELS):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key):
+        chain, _ = self._predecessors(key)
+        node = chain[0].next[0]
+        if node is self._tail or node.key != key:
+            raise KeyError(key)
+        for level in range(len(node.next)):
+            previous = chain[level]
+            previous.width[level] += node.width[level] - 1
+            previous.next[level] = node.next[level]
+        for level in range(len(node.next), self.MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def index(self, key):
+        """موقع المفتاح (يبدأ من 0) أو None إذا لم يوجد"""
+        chain, positions = self._predecessors(key)
+        node = chain[0].next[0]
+        if node is self._tail or node.key != key:
+            return None
+        return positions[0]
+
+    def _node_at(self, index):
+        node, remaining = self._head, index + 1
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.width[level] <= remaining and node.next[level] is not self._tail:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node
+
+    def slice(self, start, count):
+        """المفاتيح من الموقع start (حتى count عنصراً)"""
+        start = max(0, start)
+        if start >= self._size or count <= 0:
+            return []
+        node = self._node_at(start)
+        keys = []
+        while node is not self._tail and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+class Leaderboard:
+    """لوحة متصدرين واحدة مرتبة بالنقاط ثم عدد الدروس (تنازلياً) ثم user_id"""
+
+    def __init__(self):
+        self._ranking = IndexableSkipList()
+        self._scores = {}
+
+    def __len__(self):
+        return len(self._scores)
+
+    @staticmethod
+    def _key(user_id, score):
+        return (-score[0], -score[1], user_id)
+
+    def set(self, user_id, points, lessons=0):
+        old = self._scores.get(user_id)
+        if old == (points, lessons):
+            return
+        if old is not None:
+            self._ranking.remove(self._key(user_id, old))
+        self._scores[user_id] = (points, lessons)
+        self._ranking.insert(self._key(user_id, (points, lessons)))
+
+    def add(self, user_id, points=0, lessons=0):
+        old_points, old_lessons = self._scores.get(user_id, (0, 0))
+        self.set(user_id, old_points + points, old_lessons + lessons)
+
+    def discard(self, user_id):
+        old = self._scores.pop(user_id, None)
+        if old is not None:
+            self._ranking.remove(self._key(user_id, old))
+
+    def rank(self, user_id):
+        """ترتيب المستخدم (يبدأ من 1) أو None إذا لم يكن في اللوحة"""
+        score = self._scores.get(user_id)
+        if score is None:
+            return None
+        return self._ranking.index(self._key(user_id, score)) + 1
+
+    def entries(self, start, count):
+        """[(الترتيب، user_id، النقاط، الدروس)] بدءاً من الموقع start (يبدأ من 0)"""
+        return [
+            (start + offset + 1, user_id, -points, -lessons)
+            for offset, (points, lessons, user_id) in enumerate(self._ranking.slice(start, count))
+        ]
+
+    def top(self, count):
+        return self.entries(0, count)
+
+    def around(self, user_id, radius=2):
+        """المستخدم ومن حوله (radius قبله وبعده)"""
+        rank = self.rank(user_id)
+        if rank is None:
+            return []
+        start = max(0, rank - 1 - radius)
+        return self.entries(start, rank - start + radius)
+
+# اللوحات: الكلية من رصيد المستخدمين، والأسبوعية والشهرية من النقاط المكتسبة في الفترة
+BOARDS = ('all', 'weekly', 'monthly')
+
+def period_start(board, now=None):
+    """بداية الفترة الحالية للوحة (بتوقيت UTC مثل CURRENT_TIMESTAMP في points_history)؛ None للوحة الكلية"""
+    if board == 'all':
+        return None
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    if board == 'weekly':
+        day = now.date() - timedelta(days=now.weekday())
+    elif board == 'monthly':
+        day = now.date().replace(day=1)
+    else:
+        raise ValueError(f"Unknown leaderboard: {board!r}")
+    return datetime(day.year, day.month, day.day)
+
+class LeaderboardService:
+    """لوحات المتصدرين في الذاكرة، تُبنى من القاعدة عند التشغيل وتُحدَّث مع كل تغيير في النقاط
+
+    التحديث يأتي من DatabaseManager.points_listeners بعد حفظ المعاملة، وعند بداية أسبوع أو شهر جديد
+    تبدأ اللوحة الدورية فارغة. refresh() يعيد البناء لالتقاط التعديلات من خارج البوت (لوحة الإدارة).
+    البناء يحفظ أعلى رقم في points_history ضمن نفس لقطة القراءة، فالتغييرات التي يصل إشعارها بعد
+    البناء وهي محسوبة فيه لا تُضاف مرتين.
+    """
+
+    def __init__(self, database):
+        self.db = database
+        self._lock = threading.RLock()
+        self._boards = {}
+        self._periods = {}
+        self._high_water = 0
+        self.loaded = False
+        database.points_listeners.append(self.record)
+
+    def load(self):
+        """إعادة بناء كل اللوحات من القاعدة"""
+        with self._lock:
+            boards, periods = {board: Leaderboard() for board in BOARDS}, {}
+            with self.db.connection() as conn:
+                # معاملة قراءة واحدة كي تتطابق اللوحات مع أعلى رقم سجل المقروء
+                snapshot = not conn.in_transaction
+                if snapshot:
+                    conn.execute('BEGIN')
+                high_water = conn.execute('SELECT COALESCE(MAX(id), 0) FROM points_history').fetchone()[0]
+                for user_id, points, lessons in conn.execute(
+                    'SELECT user_id, points, total_lessons_completed FROM users'
+                ):
+                    boards['all'].set(user_id, points or 0, lessons or 0)
+                for board in BOARDS[1:]:
+                    periods[board] = period_start(board)
+                    for user_id, points in conn.execute('''
+                        SELECT user_id, SUM(points) FROM points_history
+                        WHERE date >= ? AND points > 0
+                        GROUP BY user_id
+                    ''', (periods[board].strftime('%Y-%m-%d %H:%M:%S'),)):
+                        boards[board].set(user_id, points)
+                if snapshot:
+                    conn.execute('COMMIT')
+            self._boards, self._periods, self._high_water = boards, periods, high_water
+            self.loaded = True
+        logger.info(f"Leaderboards loaded with {len(boards['all'])} users")
+
+    refresh = load
+
+    def _board(self, board):
+        if not self.loaded:
+            self.load()
+        start = period_start(board)
+        if start != self._periods.get(board):
+            self._boards[board] = Leaderboard()
+            self._periods[board] = start
+        return self._boards[board]
+
+    def record(self, user_id, points=0, lessons=0, history_id=None):
+        """تطبيق تغيير نقاط (سالب عند الصرف) أو دروس مكتملة على اللوحات"""
+        with self._lock:
+            if not self.loaded:
+                # البناء الأول سيقرأ الحالة المحفوظة بما فيها هذا التغيير
+                return
+            if history_id is not None and history_id <= self._high_water:
+                # التغيير محفوظ قبل آخر بناء ومحسوب فيه
+                return
+            self._board('all').add(user_id, points, lessons)
+            if points > 0:
+                for board in BOARDS[1:]:
+                    self._board(board).add(user_id, points)
+
+    def remove_user(self, user_id):
+        with self._lock:
+            for board in self._boards.values():
+                board.discard(user_id)
+
+    def top(self, board='all', count=10):
+        with self._lock:
+            return self._board(board).top(count)
+
+    def rank(self, board, user_id):
+        with self._lock:
+            return self._board(board).rank(user_id)
+
+    def around(self, board, user_id, radius=2):
+        with self._lock:
+            return self._board(board).around(user_id, radius)
+
+    def size(self, board='all'):
+        with self._lock:
+            return len(self._board(board))
+
+# لوحات المتصدرين المشتركة
+leaderboards = LeaderboardService(db)
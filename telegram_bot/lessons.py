@@ -1,5 +1,7 @@
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from database import db
+from points_ledger import LedgerEntry, post_entries
+from i18n import catalog
 import random
 
 class LessonsManager:
@@ -8,53 +10,11 @@ class LessonsManager:
     
     def get_text(self, user_id, key):
         """الحصول على النص حسب لغة المستخدم"""
-        user_info = self.db.get_user_info(user_id)
-        lang = user_info[4] if user_info else 'ar'
-        
-        texts = {
-            'ar': {
-                'lessons_menu': '📚 الدروس التعليمية',
-                'choose_level': 'اختر مستواك:',
-                'beginner': '🟢 مبتدئ',
-                'intermediate': '🟡 متوسط', 
-                'advanced': '🔴 متقدم',
-                'lesson_completed': '✅ مكتمل',
-                'lesson_locked': '🔒 مقفل',
-                'start_lesson': '▶️ بدء الدرس',
-                'take_quiz': '📝 اختبار',
-                'lesson_progress': 'التقدم: {}/{}',
-                'points_earned': 'حصلت على {} نقطة!',
-                'quiz_question': 'السؤال {}/{}',
-                'correct_answer': '✅ إجابة صحيحة!',
-                'wrong_answer': '❌ إجابة خاطئة',
-                'quiz_completed': 'انتهى الاختبار!\nالنتيجة: {}/{}\nالنقاط المكتسبة: {}',
-                'back_to_lessons': '🔙 العودة للدروس',
-                'next_lesson': '➡️ الدرس التالي',
-                'main_menu': '🏠 القائمة الرئيسية'
-            },
-            'en': {
-                'lessons_menu': '📚 Educational Lessons',
-                'choose_level': 'Choose your level:',
-                'beginner': '🟢 Beginner',
-                'intermediate': '🟡 Intermediate',
-                'advanced': '🔴 Advanced',
-                'lesson_completed': '✅ Completed',
-                'lesson_locked': '🔒 Locked',
-                'start_lesson': '▶️ Start Lesson',
-                'take_quiz': '📝 Quiz',
-                'lesson_progress': 'Progress: {}/{}',
-                'points_earned': 'You earned {} points!',
-                'quiz_question': 'Question {}/{}',
-                'correct_answer': '✅ Correct answer!',
-                'wrong_answer': '❌ Wrong answer',
-                'quiz_completed': 'Quiz completed!\nScore: {}/{}\nPoints earned: {}',
-                'back_to_lessons': '🔙 Back to Lessons',
-                'next_lesson': '➡️ Next Lesson',
-                'main_menu': '🏠 Main Menu'
-            }
-        }
-        
-        return texts.get(lang, texts['ar']).get(key, key)
+        return catalog.get_text(self.db.get_user_language(user_id), 'lessons', key)
+    
+    def format_text(self, user_id, key, *args):
+        """النص حسب لغة المستخدم بعد ملء حقوله بالقالب المُحلَّل مسبقاً"""
+        return catalog.format(self.db.get_user_language(user_id), 'lessons', key, *args)
     
     def create_levels_menu(self, user_id):
         """إنشاء قائمة المستويات"""
@@ -68,27 +28,19 @@ class LessonsManager:
     
     def get_lessons_by_level(self, level):
         """الحصول على الدروس حسب المستوى"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM lessons WHERE level = ? ORDER BY id', (level,))
-        lessons = cursor.fetchall()
-        conn.close()
-        return lessons
+        with self.db.connection() as conn:
+            return conn.execute('SELECT * FROM lessons WHERE level = ? ORDER BY id', (level,)).fetchall()
     
     def get_user_progress(self, user_id, level):
         """الحصول على تقدم المستخدم في مستوى معين"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT l.id, up.completed 
-            FROM lessons l 
-            LEFT JOIN user_progress up ON l.id = up.lesson_id AND up.user_id = ?
-            WHERE l.level = ?
-            ORDER BY l.id
-        ''', (user_id, level))
-        progress = cursor.fetchall()
-        conn.close()
-        return progress
+        with self.db.connection() as conn:
+            return conn.execute('''
+                SELECT l.id, up.completed 
+                FROM lessons l 
+                LEFT JOIN user_progress up ON l.id = up.lesson_id AND up.user_id = ?
+                WHERE l.level = ?
+                ORDER BY l.id
+            ''', (user_id, level)).fetchall()
     
     def create_lessons_menu(self, user_id, level):
         """إنشاء قائمة الدروس لمستوى معين"""
@@ -124,32 +76,24 @@ class LessonsManager:
     
     def get_user_language(self, user_id):
         """الحصول على لغة المستخدم"""
-        user_info = self.db.get_user_info(user_id)
-        return user_info[4] if user_info else 'ar'
+        return self.db.get_user_language(user_id)
     
     def get_lesson_content(self, user_id, lesson_id):
         """الحصول على محتوى الدرس"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM lessons WHERE id = ?', (lesson_id,))
-        lesson = cursor.fetchone()
-        conn.close()
-        
-        if not lesson:
-            return None
+        with self.db.connection() as conn:
+            lesson = conn.execute('SELECT * FROM lessons WHERE id = ?', (lesson_id,)).fetchone()
+            
+            if not lesson:
+                return None
+            
+            # التحقق من إكمال الدرس
+            progress = conn.execute('SELECT completed FROM user_progress WHERE user_id = ? AND lesson_id = ?', 
+                                    (user_id, lesson_id)).fetchone()
         
         lang = self.get_user_language(user_id)
         title = lesson[1] if lang == 'ar' else lesson[2]
         content = lesson[3] if lang == 'ar' else lesson[4]
         
-        # التحقق من إكمال الدرس
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT completed FROM user_progress WHERE user_id = ? AND lesson_id = ?', 
-                      (user_id, lesson_id))
-        progress = cursor.fetchone()
-        conn.close()
-        
         is_completed = progress and progress[0]
         
         # إنشاء الأزرار
@@ -172,14 +116,10 @@ class LessonsManager:
     
     def create_sample_quizzes(self):
         """إنشاء اختبارات تجريبية"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        
-        # التحقق من وجود اختبارات
-        cursor.execute('SELECT COUNT(*) FROM quizzes')
-        if cursor.fetchone()[0] > 0:
-            conn.close()
-            return
+        with self.db.connection() as conn:
+            # التحقق من وجود اختبارات
+            if conn.execute('SELECT COUNT(*) FROM quizzes').fetchone()[0] > 0:
+                return
         
         sample_quizzes = [
             {
@@ -216,28 +156,22 @@ class LessonsManager:
             }
         ]
         
-        for quiz in sample_quizzes:
-            cursor.execute('''
+        with self.db.transaction() as conn:
+            conn.executemany('''
                 INSERT INTO quizzes (lesson_id, question_ar, question_en, option_a_ar, option_a_en,
                                    option_b_ar, option_b_en, option_c_ar, option_c_en, 
                                    option_d_ar, option_d_en, correct_answer, explanation_ar, explanation_en)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (quiz['lesson_id'], quiz['question_ar'], quiz['question_en'],
-                  quiz['option_a_ar'], quiz['option_a_en'], quiz['option_b_ar'], quiz['option_b_en'],
-                  quiz['option_c_ar'], quiz['option_c_en'], quiz['option_d_ar'], quiz['option_d_en'],
-                  quiz['correct_answer'], quiz['explanation_ar'], quiz['explanation_en']))
-        
-        conn.commit()
-        conn.close()
+            ''', [(quiz['lesson_id'], quiz['question_ar'], quiz['question_en'],
+                   quiz['option_a_ar'], quiz['option_a_en'], quiz['option_b_ar'], quiz['option_b_en'],
+                   quiz['option_c_ar'], quiz['option_c_en'], quiz['option_d_ar'], quiz['option_d_en'],
+                   quiz['correct_answer'], quiz['explanation_ar'], quiz['explanation_en'])
+                  for quiz in sample_quizzes])
     
     def get_quiz_questions(self, lesson_id):
         """الحصول على أسئلة الاختبار للدرس"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM quizzes WHERE lesson_id = ?', (lesson_id,))
-        questions = cursor.fetchall()
-        conn.close()
-        return questions
+        with self.db.connection() as conn:
+            return conn.execute('SELECT * FROM quizzes WHERE lesson_id = ?', (lesson_id,)).fetchall()
     
     def create_quiz_question(self, user_id, lesson_id, question_index=0):
         """إنشاء سؤال الاختبار"""
@@ -268,7 +202,7 @@ class LessonsManager:
         keyboard.append([InlineKeyboardButton(self.get_text(user_id, 'back_to_lessons'), 
                                             callback_data=f"lesson_{lesson_id}")])
         
-        header = self.get_text(user_id, 'quiz_question').format(question_index + 1, len(questions))
+        header = self.format_text(user_id, 'quiz_question', question_index + 1, len(questions))
         full_text = f"{header}\n\n{question_text}"
         
         return {
@@ -281,52 +215,46 @@ class LessonsManager:
     
     def complete_lesson(self, user_id, lesson_id, quiz_score=0):
         """إكمال الدرس ومنح النقاط"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        
-        # التحقق من إكمال الدرس مسبقاً
-        cursor.execute('SELECT completed FROM user_progress WHERE user_id = ? AND lesson_id = ?', 
-                      (user_id, lesson_id))
-        existing = cursor.fetchone()
-        
-        if existing and existing[0]:
-            conn.close()
-            return False, 0  # الدرس مكتمل مسبقاً
-        
-        # الحصول على نقاط الدرس
-        cursor.execute('SELECT points_reward FROM lessons WHERE id = ?', (lesson_id,))
-        lesson_points = cursor.fetchone()[0]
-        
-        # حساب النقاط الإضافية حسب نتيجة الاختبار
-        bonus_points = quiz_score * 2  # نقطتان إضافيتان لكل إجابة صحيحة
-        total_points = lesson_points + bonus_points
-        
-        # تحديث أو إدراج التقدم
-        if existing:
-            cursor.execute('''
-                UPDATE user_progress 
-                SET completed = TRUE, quiz_score = ?, completion_date = CURRENT_TIMESTAMP
-                WHERE user_id = ? AND lesson_id = ?
-            ''', (quiz_score, user_id, lesson_id))
-        else:
-            cursor.execute('''
-                INSERT INTO user_progress (user_id, lesson_id, completed, quiz_score, completion_date)
-                VALUES (?, ?, TRUE, ?, CURRENT_TIMESTAMP)
-            ''', (user_id, lesson_id, quiz_score))
-        
-        # إضافة النقاط للمستخدم
-        cursor.execute('UPDATE users SET points = points + ?, total_lessons_completed = total_lessons_completed + 1 WHERE user_id = ?', 
-                      (total_points, user_id))
-        
-        # تسجيل تاريخ النقاط
-        cursor.execute('''
-            INSERT INTO points_history (user_id, points, reason, transaction_type)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, total_points, f'Completed lesson {lesson_id}', 'earned'))
-        
-        conn.commit()
-        conn.close()
-        
+        with self.db.transaction() as conn:
+            cursor = conn.cursor()
+            
+            # التحقق من إكمال الدرس مسبقاً
+            cursor.execute('SELECT completed FROM user_progress WHERE user_id = ? AND lesson_id = ?', 
+                          (user_id, lesson_id))
+            existing = cursor.fetchone()
+            
+            if existing and existing[0]:
+                return False, 0  # الدرس مكتمل مسبقاً
+            
+            # الحصول على نقاط الدرس
+            cursor.execute('SELECT points_reward FROM lessons WHERE id = ?', (lesson_id,))
+            lesson_points = cursor.fetchone()[0]
+            
+            # حساب النقاط الإضافية حسب نتيجة الاختبار
+            bonus_points = quiz_score * 2  # نقطتان إضافيتان لكل إجابة صحيحة
+            total_points = lesson_points + bonus_points
+            
+            # تحديث أو إدراج التقدم
+            if existing:
+                cursor.execute('''
+                    UPDATE user_progress 
+                    SET completed = TRUE, quiz_score = ?, completion_date = CURRENT_TIMESTAMP
+                    WHERE user_id = ? AND lesson_id = ?
+                ''', (quiz_score, user_id, lesson_id))
+            else:
+                cursor.execute('''
+                    INSERT INTO user_progress (user_id, lesson_id, completed, quiz_score, completion_date)
+                    VALUES (?, ?, TRUE, ?, CURRENT_TIMESTAMP)
+                ''', (user_id, lesson_id, quiz_score))
+            
+            # إضافة النقاط للمستخدم (المفتاح يمنع منح نقاط الدرس مرتين)
+            cursor.execute('UPDATE users SET total_lessons_completed = total_lessons_completed + 1 WHERE user_id = ?', 
+                          (user_id,))
+            entries = [LedgerEntry(user_id, total_points, f'Completed lesson {lesson_id}', f'lesson:{user_id}:{lesson_id}')]
+            results = post_entries(conn, entries)
+        
+        self.db.invalidate_user(user_id)
+        self.db.ledger.committed(entries, results, lessons={user_id: 1})
         return True, total_points
 
 # إنشاء مثيل من مدير الدروس
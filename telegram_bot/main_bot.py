@@ -1,21 +1,28 @@
 import os
 import logging
-import schedule
-import time
-import threading
+import asyncio
 from datetime import datetime
 from dotenv import load_dotenv
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, TypeHandler, filters, ContextTypes
+from telegram.error import BadRequest, RetryAfter
 
 # استيراد الأنظمة المطورة
 from database import db
+from async_database import async_db
+from i18n import catalog
 from lessons import lesson_system
 from points_system import points_system
 from news_system import news_system
 from ai_chat import ai_chat_system
 from shop_system import shop_system
+from search_index import search
+from scheduler import CronSpec, job_scheduler
+from broadcast import broadcast_engine
+from notification_system import notification_system
+from leaderboard import leaderboards
+from analytics_system import analytics_system
 
 # تحميل المتغيرات البيئية
 load_dotenv()
@@ -27,21 +34,35 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+SEARCH_PAGE_SIZE = 5
+
 class CyberBotAI:
     def __init__(self):
         self.db = db
+        self.async_db = async_db
         self.lesson_system = lesson_system
         self.points_system = points_system
         self.news_system = news_system
         self.ai_chat_system = ai_chat_system
         self.shop_system = shop_system
+        self.scheduler = job_scheduler
+        self.broadcast_engine = broadcast_engine
         
         # إعداد البوت
         self.token = os.getenv('TELEGRAM_BOT_TOKEN')
         if not self.token:
             raise ValueError("TELEGRAM_BOT_TOKEN is required")
         
-        self.application = Application.builder().token(self.token).build()
+        # معالجة التحديثات بالتوازي حتى لا ينتظر المستخدمون إجابات الذكاء الاصطناعي لغيرهم
+        self.application = (
+            Application.builder()
+            .token(self.token)
+            .base_url(os.getenv('TELEGRAM_API_BASE_URL', 'https://api.telegram.org/bot'))
+            .concurrent_updates(True)
+            .post_init(self.post_init)
+            .post_shutdown(self.shutdown)
+            .build()
+        )
         self.setup_handlers()
         
         # إعداد المهام المجدولة
@@ -49,67 +70,30 @@ class CyberBotAI:
     
     def get_text(self, user_id, key):
         """الحصول على النص حسب لغة المستخدم"""
-        user_info = self.db.get_user_info(user_id)
-        lang = user_info[4] if user_info else 'ar'
-        
-        texts = {
-            'ar': {
-                'welcome': '🤖 مرحباً بك في CyberBot AI!\n\nبوتك التعليمي الذكي للأمن السيبراني',
-                'main_menu': '🏠 القائمة الرئيسية',
-                'lessons': '📚 الدروس التعليمية',
-                'news': '📰 الأخبار الأمنية',
-                'ai_chat': '🤖 الذكاء الاصطناعي',
-                'shop': '🛒 المتجر',
-                'profile': '👤 ملفي الشخصي',
-                'settings': '⚙️ الإعدادات',
-                'help': '❓ المساعدة',
-                'points': 'نقاطك: {} نقطة',
-                'level': 'مستواك: {}',
-                'vip_status': '👑 عضو VIP',
-                'regular_status': '👤 عضو عادي',
-                'choose_option': 'اختر من القائمة أدناه:',
-                'language_changed': '✅ تم تغيير اللغة بنجاح',
-                'error_occurred': '❌ حدث خطأ، حاول مرة أخرى'
-            },
-            'en': {
-                'welcome': '🤖 Welcome to CyberBot AI!\n\nYour smart educational bot for cybersecurity',
-                'main_menu': '🏠 Main Menu',
-                'lessons': '📚 Educational Lessons',
-                'news': '📰 Security News',
-                'ai_chat': '🤖 AI Chat',
-                'shop': '🛒 Shop',
-                'profile': '👤 My Profile',
-                'settings': '⚙️ Settings',
-                'help': '❓ Help',
-                'points': 'Your points: {} points',
-                'level': 'Your level: {}',
-                'vip_status': '👑 VIP Member',
-                'regular_status': '👤 Regular Member',
-                'choose_option': 'Choose from the menu below:',
-                'language_changed': '✅ Language changed successfully',
-                'error_occurred': '❌ An error occurred, please try again'
-            }
-        }
-        
-        return texts.get(lang, texts['ar']).get(key, key)
+        return catalog.get_text(self.db.get_user_language(user_id), 'main', key)
+    
+    def format_text(self, user_id, key, *args):
+        """النص حسب لغة المستخدم بعد ملء حقوله بالقالب المُحلَّل مسبقاً"""
+        return catalog.format(self.db.get_user_language(user_id), 'main', key, *args)
     
     def create_main_menu(self, user_id):
         """إنشاء القائمة الرئيسية"""
-        user_info = self.db.get_user_info(user_id)
-        points = user_info[5] if user_info else 0
-        level = user_info[6] if user_info else 'beginner'
-        is_vip = user_info[11] if len(user_info) > 11 else False
+        profile = self.db.get_user_profile(user_id)
+        points = profile.points if profile else 0
+        level = profile.level if profile else 'beginner'
+        is_vip = profile.is_vip if profile else False
+        lang = profile.language if profile else 'ar'
         
         # ترجمة المستوى
         level_text = {
-            'beginner': 'مبتدئ' if user_info[4] == 'ar' else 'Beginner',
-            'intermediate': 'متوسط' if user_info[4] == 'ar' else 'Intermediate',
-            'advanced': 'متقدم' if user_info[4] == 'ar' else 'Advanced'
+            'beginner': 'مبتدئ' if lang == 'ar' else 'Beginner',
+            'intermediate': 'متوسط' if lang == 'ar' else 'Intermediate',
+            'advanced': 'متقدم' if lang == 'ar' else 'Advanced'
         }.get(level, level)
         
         text = f"{self.get_text(user_id, 'welcome')}\n\n"
-        text += f"📊 {self.get_text(user_id, 'points').format(points)}\n"
-        text += f"🎯 {self.get_text(user_id, 'level').format(level_text)}\n"
+        text += f"📊 {self.format_text(user_id, 'points', points)}\n"
+        text += f"🎯 {self.format_text(user_id, 'level', level_text)}\n"
         text += f"💎 {self.get_text(user_id, 'vip_status') if is_vip else self.get_text(user_id, 'regular_status')}\n\n"
         text += f"{self.get_text(user_id, 'choose_option')}"
         
@@ -139,19 +123,75 @@ class CyberBotAI:
         user_id = user.id
         
         # تسجيل المستخدم في قاعدة البيانات
-        self.db.register_user(
+        await self.async_db.register_user(
             user_id=user_id,
             username=user.username or '',
             first_name=user.first_name or '',
-            last_name=user.last_name or '',
-            language='ar'  # افتراضي
+            last_name=user.last_name or ''
         )
         
         # إنشاء القائمة الرئيسية
-        text, keyboard = self.create_main_menu(user_id)
+        text, keyboard = await self.async_db.run(self.create_main_menu, user_id)
         
         await update.message.reply_text(text, reply_markup=keyboard)
     
+    async def track_activity(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """تحديث سلسلة الأيام المتتالية عند أول نشاط للمستخدم في اليوم"""
+        if update.effective_user is None:
+            return
+        try:
+            await self.async_db.record_daily_activity(update.effective_user.id)
+        except Exception as e:
+            logger.error(f"Error recording daily activity: {e}")
+    
+    async def search_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """معالج أمر /search"""
+        user_id = update.effective_user.id
+        search_query = ' '.join(context.args).strip()
+        
+        if not search_query:
+            text = await self.async_db.run(self.get_text, user_id, 'search_usage')
+            await update.message.reply_text(text)
+            return
+        
+        # حفظ نص البحث لأزرار التنقل بين الصفحات (callback_data محدودة الطول)
+        context.user_data.setdefault(user_id, {})['search_query'] = search_query
+        text, keyboard = await self.async_db.run(self.create_search_results, user_id, search_query, 1)
+        await update.message.reply_text(text, reply_markup=keyboard)
+    
+    def create_search_results(self, user_id, search_query, page):
+        """صفحة من نتائج البحث في الأخبار والدروس"""
+        lang = self.db.get_user_language(user_id)
+        with self.db.connection() as conn:
+            found = search(conn, search_query, page=page, per_page=SEARCH_PAGE_SIZE)
+        
+        keyboard = []
+        if not found['results']:
+            text = self.format_text(user_id, 'search_no_results', search_query)
+        else:
+            text = f"{self.format_text(user_id, 'search_results', search_query, found['total'])}\n\n"
+            start = (found['page'] - 1) * SEARCH_PAGE_SIZE
+            for i, result in enumerate(found['results'], start + 1):
+                icon = '📰' if result['kind'] == 'news' else '📚'
+                title = result['title_ar'] if lang == 'ar' else result['title_en']
+                text += f"{i}. {icon} {title}\n{result['snippet']}\n\n"
+                
+                callback_data = f"news_read_{result['id']}" if result['kind'] == 'news' else f"lesson_{result['id']}"
+                keyboard.append([InlineKeyboardButton(f"{icon} {i}", callback_data=callback_data)])
+            
+            text += self.format_text(user_id, 'search_page', found['page'], found['pages'])
+            
+            navigation = []
+            if found['page'] > 1:
+                navigation.append(InlineKeyboardButton(self.get_text(user_id, 'previous_page'), callback_data=f"search_page_{found['page'] - 1}"))
+            if found['page'] < found['pages']:
+                navigation.append(InlineKeyboardButton(self.get_text(user_id, 'next_page'), callback_data=f"search_page_{found['page'] + 1}"))
+            if navigation:
+                keyboard.append(navigation)
+        
+        keyboard.append([InlineKeyboardButton(self.get_text(user_id, 'main_menu'), callback_data='main_menu')])
+        return text, InlineKeyboardMarkup(keyboard)
+    
     async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """معالج الأزرار"""
         query = update.callback_query
@@ -162,21 +202,21 @@ class CyberBotAI:
         
         try:
             if data == 'main_menu':
-                text, keyboard = self.create_main_menu(user_id)
+                text, keyboard = await self.async_db.run(self.create_main_menu, user_id)
                 await query.edit_message_text(text, reply_markup=keyboard)
             
             elif data == 'lessons':
-                text, keyboard = self.lesson_system.create_lessons_menu(user_id)
+                text, keyboard = await self.async_db.run(self.lesson_system.create_lessons_menu, user_id)
                 await query.edit_message_text(text, reply_markup=keyboard)
             
             elif data.startswith('lesson_'):
                 lesson_id = int(data.split('_')[1])
-                text, keyboard = self.lesson_system.create_lesson_details(user_id, lesson_id)
+                text, keyboard = await self.async_db.run(self.lesson_system.create_lesson_details, user_id, lesson_id)
                 await query.edit_message_text(text, reply_markup=keyboard)
             
             elif data.startswith('quiz_'):
                 lesson_id = int(data.split('_')[1])
-                text, keyboard = self.lesson_system.start_quiz(user_id, lesson_id)
+                text, keyboard = await self.async_db.run(self.lesson_system.start_quiz, user_id, lesson_id)
                 await query.edit_message_text(text, reply_markup=keyboard)
             
             elif data.startswith('answer_'):
@@ -185,11 +225,12 @@ class CyberBotAI:
                 question_index = int(parts[2])
                 answer_index = int(parts[3])
                 
-                result = self.lesson_system.submit_quiz_answer(user_id, lesson_id, question_index, answer_index)
+                result = await self.async_db.run(self.lesson_system.submit_quiz_answer, user_id, lesson_id, question_index, answer_index)
                 
                 if result['completed']:
                     # إضافة النقاط
-                    self.db.add_points(user_id, result['points'], f"Completed lesson {lesson_id}")
+                    await self.async_db.add_points(user_id, result['points'], f"Completed lesson {lesson_id}",
+                                                   idempotency_key=f'lesson:{user_id}:{lesson_id}')
                     
                     text = f"🎉 تهانينا! لقد أكملت الدرس بنجاح!\n\n"
                     text += f"📊 النتيجة: {result['score']}/{result['total']}\n"
@@ -199,104 +240,144 @@ class CyberBotAI:
                     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
                 else:
                     # السؤال التالي
-                    text, keyboard = self.lesson_system.get_next_question(user_id, lesson_id, question_index + 1)
+                    text, keyboard = await self.async_db.run(self.lesson_system.get_next_question, user_id, lesson_id, question_index + 1)
                     await query.edit_message_text(text, reply_markup=keyboard)
             
             elif data == 'news':
-                text, keyboard = self.news_system.create_news_menu(user_id)
+                # create_news_menu يعيد لوحة الأزرار فقط
+                text = await self.async_db.run(self.news_system.get_text, user_id, 'daily_news')
+                keyboard = await self.async_db.run(self.news_system.create_news_menu, user_id)
                 await query.edit_message_text(text, reply_markup=keyboard)
             
             elif data.startswith('news_'):
                 if data == 'news_latest':
-                    text, keyboard = self.news_system.show_latest_news(user_id)
+                    text, keyboard = await self.async_db.run(self.news_system.show_latest_news, user_id)
                 elif data == 'news_critical':
-                    text, keyboard = self.news_system.show_critical_news(user_id)
+                    text, keyboard = await self.async_db.run(self.news_system.show_critical_news, user_id)
                 elif data == 'news_categories':
-                    text, keyboard = self.news_system.show_categories(user_id)
+                    text, keyboard = await self.async_db.run(self.news_system.show_categories, user_id)
                 else:
-                    news_id = int(data.split('_')[1])
-                    text, keyboard = self.news_system.show_news_details(user_id, news_id)
+                    # news_read_<id> من قوائم الأخبار ونتائج البحث
+                    news_id = int(data.rsplit('_', 1)[1])
+                    text, keyboard = await self.async_db.run(self.news_system.get_news_detail, user_id, news_id)
+                    if text is None:
+                        # الخبر حُذف بعد عرض القائمة
+                        text = await self.async_db.run(self.news_system.get_text, user_id, 'no_news')
+                        keyboard = await self.async_db.run(self.news_system.create_news_menu, user_id)
                 
                 await query.edit_message_text(text, reply_markup=keyboard)
             
             elif data == 'ai_chat':
-                text, keyboard = self.ai_chat_system.create_ai_chat_menu(user_id)
+                text, keyboard = await self.async_db.run(self.ai_chat_system.create_ai_chat_menu, user_id)
                 await query.edit_message_text(text, reply_markup=keyboard)
             
             elif data.startswith('ai_'):
                 if data == 'ai_clear':
-                    self.ai_chat_system.clear_conversation(user_id)
-                    text = self.ai_chat_system.get_text(user_id, 'chat_cleared')
-                    keyboard = self.ai_chat_system.create_ai_response_menu(user_id)
+                    await self.ai_chat_system.clear_conversation(user_id)
+                    text = await self.async_db.run(self.ai_chat_system.get_text, user_id, 'chat_cleared')
+                    keyboard = await self.async_db.run(self.ai_chat_system.create_ai_response_menu, user_id)
                     await query.edit_message_text(text, reply_markup=keyboard)
                 elif data.startswith('ai_ask_'):
                     question_type = data.split('_')[2]
-                    answer = self.ai_chat_system.get_predefined_answer(user_id, question_type)
-                    keyboard = self.ai_chat_system.create_ai_response_menu(user_id)
+                    answer = await self.ai_chat_system.get_predefined_answer(
+                        user_id, question_type, on_update=self.stream_updater(query.message)
+                    )
+                    keyboard = await self.async_db.run(self.ai_chat_system.create_ai_response_menu, user_id)
                     await query.edit_message_text(answer, reply_markup=keyboard)
             
             elif data == 'shop':
-                text, keyboard = self.shop_system.create_shop_menu(user_id)
+                text, keyboard = await self.async_db.run(self.shop_system.create_shop_menu, user_id)
                 await query.edit_message_text(text, reply_markup=keyboard)
             
             elif data.startswith('shop_'):
                 if data.startswith('shop_category_'):
                     category = data.split('_')[2]
-                    text, keyboard = self.shop_system.create_category_menu(user_id, category)
+                    text, keyboard = await self.async_db.run(self.shop_system.create_category_menu, user_id, category)
                 elif data.startswith('shop_item_'):
                     item_id = int(data.split('_')[2])
-                    text, keyboard = self.shop_system.create_item_details_menu(user_id, item_id)
+                    text, keyboard = await self.async_db.run(self.shop_system.create_item_details_menu, user_id, item_id)
                 elif data.startswith('shop_buy_'):
                     parts = data.split('_')
                     payment_method = parts[2]
                     item_id = int(parts[3])
-                    text, keyboard = self.shop_system.create_purchase_confirmation(user_id, item_id, payment_method)
+                    text, keyboard = await self.async_db.run(self.shop_system.create_purchase_confirmation, user_id, item_id, payment_method)
                 elif data.startswith('shop_confirm_'):
                     parts = data.split('_')
                     payment_method = parts[2]
                     item_id = int(parts[3])
                     
                     if payment_method == 'points':
-                        success, message = self.shop_system.process_points_purchase(user_id, item_id)
+                        success, message = await self.async_db.run(self.shop_system.process_points_purchase, user_id, item_id)
                         text = f"✅ {message}" if success else f"❌ {message}"
                         keyboard = [[InlineKeyboardButton("🔙 العودة للمتجر", callback_data='shop')]]
                     else:  # card payment
-                        payment_url = self.shop_system.create_stripe_payment_link(user_id, item_id)
+                        payment_url = await asyncio.to_thread(self.shop_system.create_stripe_payment_link, user_id, item_id)
                         if payment_url:
-                            text = f"💳 {self.shop_system.get_text(user_id, 'payment_link')}\n\n{payment_url}"
+                            payment_link_text = await self.async_db.run(self.shop_system.get_text, user_id, 'payment_link')
+                            text = f"💳 {payment_link_text}\n\n{payment_url}"
                         else:
                             text = "❌ فشل في إنشاء رابط الدفع"
                         keyboard = [[InlineKeyboardButton("🔙 العودة للمتجر", callback_data='shop')]]
                 elif data == 'shop_purchases':
-                    text, keyboard = self.shop_system.create_purchases_menu(user_id)
+                    text, keyboard = await self.async_db.run(self.shop_system.create_purchases_menu, user_id)
                 
                 await query.edit_message_text(text, reply_markup=keyboard)
             
+            elif data == 'points':
+                text, keyboard = await self.async_db.run(self.points_system.create_points_menu, user_id)
+                await query.edit_message_text(text, reply_markup=keyboard)
+            
+            elif data == 'points_history':
+                text, keyboard = await self.async_db.run(self.points_system.create_points_history_menu, user_id)
+                await query.edit_message_text(text, reply_markup=keyboard)
+            
+            elif data == 'referral_system':
+                text, keyboard = await self.async_db.run(self.points_system.create_referral_menu, user_id)
+                await query.edit_message_text(text, reply_markup=keyboard, parse_mode='Markdown')
+            
+            elif data == 'achievements':
+                text, keyboard = await self.async_db.run(self.points_system.create_achievements_menu, user_id)
+                await query.edit_message_text(text, reply_markup=keyboard)
+            
+            elif data.startswith('leaderboard'):
+                board = data.split('_')[1] if '_' in data else 'all'
+                text, keyboard = await self.async_db.run(self.points_system.create_leaderboard_menu, user_id, board)
+                await query.edit_message_text(text, reply_markup=keyboard)
+            
             elif data == 'profile':
-                text, keyboard = self.points_system.create_profile_menu(user_id)
+                text, keyboard = await self.async_db.run(self.points_system.create_profile_menu, user_id)
                 await query.edit_message_text(text, reply_markup=keyboard)
             
             elif data == 'settings':
-                text, keyboard = self.create_settings_menu(user_id)
+                text, keyboard = await self.async_db.run(self.create_settings_menu, user_id)
                 await query.edit_message_text(text, reply_markup=keyboard)
             
             elif data.startswith('lang_'):
                 lang = data.split('_')[1]
-                self.db.update_user_language(user_id, lang)
-                text = self.get_text(user_id, 'language_changed')
-                text, keyboard = self.create_main_menu(user_id)
+                await self.async_db.update_user_language(user_id, lang)
+                text = await self.async_db.run(self.get_text, user_id, 'language_changed')
+                text, keyboard = await self.async_db.run(self.create_main_menu, user_id)
                 await query.edit_message_text(text, reply_markup=keyboard)
             
             elif data == 'help':
-                text, keyboard = self.create_help_menu(user_id)
+                text, keyboard = await self.async_db.run(self.create_help_menu, user_id)
                 await query.edit_message_text(text, reply_markup=keyboard)
+            
+            elif data.startswith('search_page_'):
+                search_query = context.user_data.get(user_id, {}).get('search_query')
+                if search_query:
+                    page = int(data.split('_')[2])
+                    text, keyboard = await self.async_db.run(self.create_search_results, user_id, search_query, page)
+                    await query.edit_message_text(text, reply_markup=keyboard)
         
         except Exception as e:
             logger.error(f"Error in button callback: {e}")
+            error_text = await self.async_db.run(self.get_text, user_id, 'error_occurred')
+            main_menu_text = await self.async_db.run(self.get_text, user_id, 'main_menu')
             await query.edit_message_text(
-                self.get_text(user_id, 'error_occurred'),
+                error_text,
                 reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton(self.get_text(user_id, 'main_menu'), callback_data='main_menu')
+                    InlineKeyboardButton(main_menu_text, callback_data='main_menu')
                 ]])
             )
     
@@ -309,22 +390,43 @@ class CyberBotAI:
         if user_id in context.user_data and context.user_data[user_id].get('ai_chat_mode'):
             # إرسال السؤال للذكاء الاصطناعي
             thinking_msg = await update.message.reply_text(
-                self.ai_chat_system.get_text(user_id, 'thinking')
+                await self.async_db.run(self.ai_chat_system.get_text, user_id, 'thinking')
             )
             
-            answer = self.ai_chat_system.ask_ai(user_id, message_text)
-            keyboard = self.ai_chat_system.create_ai_response_menu(user_id)
+            answer = await self.ai_chat_system.ask_ai(
+                user_id, message_text, on_update=self.stream_updater(thinking_msg)
+            )
+            keyboard = await self.async_db.run(self.ai_chat_system.create_ai_response_menu, user_id)
             
             await thinking_msg.edit_text(answer, reply_markup=keyboard)
         else:
             # عرض القائمة الرئيسية
-            text, keyboard = self.create_main_menu(user_id)
+            text, keyboard = await self.async_db.run(self.create_main_menu, user_id)
             await update.message.reply_text(text, reply_markup=keyboard)
     
+    def stream_updater(self, message):
+        """دالة تعدّل الرسالة بالنص الجزئي أثناء بث إجابة الذكاء الاصطناعي"""
+        retry_at = 0.0
+        
+        async def update(text):
+            nonlocal retry_at
+            loop = asyncio.get_running_loop()
+            # عند تجاوز حد التعديلات نتخطى التحديثات حتى انتهاء المهلة بدلاً من الانتظار
+            if loop.time() < retry_at:
+                return
+            try:
+                await message.edit_text(text[:4000] + ' ▌')
+            except RetryAfter as e:
+                retry_at = loop.time() + e.retry_after
+            except BadRequest as e:
+                if 'not modified' not in str(e).lower():
+                    logger.warning(f"Failed to update streamed message: {e}")
+        
+        return update
+    
     def create_settings_menu(self, user_id):
         """إنشاء قائمة الإعدادات"""
-        user_info = self.db.get_user_info(user_id)
-        lang = user_info[4] if user_info else 'ar'
+        lang = self.db.get_user_language(user_id)
         
         text = "⚙️ الإعدادات\n\n" if lang == 'ar' else "⚙️ Settings\n\n"
         text += f"🌐 اللغة الحالية: {'العربية' if lang == 'ar' else 'English'}\n\n"
@@ -342,8 +444,7 @@ class CyberBotAI:
     
     def create_help_menu(self, user_id):
         """إنشاء قائمة المساعدة"""
-        user_info = self.db.get_user_info(user_id)
-        lang = user_info[4] if user_info else 'ar'
+        lang = self.db.get_user_language(user_id)
         
         if lang == 'ar':
             text = """❓ المساعدة والدعم
@@ -406,52 +507,102 @@ Technical support: @support_cyberbot"""
     
     def setup_handlers(self):
         """إعداد معالجات البوت"""
+        # تسجيل النشاط اليومي قبل كل تحديث (المجموعة -1 تعمل قبل المعالجات الأخرى)
+        self.application.add_handler(TypeHandler(Update, self.track_activity), group=-1)
         self.application.add_handler(CommandHandler("start", self.start_command))
+        self.application.add_handler(CommandHandler("search", self.search_command))
         self.application.add_handler(CallbackQueryHandler(self.button_callback))
         self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.message_handler))
     
     def setup_scheduled_tasks(self):
-        """إعداد المهام المجدولة"""
+        """إعداد المهام المجدولة (تعمل داخل حلقة أحداث البوت بعد تشغيله)"""
+        # جمع الأخبار كل 6 ساعات
+        self.scheduler.add_job(
+            'news_collection',
+            os.getenv('NEWS_COLLECTION_CRON', '0 */6 * * *'),
+            self.news_system.generate_daily_newsletter,
+            jitter=60, misfire_grace=3 * 3600
+        )
+        
         # النشرة اليومية في الساعة 8 مساءً
-        schedule.every().day.at("20:00").do(self.send_daily_newsletter)
+        self.scheduler.add_job(
+            'daily_newsletter',
+            CronSpec.daily_at(os.getenv('NEWSLETTER_TIME', '20:00')),
+            self.send_daily_newsletter,
+            misfire_grace=2 * 3600
+        )
         
-        # نسخ احتياطي يومي في الساعة 2 صباحاً
-        schedule.every().day.at("02:00").do(self.backup_database)
+        # الإشعارات المجدولة والإشعارات الجماعية التي حان موعدها
+        if os.getenv('NOTIFICATIONS_ENABLED', 'True').lower() == 'true':
+            self.scheduler.add_job(
+                'pending_notifications',
+                '* * * * *',
+                notification_system.process_pending_notifications,
+                misfire_grace=60
+            )
+        
+        # إعادة بناء لوحات المتصدرين لالتقاط تعديلات النقاط من خارج البوت (لوحة الإدارة)
+        self.scheduler.add_job(
+            'leaderboard_refresh',
+            os.getenv('LEADERBOARD_REFRESH_CRON', '0 * * * *'),
+            leaderboards.refresh,
+            misfire_grace=3600
+        )
         
-        # تشغيل المجدول في thread منفصل
-        def run_scheduler():
-            while True:
-                schedule.run_pending()
-                time.sleep(60)
+        # مطابقة أرصدة المستخدمين مع مجموع دفتر النقاط
+        self.scheduler.add_job(
+            'points_reconciliation',
+            os.getenv('POINTS_RECONCILE_CRON', '30 3 * * *'),
+            self.reconcile_points,
+            jitter=300, misfire_grace=12 * 3600
+        )
         
-        scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-        scheduler_thread.start()
+        # حفظ عدادات ذاكرة الإجابات المؤقتة وحذف الإجابات المنتهية مع تسجيل نسبة الإصابة
+        self.scheduler.add_job(
+            'ai_cache_maintenance',
+            os.getenv('AI_CACHE_MAINTENANCE_CRON', '*/30 * * * *'),
+            self.ai_chat_system.maintain_answer_cache,
+            misfire_grace=1800
+        )
+        
+        # حذف تجميعات التحليلات الساعية القديمة (التجميعات اليومية تبقى)
+        self.scheduler.add_job(
+            'analytics_rollup_prune',
+            '15 4 * * *',
+            self.prune_analytics_rollups,
+            jitter=300, misfire_grace=12 * 3600
+        )
+        
+        # نسخ احتياطي يومي في الساعة 2 صباحاً
+        if os.getenv('AUTO_BACKUP_ENABLED', 'True').lower() == 'true':
+            self.scheduler.add_job(
+                'database_backup',
+                CronSpec.daily_at(os.getenv('BACKUP_TIME', '02:00')),
+                self.backup_database,
+                jitter=300, misfire_grace=12 * 3600
+            )
     
-    def send_daily_newsletter(self):
+    async def send_daily_newsletter(self):
         """إرسال النشرة اليومية"""
         try:
             logger.info("Starting daily newsletter...")
             
-            # جمع الأخبار وإنشاء النشرة
-            newsletter = self.news_system.generate_daily_newsletter()
+            # جمع ما استجد من الأخبار (عمل متزامن طويل يُنفذ خارج حلقة الأحداث)
+            await asyncio.to_thread(self.news_system.generate_daily_newsletter)
             
-            if newsletter:
-                # الحصول على جميع المستخدمين المشتركين
-                subscribers = self.db.get_newsletter_subscribers()
-                
-                for user_id in subscribers:
-                    try:
-                        # إرسال النشرة للمستخدم
-                        self.application.bot.send_message(
-                            chat_id=user_id,
-                            text=newsletter,
-                            parse_mode='Markdown'
-                        )
-                        time.sleep(0.1)  # تجنب حدود التيليجرام
-                    except Exception as e:
-                        logger.error(f"Failed to send newsletter to {user_id}: {e}")
-                
-                logger.info(f"Newsletter sent to {len(subscribers)} subscribers")
+            # النشرة من أخبار آخر 24 ساعة المحفوظة، ومنها ما جمعته مهمة news_collection قبلها
+            messages = await self.async_db.run(self.news_system.create_newsletter_messages)
+            if not messages:
+                logger.info("No news saved in the last 24 hours, skipping daily newsletter")
+                return
+            
+            # البث للمشتركين على دفعات مع حفظ التقدم
+            broadcast_id = await self.broadcast_engine.create_broadcast(
+                'newsletter', messages, audience={'newsletter': True}
+            )
+            totals = await self.broadcast_engine.run(broadcast_id)
+            
+            logger.info(f"Newsletter broadcast {broadcast_id} finished: {totals}")
             
         except Exception as e:
             logger.error(f"Error in daily newsletter: {e}")
@@ -467,15 +618,42 @@ Technical support: @support_cyberbot"""
             # إنشاء مجلد النسخ الاحتياطية إذا لم يكن موجوداً
             os.makedirs(os.path.dirname(backup_path), exist_ok=True)
             
-            # نسخ قاعدة البيانات
-            import shutil
-            shutil.copy2(self.db.db_path, backup_path)
+            # نسخ قاعدة البيانات (نسخ الملف مباشرة يفقد ما لم يُدمج بعد من ملف WAL)
+            self.db.backup(backup_path)
             
             logger.info(f"Database backup created: {backup_path}")
             
         except Exception as e:
             logger.error(f"Error in database backup: {e}")
     
+    def reconcile_points(self):
+        """فحص الأرصدة مقابل دفتر النقاط على دفعات (وتصحيحها إذا فُعّل ذلك)"""
+        return self.db.ledger.reconcile(
+            chunk_size=int(os.getenv('POINTS_RECONCILE_CHUNK', '1000')),
+            repair=os.getenv('POINTS_RECONCILE_REPAIR', 'False').lower() == 'true'
+        )
+    
+    def prune_analytics_rollups(self):
+        """حذف تجميعات الساعات الأقدم من مدة الاحتفاظ"""
+        return analytics_system.prune_hourly_rollups(int(os.getenv('ANALYTICS_HOURLY_RETENTION_DAYS', '14')))
+    
+    async def post_init(self, application):
+        """بدء المهام المجدولة بعد تهيئة التطبيق داخل حلقة الأحداث"""
+        self.broadcast_engine.bot = application.bot
+        notification_system.bot_application = application
+        notification_system.queue.start()
+        # بناء لوحات المتصدرين في الذاكرة قبل أول طلب
+        await self.async_db.run(leaderboards.load)
+        await self.scheduler.start()
+        # استئناف البث الذي قُطع بإيقاف البوت
+        await self.broadcast_engine.resume_unfinished()
+    
+    async def shutdown(self, application):
+        """إغلاق الموارد غير المتزامنة عند إيقاف البوت"""
+        await self.scheduler.stop()
+        await notification_system.queue.stop()
+        await self.ai_chat_system.close()
+    
     def run(self):
         """تشغيل البوت"""
         logger.info("Starting CyberBot AI...")
@@ -487,6 +665,9 @@ Technical support: @support_cyberbot"""
         
         # تشغيل البوت
         self.application.run_polling(drop_pending_updates=True)
+        
+        # إيقاف خيوط قاعدة البيانات بعد توقف البوت
+        self.async_db.close()
 
 if __name__ == '__main__':
     try:
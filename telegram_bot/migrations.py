@@ -0,0 +1,448 @@
+"""ترحيلات مخطط قاعدة البيانات المرقّمة
+
+رقم إصدار المخطط يُحفظ في PRAGMA user_version، وكل ترحيل يُنفَّذ مرة واحدة داخل معاملة
+init_database نفسها (إذا فشل يُلغى مع رقم الإصدار). الترحيلات الجديدة تُضاف في نهاية MIGRATIONS.
+DatabaseManager._create_tables ينشئ المخطط الأساسي فقط (CREATE IF NOT EXISTS)، وكل ترقية لجدول
+موجود (عمود جديد، تحويل بيانات، فهرس على عمود مُضاف) تكون ترحيلاً هنا.
+
+فحص خطط الاستعلامات الساخنة (يفشل إذا احتاج أي منها قراءة جدول كاملاً):
+
+    python migrations.py --db cyberbot.db --check
+"""
+import argparse
+import logging
+import re
+import sys
+
+from analytics_rollups import rebuild_rollups
+from notification_planner import DEFAULT_TYPE_MASK, parse_clock, types_to_mask
+from referrals import MAX_DEPTH
+from search_index import SEARCH_COLUMNS, SEARCH_TABLES, normalize_sql
+
+logger = logging.getLogger(__name__)
+
+def add_column_if_missing(cursor, table, column, definition):
+    """إضافة عمود لجدول موجود مسبقاً؛ يعيد True إذا أُضيف العمود"""
+    columns = {row[1] for row in cursor.execute(f'PRAGMA table_info({table})')}
+    if column in columns:
+        return False
+    cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    return True
+
+def _has_unique_index(cursor, table, columns):
+    for index in cursor.execute(f'PRAGMA index_list({table})').fetchall():
+        if index[2] and [row[2] for row in cursor.execute(f'PRAGMA index_info({index[1]})')] == list(columns):
+            return True
+    return False
+
+def _column_type(cursor, table, column):
+    for row in cursor.execute(f'PRAGMA table_info({table})'):
+        if row[1] == column:
+            return row[2].upper()
+    return None
+
+def _reconcile_legacy_schema(cursor):
+    """توحيد قواعد البيانات التي أنشأها database_updated.py مع مخطط database.py"""
+    for table, column, definition in (
+        ('users', 'referred_by', 'INTEGER'),
+        ('users', 'streak_days', 'INTEGER DEFAULT 0'),
+        ('users', 'last_activity_date', 'DATE'),
+        ('lessons', 'category', 'TEXT'),
+        ('lessons', 'duration_minutes', 'INTEGER DEFAULT 15'),
+        ('user_progress', 'time_spent_minutes', 'INTEGER DEFAULT 0'),
+        ('shop_items', 'stock_quantity', 'INTEGER DEFAULT -1')
+    ):
+        add_column_if_missing(cursor, table, column, definition)
+
+    # تقدم واحد لكل مستخدم ودرس: إبقاء السجل المكتمل الأحدث ثم إضافة القيد المفقود في المخطط القديم
+    if not _has_unique_index(cursor, 'user_progress', ('user_id', 'lesson_id')):
+        cursor.execute('''
+            DELETE FROM user_progress WHERE id NOT IN (
+                SELECT id FROM (
+                    SELECT id, ROW_NUMBER() OVER (
+                        PARTITION BY user_id, lesson_id ORDER BY completed DESC, id DESC
+                    ) AS position
+                    FROM user_progress
+                ) WHERE position = 1
+            )
+        ''')
+        cursor.execute('''
+            CREATE UNIQUE INDEX idx_user_progress_user_lesson ON user_progress (user_id, lesson_id)
+        ''')
+
+    # معرّف الشراء نص (uuid من shop_system) بينما أنشأه database.py سابقاً رقماً تلقائياً
+    if _column_type(cursor, 'purchases', 'id') != 'TEXT':
+        cursor.execute('ALTER TABLE purchases RENAME TO purchases_old')
+        cursor.execute('''
+            CREATE TABLE purchases (
+                id TEXT PRIMARY KEY,
+                user_id INTEGER,
+                item_id INTEGER,
+                payment_method TEXT,
+                amount_points INTEGER,
+                amount_usd REAL,
+                status TEXT DEFAULT 'pending',
+                purchase_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (user_id),
+                FOREIGN KEY (item_id) REFERENCES shop_items (id)
+            )
+        ''')
+        cursor.execute('''
+            INSERT INTO purchases (id, user_id, item_id, payment_method, amount_points, amount_usd, status, purchase_date)
+            SELECT CAST(id AS TEXT), user_id, item_id, payment_method, amount_points, amount_usd, status, purchase_date
+            FROM purchases_old
+        ''')
+        cursor.execute('DROP TABLE purchases_old')
+
+# فهارس الاستعلامات الساخنة (انظر HOT_QUERIES)؛ الأعمدة الإضافية تجعل الفهرس يغطي الاستعلام
+HOT_QUERY_INDEXES = (
+    ('idx_users_leaderboard', 'users', 'points DESC, total_lessons_completed DESC'),
+    ('idx_users_registration', 'users', 'registration_date'),
+    ('idx_points_history_user_date', 'points_history', 'user_id, date'),
+    ('idx_referrals_referrer', 'referrals', 'referrer_id, points_awarded'),
+    ('idx_lessons_level', 'lessons', 'level'),
+    ('idx_quizzes_lesson', 'quizzes', 'lesson_id'),
+    ('idx_shop_items_category', 'shop_items', 'category, price_usd'),
+    ('idx_purchases_user_date', 'purchases', 'user_id, purchase_date'),
+    ('idx_purchases_status_date', 'purchases', 'status, purchase_date'),
+    ('idx_user_activities_time', 'user_activities', 'timestamp, activity_type, user_id'),
+    ('idx_user_activities_user', 'user_activities', 'user_id, activity_type, timestamp'),
+    ('idx_notifications_created', 'notifications', 'created_at, notification_type')
+)
+
+def _add_hot_query_indexes(cursor):
+    for name, table, columns in HOT_QUERY_INDEXES:
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})')
+
+def _backfill_achievements(cursor):
+    """منح الإنجازات التي استوفاها المستخدمون قبل محرك الإنجازات (دون إشعارات)"""
+    cursor.execute('''
+        INSERT OR IGNORE INTO user_achievements (user_id, achievement_id)
+        SELECT user_id, 'first_lesson' FROM users WHERE total_lessons_completed >= 1
+        UNION ALL SELECT user_id, 'five_lessons' FROM users WHERE total_lessons_completed >= 5
+        UNION ALL SELECT user_id, 'points_collector' FROM users WHERE points >= 100
+        UNION ALL SELECT user_id, 'week_streak' FROM users WHERE streak_days >= 7
+        UNION ALL SELECT DISTINCT referrer_id, 'first_referral' FROM referrals WHERE referrer_id IS NOT NULL
+    ''')
+
+def _add_ledger_idempotency(cursor):
+    """مفاتيح عدم التكرار لقيود دفتر النقاط"""
+    add_column_if_missing(cursor, 'points_history', 'idempotency_key', 'TEXT')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_points_history_idempotency ON points_history (idempotency_key)
+        WHERE idempotency_key IS NOT NULL
+    ''')
+
+def _build_referral_stats(cursor):
+    """عدادات الإحالة في صف المستخدم وجدول إغلاق شجرة الإحالات من سجلات referrals الموجودة"""
+    for column in ('referral_count', 'referral_points', 'referral_network'):
+        add_column_if_missing(cursor, 'users', column, 'INTEGER DEFAULT 0')
+
+    # لكل مستخدم محيل واحد (أول إحالة مسجلة له)، والعمق محدود للحماية من الحلقات
+    cursor.execute('DELETE FROM referral_tree')
+    cursor.execute('''
+        WITH RECURSIVE edges(referrer_id, referred_id) AS (
+            SELECT referrer_id, referred_id FROM referrals
+            WHERE id IN (SELECT MIN(id) FROM referrals GROUP BY referred_id)
+              AND referrer_id IS NOT NULL AND referrer_id != referred_id
+        ),
+        tree(ancestor_id, descendant_id, depth) AS (
+            SELECT referrer_id, referred_id, 1 FROM edges
+            UNION
+            SELECT tree.ancestor_id, edges.referred_id, tree.depth + 1
+            FROM tree JOIN edges ON edges.referrer_id = tree.descendant_id
+            WHERE tree.depth < ? AND edges.referred_id != tree.ancestor_id
+        )
+        INSERT OR IGNORE INTO referral_tree (ancestor_id, descendant_id, depth)
+        SELECT ancestor_id, descendant_id, MIN(depth) FROM tree GROUP BY ancestor_id, descendant_id
+    ''', (MAX_DEPTH,))
+    cursor.execute('''
+        UPDATE users SET
+            referral_count = (SELECT COUNT(*) FROM referrals WHERE referrer_id = users.user_id),
+            referral_points = (SELECT COALESCE(SUM(points_awarded), 0) FROM referrals WHERE referrer_id = users.user_id),
+            referral_network = (SELECT COUNT(*) FROM referral_tree WHERE ancestor_id = users.user_id)
+    ''')
+
+def _build_analytics_rollups(cursor):
+    """بناء تجميعات التحليلات من السجل الموجود؛ فهرس الوقت على user_activities لم يعد يخدم التقارير"""
+    rebuild_rollups(cursor)
+    cursor.execute('DROP INDEX IF EXISTS idx_user_activities_time')
+
+def _add_user_account_columns(cursor):
+    """أعمدة users المفقودة في قواعد database.py القديمة (انتهاء VIP وآخر نشاط)"""
+    add_column_if_missing(cursor, 'users', 'vip_expires', 'TIMESTAMP')
+    add_column_if_missing(cursor, 'users', 'last_activity', 'TIMESTAMP')
+
+def _add_news_clustering(cursor):
+    """أعمدة تجميع الأخبار المكررة وربط الأخبار المحفوظة بمصادرها"""
+    added = [add_column_if_missing(cursor, 'news', column, definition) for column, definition in (
+        ('minhash', 'BLOB'),
+        ('cve_ids', 'TEXT'),
+        ('cluster_size', 'INTEGER DEFAULT 1')
+    )]
+    if any(added):
+        cursor.execute('''
+            INSERT OR IGNORE INTO news_sources (news_id, source_url, published_date)
+            SELECT id, source_url, published_date FROM news WHERE source_url IS NOT NULL
+        ''')
+
+def _create_search_triggers(cursor, table):
+    """قوادح تحديث فهرس الجدول؛ التوحيد بدوال SQL المدمجة فلا تحتاج الاتصالات دوال مخصصة"""
+    columns = ', '.join(SEARCH_COLUMNS)
+    values = ', '.join(normalize_sql(f'new.{column}') for column in SEARCH_COLUMNS)
+    cursor.execute(f'''
+        CREATE TRIGGER {table}_fts_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {table}_fts (rowid, {columns}) VALUES (new.id, {values});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER {table}_fts_delete AFTER DELETE ON {table} BEGIN
+            DELETE FROM {table}_fts WHERE rowid = old.id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER {table}_fts_update AFTER UPDATE OF {columns} ON {table} BEGIN
+            DELETE FROM {table}_fts WHERE rowid = old.id;
+            INSERT INTO {table}_fts (rowid, {columns}) VALUES (new.id, {values});
+        END
+    ''')
+
+def _build_search_index(cursor):
+    """فهرس البحث النصي للأخبار والدروس (نص موحّد تحدّثه القوادح؛ المقتطفات تُبنى من النص الأصلي)
+
+    القوادح تُستبدل والفهرس يُعاد بناؤه دائماً، فيصحح أيضاً القوادح القديمة التي استدعت دالة
+    normalize_ar المسجلة في التطبيق فقط وفشلت على الاتصالات الأخرى.
+    """
+    columns = ', '.join(SEARCH_COLUMNS)
+    for table in SEARCH_TABLES:
+        cursor.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(
+                {columns},
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+        ''')
+        for action in ('insert', 'delete', 'update'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {table}_fts_{action}')
+        _create_search_triggers(cursor, table)
+        cursor.execute(f'DELETE FROM {table}_fts')
+        cursor.execute(f'''
+            INSERT INTO {table}_fts (rowid, {columns})
+            SELECT id, {', '.join(normalize_sql(column) for column in SEARCH_COLUMNS)} FROM {table}
+        ''')
+
+def _add_broadcast_recipient_columns(cursor):
+    """الاشتراك في النشرة ووقت حظر البوت (يُستبعد من حظر البوت من البث ويُلغى اشتراكه)"""
+    add_column_if_missing(cursor, 'users', 'newsletter_subscribed', 'BOOLEAN DEFAULT TRUE')
+    add_column_if_missing(cursor, 'users', 'blocked_at', 'TIMESTAMP')
+
+def _add_notification_queue(cursor):
+    """ترقية جداول الإشعارات القديمة إلى طابور الإرسال (المحاولات، موعد الإتاحة، ومهلة الحجز)"""
+    added = [add_column_if_missing(cursor, 'notifications', column, definition) for column, definition in (
+        ('attempts', 'INTEGER NOT NULL DEFAULT 0'),
+        ('available_at', 'REAL'),
+        ('leased_until', 'REAL')
+    )]
+    if any(added):
+        cursor.execute('''
+            UPDATE notifications SET available_at = CAST(COALESCE(strftime('%s', scheduled_time, 'utc'), strftime('%s', 'now')) AS REAL)
+            WHERE available_at IS NULL AND sent = FALSE AND failed = FALSE
+        ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_notifications_queue ON notifications (available_at)
+        WHERE sent = FALSE AND failed = FALSE
+    ''')
+
+def _convert_notification_preferences(cursor):
+    """تحويل التفضيلات القديمة (أنواع مفصولة بفواصل وأوقات HH:MM) إلى قناع بتات ودقائق
+
+    ويُضاف broadcast_id للإشعارات المؤجلة لساعات الهدوء (نصها يُقرأ من سجل البث).
+    """
+    add_column_if_missing(cursor, 'notifications', 'broadcast_id', 'INTEGER')
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(user_notification_preferences)')}
+    if 'notification_types' in columns:
+        legacy_preferences = cursor.execute('''
+            SELECT user_id, notification_types, quiet_hours_start, quiet_hours_end
+            FROM user_notification_preferences
+        ''').fetchall()
+        cursor.execute('ALTER TABLE user_notification_preferences RENAME TO user_notification_preferences_old')
+        cursor.execute(f'''
+            CREATE TABLE user_notification_preferences (
+                user_id INTEGER PRIMARY KEY,
+                type_mask INTEGER NOT NULL DEFAULT {DEFAULT_TYPE_MASK},
+                quiet_hours_start INTEGER CHECK (quiet_hours_start BETWEEN 0 AND 1439),
+                quiet_hours_end INTEGER CHECK (quiet_hours_end BETWEEN 0 AND 1439),
+                timezone TEXT,
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        ''')
+        cursor.executemany('''
+            INSERT INTO user_notification_preferences (user_id, type_mask, quiet_hours_start, quiet_hours_end)
+            VALUES (?, ?, ?, ?)
+        ''', [(user_id, types_to_mask((types or '').split(',')), parse_clock(start), parse_clock(end))
+              for user_id, types, start, end in legacy_preferences])
+        cursor.execute('DROP TABLE user_notification_preferences_old')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_notification_prefs_timezone ON user_notification_preferences (timezone)
+        WHERE quiet_hours_start IS NOT NULL
+    ''')
+
+# (الإصدار، الوصف، دالة الترحيل)
+MIGRATIONS = (
+    (1, 'reconcile legacy schema', _reconcile_legacy_schema),
+    (2, 'hot query indexes', _add_hot_query_indexes),
+    (3, 'backfill achievements', _backfill_achievements),
+    (4, 'points ledger idempotency keys', _add_ledger_idempotency),
+    (5, 'referral counters and closure table', _build_referral_stats),
+    (6, 'analytics rollups', _build_analytics_rollups),
+    (7, 'user account columns', _add_user_account_columns),
+    (8, 'news clustering columns', _add_news_clustering),
+    (9, 'full-text search index', _build_search_index),
+    (10, 'broadcast recipient columns', _add_broadcast_recipient_columns),
+    (11, 'notification delivery queue', _add_notification_queue),
+    (12, 'notification preference masks', _convert_notification_preferences)
+)
+
+def schema_version(cursor):
+    return cursor.execute('PRAGMA user_version').fetchone()[0]
+
+def run_migrations(cursor):
+    """تنفيذ الترحيلات الأحدث من إصدار القاعدة؛ يعيد الإصدار الحالي"""
+    current = schema_version(cursor)
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info(f"Applying database migration {version}: {description}")
+        migrate(cursor)
+        cursor.execute(f'PRAGMA user_version = {int(version)}')
+        current = version
+    return current
+
+# الاستعلامات الساخنة كما تُنفَّذ في الوحدات (القيم مجرد أمثلة لفحص الخطة)
+HOT_QUERIES = (
+    ('points history', '''
+        SELECT points, reason, transaction_type, date FROM points_history
+        WHERE user_id = ? ORDER BY date DESC LIMIT 10
+    ''', (1,)),
+    ('ledger idempotency', 'SELECT 1 FROM points_history WHERE idempotency_key = ?', ('lesson:1:1',)),
+    ('referral stats', '''
+        SELECT referral_count, referral_points, referral_network FROM users WHERE user_id = ?
+    ''', (1,)),
+    ('referral levels', '''
+        SELECT depth, COUNT(*) FROM referral_tree WHERE ancestor_id = ? AND depth <= ? GROUP BY depth
+    ''', (1, 3)),
+    ('referral upline', '''
+        SELECT ancestor_id, depth FROM referral_tree WHERE descendant_id = ? ORDER BY depth
+    ''', (1,)),
+    ('referral code', 'SELECT user_id FROM users WHERE referral_code = ?', ('ABC123',)),
+    ('leaderboard', '''
+        SELECT user_id, first_name, points, total_lessons_completed FROM users
+        ORDER BY points DESC, total_lessons_completed DESC LIMIT 10
+    ''', ()),
+    ('new users', 'SELECT COUNT(*) FROM users WHERE registration_date >= ?', ('2024-01-01',)),
+    ('lessons by level', '''
+        SELECT l.id, up.completed FROM lessons l
+        LEFT JOIN user_progress up ON l.id = up.lesson_id AND up.user_id = ?
+        WHERE l.level = ? ORDER BY l.id
+    ''', (1, 'beginner')),
+    ('lesson progress', '''
+        SELECT completed FROM user_progress WHERE user_id = ? AND lesson_id = ?
+    ''', (1, 1)),
+    ('lesson quiz', 'SELECT * FROM quizzes WHERE lesson_id = ?', (1,)),
+    ('shop category', '''
+        SELECT id, name_ar, price_points, price_usd FROM shop_items
+        WHERE category = ? AND is_available = TRUE ORDER BY price_usd ASC
+    ''', ('courses',)),
+    ('purchase history', '''
+        SELECT p.id, s.name_ar, p.amount_usd, p.purchase_date FROM purchases p
+        JOIN shop_items s ON p.item_id = s.id
+        WHERE p.user_id = ? ORDER BY p.purchase_date DESC LIMIT 10
+    ''', (1,)),
+    ('revenue', 'SELECT SUM(revenue), SUM(sales) FROM revenue_rollups WHERE day >= ?', ('2024-01-01',)),
+    ('active users', '''
+        SELECT users FROM activity_rollups WHERE granularity = 'day' AND bucket >= ?
+    ''', ('2024-01-01',)),
+    ('popular activities', '''
+        SELECT activity_type, SUM(events) AS count FROM activity_rollups
+        WHERE granularity = 'day' AND bucket >= ?
+        GROUP BY activity_type ORDER BY count DESC LIMIT 10
+    ''', ('2024-01-01',)),
+    ('ai usage', '''
+        SELECT COALESCE(SUM(events), 0) FROM activity_rollups
+        WHERE granularity = 'day' AND bucket >= ? AND activity_type = 'ai_chat'
+    ''', ('2024-01-01',)),
+    ('hourly activity', '''
+        SELECT bucket, events, users FROM activity_rollups
+        WHERE granularity = 'hour' AND bucket > ? ORDER BY bucket
+    ''', ('2024-01-01 00',)),
+    ('user activity', '''
+        SELECT activity_type, COUNT(*) AS count FROM user_activities
+        WHERE user_id = ? GROUP BY activity_type ORDER BY count DESC
+    ''', (1,)),
+    ('last activity', 'SELECT MAX(timestamp) FROM user_activities WHERE user_id = ?', (1,)),
+    ('user achievements', 'SELECT achievement_id, unlocked_at FROM user_achievements WHERE user_id = ?', (1,)),
+    ('recent news', '''
+        SELECT id, title_ar, title_en FROM news WHERE published_date >= ?
+        ORDER BY cluster_size DESC, published_date DESC LIMIT 10
+    ''', ('2024-01-01',)),
+    ('notification queue', '''
+        SELECT id FROM notifications
+        WHERE sent = FALSE AND failed = FALSE AND available_at <= ?
+        ORDER BY available_at, id LIMIT 50
+    ''', (0,)),
+    ('notification stats', '''
+        SELECT notification_type, COUNT(*) AS count FROM notifications
+        WHERE created_at >= ? GROUP BY notification_type
+    ''', ('2024-01-01',)),
+    ('due broadcasts', '''
+        SELECT id FROM broadcasts WHERE status = 'pending' AND (scheduled_at IS NULL OR scheduled_at <= ?)
+        ORDER BY id
+    ''', (0,))
+)
+
+# "SCAN users" أو "SCAN TABLE users" (إصدارات SQLite الأقدم)، أو قراءة فهرس مغطٍّ كاملاً؛
+# أما "SCAN ... USING INDEX" فهي قراءة مرتبة تتوقف عند LIMIT (مثل لوحة المتصدرين)
+_FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?(?: USING COVERING INDEX \w+)?$')
+
+def full_table_scans(conn, sql, params=()):
+    """أسماء الجداول (أو أسمائها المستعارة) التي تُقرأ كاملة في خطة الاستعلام"""
+    scans = []
+    for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params):
+        match = _FULL_SCAN.match(row[3])
+        if match and match.group(1) != 'CONSTANT':
+            scans.append(match.group(1))
+    return scans
+
+def check_query_plans(conn, queries=HOT_QUERIES):
+    """فحص خطط الاستعلامات الساخنة؛ يعيد [(الاسم، الجداول المقروءة كاملة)] للاستعلامات المخالفة"""
+    failures = []
+    for name, sql, params in queries:
+        scans = full_table_scans(conn, sql, params)
+        if scans:
+            failures.append((name, scans))
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply database migrations and check hot query plans')
+    parser.add_argument('--db', default='cyberbot.db')
+    parser.add_argument('--check', action='store_true', help='fail if a hot query falls back to a full table scan')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    from database import DatabaseManager
+    database = DatabaseManager(args.db)
+    try:
+        with database.connection() as conn:
+            print(f"schema version: {schema_version(conn)}")
+            if not args.check:
+                return 0
+            failures = check_query_plans(conn)
+    finally:
+        database.close()
+
+    for name, scans in failures:
+        print(f"FULL SCAN {name}: {', '.join(scans)}")
+    print(f"{len(HOT_QUERIES) - len(failures)}/{len(HOT_QUERIES)} hot queries use an index")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+import re
+import zlib
+from array import array
+
+_CVE_PATTERN = re.compile(r'\bCVE-\d{4}-\d{4,7}\b', re.IGNORECASE)
+_WORD = re.compile(r'\w+')
+
+# معاملات دوال التجزئة العامة (a*x + b) mod p ثابتة حتى تبقى البصمات المحفوظة قابلة للمقارنة
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+def _hash_params(count, seed=0x5EED):
+    params = []
+    state = seed
+    for _ in range(count):
+        # مولد LCG بسيط وحتمي لا يعتمد على PYTHONHASHSEED
+        state = (state * 6364136223846793005 + 1442695040888963407) & ((1 << 64) - 1)
+        a = (state >> 16) % (_PRIME - 1) + 1
+        state = (state * 6364136223846793005 + 1442695040888963407) & ((1 << 64) - 1)
+        b = (state >> 16) % _PRIME
+        params.append((a, b))
+    return tuple(params)
+
+def load_signature(data):
+    """استعادة بصمة MinHash المحفوظة في عمود BLOB"""
+    signature = array('I')
+    signature.frombytes(data)
+    return signature
+
+def extract_cve_ids(text):
+    """معرّفات CVE المذكورة في النص (مفتاح قوي لتجميع الأخبار عن نفس الثغرة)"""
+    return frozenset(match.upper() for match in _CVE_PATTERN.findall(text or ''))
+
+class StoryClusterer:
+    """تجميع الأخبار المتقاربة من مصادر مختلفة باستخدام MinHash على مقاطع الكلمات ومعرّفات CVE"""
+
+    def __init__(self, num_hashes=64, shingle_size=3, threshold=0.6, max_cve_ids=3):
+        self.num_hashes = num_hashes
+        self.shingle_size = shingle_size
+        self.threshold = threshold
+        # الأخبار التي تذكر ثغرات كثيرة (مثل ملخصات التحديثات الشهرية) لا تُجمع بمعرّف CVE
+        self.max_cve_ids = max_cve_ids
+        self._params = _hash_params(num_hashes)
+
+    def shingles(self, text):
+        words = _WORD.findall(text.lower())
+        size = self.shingle_size
+        if len(words) < size:
+            return {' '.join(words)} if words else set()
+        return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+    def signature(self, text):
+        """بصمة MinHash للنص"""
+        hashes = [zlib.crc32(shingle.encode('utf-8')) for shingle in self.shingles(text)]
+        if not hashes:
+            return array('I', [_MAX_HASH] * self.num_hashes)
+        return array('I', (
+            min((a * h + b) % _PRIME for h in hashes) & _MAX_HASH
+            for a, b in self._params
+        ))
+
+    def similarity(self, signature, other):
+        """تقدير معامل Jaccard من نسبة تطابق قيم البصمتين"""
+        matches = sum(1 for x, y in zip(signature, other) if x == y)
+        return matches / self.num_hashes
+
+    def strong_keys(self, cve_ids):
+        return cve_ids if 0 < len(cve_ids) <= self.max_cve_ids else frozenset()
+
+    def is_duplicate(self, story, other):
+        if self.strong_keys(story['cve_ids']) & self.strong_keys(other['cve_ids']):
+            return True
+        return self.similarity(story['minhash'], other['minhash']) >= self.threshold
+
+    def prepare(self, news):
+        """إضافة البصمة ومعرّفات CVE إلى الخبر"""
+        text = f"{news['title']} {news['content']}"
+        news['minhash'] = self.signature(text)
+        news['cve_ids'] = extract_cve_ids(text)
+        return news
+
+    def cluster(self, news_items):
+        """تجميع الأخبار المتقاربة؛ يعيد قائمة بالخبر الممثل لكل مجموعة مع مصادرها وحجمها
+
+        عدد الأخبار في كل دورة صغير (بضع عشرات)، لذا تكفي المقارنة الزوجية مع اتحاد المجموعات.
+        """
+        items = [self.prepare(news) for news in news_items]
+        parent = list(range(len(items)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i in range(len(items)):
+            for j in range(i + 1, len(items)):
+                if find(i) != find(j) and self.is_duplicate(items[i], items[j]):
+                    parent[find(j)] = find(i)
+
+        groups = {}
+        for i, news in enumerate(items):
+            groups.setdefault(find(i), []).append(news)
+
+        stories = []
+        for members in groups.values():
+            # الخبر ذو المحتوى الأطول يُعتمد نسخةً ممثلة لأنه الأغنى بالتفاصيل للتلخيص
+            canonical = dict(max(members, key=lambda news: len(news['content'])))
+            canonical['sources'] = [(news['source'], news['url'], news['published_date']) for news in members]
+            canonical['cluster_size'] = len(members)
+            canonical['cve_ids'] = frozenset().union(*(news['cve_ids'] for news in members))
+            stories.append(canonical)
+        return stories
@@ -1,24 +1,33 @@
 import feedparser
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, wait
 from bs4 import BeautifulSoup
 from newspaper import Article
 import openai
 import os
 from datetime import datetime, timedelta
 from database import db
-import schedule
+from i18n import catalog
+from content_cache import ContentCache
+from news_clustering import StoryClusterer, load_signature
 import time
 import threading
 import logging
 
 logger = logging.getLogger(__name__)
 
+# تُرفع عند تعديل نص الطلب حتى لا تُستخدم النتائج المخزنة بالصيغة القديمة
+SUMMARY_PROMPT_VERSION = 1
+TRANSLATION_PROMPT_VERSION = 1
+
 class NewsSystem:
     def __init__(self):
         self.db = db
         self.openai_client = openai.OpenAI(
             api_key=os.getenv('OPENAI_API_KEY'),
-            base_url=os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
+            base_url=os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1'),
+            max_retries=0  # إعادة المحاولة تتم في _complete
         )
         
         # مصادر الأخبار
@@ -30,98 +39,137 @@ class NewsSystem:
             'dark_reading': 'https://www.darkreading.com/rss.xml',
             'cisa_alerts': 'https://www.cisa.gov/cybersecurity-advisories/all.xml'
         }
+        
+        # جلسة HTTP مشتركة ومجمّع خيوط لجلب المصادر بالتوازي
+        self.fetch_timeout = float(os.getenv('NEWS_FETCH_TIMEOUT', 15))
+        workers = int(os.getenv('NEWS_FETCH_WORKERS', len(self.news_sources)))
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = 'CyberBotAI/1.0 (+news collector)'
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=1)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._fetch_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='news')
+        
+        # مرحلة الإثراء بالذكاء الاصطناعي: مهام متوازية محدودة مع مهلة وإعادة محاولة لكل مهمة
+        self.ai_timeout = float(os.getenv('NEWS_AI_TIMEOUT', 30))
+        self.ai_retries = int(os.getenv('NEWS_AI_RETRIES', 2))
+        self._ai_pool = ThreadPoolExecutor(
+            max_workers=int(os.getenv('NEWS_AI_WORKERS', 4)),
+            thread_name_prefix='news-ai'
+        )
+        
+        # نتائج التلخيص والترجمة السابقة مفهرسة ببصمة المحتوى (الأخبار المكررة بين المصادر)
+        self.content_cache = ContentCache(
+            self.db,
+            max_bytes=int(os.getenv('NEWS_CACHE_MAX_MB', 50)) * 1024 * 1024
+        )
+        
+        # تجميع الخبر نفسه من عدة مصادر قبل الإثراء، ومطابقته مع أخبار الأيام الأخيرة المحفوظة
+        self.clusterer = StoryClusterer(threshold=float(os.getenv('NEWS_DUPLICATE_THRESHOLD', 0.6)))
+        self.cluster_window_days = int(os.getenv('NEWS_CLUSTER_WINDOW_DAYS', 3))
+        
+        # جمع الأخبار من مهمتين مجدولتين مختلفتين لا يتداخل
+        self._collect_lock = threading.Lock()
     
     def get_text(self, user_id, key):
         """الحصول على النص حسب لغة المستخدم"""
-        user_info = self.db.get_user_info(user_id)
-        lang = user_info[4] if user_info else 'ar'
-        
-        texts = {
-            'ar': {
-                'daily_news': '📰 النشرة الإخبارية اليومية',
-                'latest_news': 'آخر الأخبار',
-                'news_categories': 'تصنيفات الأخبار',
-                'critical_alerts': '🚨 تنبيهات حرجة',
-                'security_updates': '🔒 تحديثات أمنية',
-                'threat_intelligence': '🎯 معلومات التهديدات',
-                'vulnerabilities': '🔓 الثغرات الأمنية',
-                'malware_analysis': '🦠 تحليل البرمجيات الخبيثة',
-                'no_news': 'لا توجد أخبار متاحة حالياً',
-                'loading_news': 'جاري تحميل الأخبار...',
-                'news_summary': 'ملخص الخبر',
-                'read_full': 'قراءة كاملة',
-                'back_to_news': '🔙 العودة للأخبار',
-                'main_menu': '🏠 القائمة الرئيسية',
-                'published': 'نُشر في:',
-                'source': 'المصدر:'
-            },
-            'en': {
-                'daily_news': '📰 Daily Newsletter',
-                'latest_news': 'Latest News',
-                'news_categories': 'News Categories',
-                'critical_alerts': '🚨 Critical Alerts',
-                'security_updates': '🔒 Security Updates',
-                'threat_intelligence': '🎯 Threat Intelligence',
-                'vulnerabilities': '🔓 Vulnerabilities',
-                'malware_analysis': '🦠 Malware Analysis',
-                'no_news': 'No news available at the moment',
-                'loading_news': 'Loading news...',
-                'news_summary': 'News Summary',
-                'read_full': 'Read Full',
-                'back_to_news': '🔙 Back to News',
-                'main_menu': '🏠 Main Menu',
-                'published': 'Published:',
-                'source': 'Source:'
-            }
-        }
-        
-        return texts.get(lang, texts['ar']).get(key, key)
+        return catalog.get_text(self.db.get_user_language(user_id), 'news', key)
+    
+    def format_text(self, user_id, key, *args):
+        """النص حسب لغة المستخدم بعد ملء حقوله بالقالب المُحلَّل مسبقاً"""
+        return catalog.format(self.db.get_user_language(user_id), 'news', key, *args)
     
-    def fetch_rss_news(self, source_name, rss_url, limit=5):
-        """جلب الأخبار من RSS"""
+    def fetch_rss_news(self, source_name, rss_url, limit=5, state=None):
+        """جلب الأخبار من RSS
+
+        state: (etag, last_modified) من آخر جلب لإرسال طلب شرطي؛ المصدر غير المتغير يعيد 304
+        يعيد (news_items, new_state) حيث new_state هو None إذا لم يتغير المصدر أو فشل الجلب
+        """
         try:
-            feed = feedparser.parse(rss_url)
-            news_items = []
+            headers = {}
+            if state:
+                etag, last_modified = state
+                if etag:
+                    headers['If-None-Match'] = etag
+                if last_modified:
+                    headers['If-Modified-Since'] = last_modified
+            
+            response = self.session.get(rss_url, headers=headers, timeout=self.fetch_timeout)
+            if response.status_code == 304:
+                logger.info(f"{source_name} not modified since last fetch")
+                return [], None
+            response.raise_for_status()
             
-            for entry in feed.entries[:limit]:
-                try:
-                    # استخراج المحتوى
-                    content = ""
-                    if hasattr(entry, 'summary'):
-                        content = entry.summary
-                    elif hasattr(entry, 'description'):
-                        content = entry.description
-                    
-                    # تنظيف المحتوى من HTML
-                    if content:
-                        soup = BeautifulSoup(content, 'html.parser')
-                        content = soup.get_text().strip()
-                    
-                    # تاريخ النشر
-                    published_date = datetime.now()
-                    if hasattr(entry, 'published_parsed') and entry.published_parsed:
-                        published_date = datetime(*entry.published_parsed[:6])
-                    
-                    news_item = {
-                        'title': entry.title,
-                        'content': content,
-                        'url': entry.link,
-                        'source': source_name,
-                        'published_date': published_date,
-                        'category': self.categorize_news(entry.title + " " + content)
-                    }
-                    
-                    news_items.append(news_item)
-                    
-                except Exception as e:
-                    logger.error(f"Error processing RSS entry: {e}")
-                    continue
+            feed = feedparser.parse(response.content, response_headers=dict(response.headers))
+            news_items = self.parse_feed_entries(source_name, feed, limit)
             
-            return news_items
+            new_state = (response.headers.get('ETag'), response.headers.get('Last-Modified'))
+            return news_items, new_state
             
         except Exception as e:
             logger.error(f"Error fetching RSS from {rss_url}: {e}")
-            return []
+            return [], None
+    
+    def parse_feed_entries(self, source_name, feed, limit=5):
+        """تحويل عناصر الخلاصة إلى أخبار مع تنظيف المحتوى من HTML"""
+        news_items = []
+        
+        for entry in feed.entries[:limit]:
+            try:
+                # استخراج المحتوى
+                content = ""
+                if hasattr(entry, 'summary'):
+                    content = entry.summary
+                elif hasattr(entry, 'description'):
+                    content = entry.description
+                
+                # تنظيف المحتوى من HTML
+                if content:
+                    soup = BeautifulSoup(content, 'html.parser')
+                    content = soup.get_text().strip()
+                
+                # تاريخ النشر
+                published_date = datetime.now()
+                if hasattr(entry, 'published_parsed') and entry.published_parsed:
+                    published_date = datetime(*entry.published_parsed[:6])
+                
+                news_item = {
+                    'title': entry.title,
+                    'content': content,
+                    'url': entry.link,
+                    'source': source_name,
+                    'published_date': published_date,
+                    'category': self.categorize_news(entry.title + " " + content)
+                }
+                
+                news_items.append(news_item)
+                
+            except Exception as e:
+                logger.error(f"Error processing RSS entry: {e}")
+                continue
+        
+        return news_items
+    
+    def get_feed_states(self):
+        """حالة الجلب الشرطي المحفوظة لكل مصدر: {source_name: (feed_url, etag, last_modified)}"""
+        with self.db.connection() as conn:
+            rows = conn.execute('SELECT source_name, feed_url, etag, last_modified FROM feed_state').fetchall()
+        return {row['source_name']: (row['feed_url'], row['etag'], row['last_modified']) for row in rows}
+    
+    def save_feed_states(self, states):
+        """حفظ ETag/Last-Modified للمصادر المتغيرة في معاملة واحدة"""
+        if not states:
+            return
+        with self.db.transaction() as conn:
+            conn.executemany('''
+                INSERT INTO feed_state (source_name, feed_url, etag, last_modified, last_checked)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (source_name) DO UPDATE SET
+                    feed_url = excluded.feed_url,
+                    etag = excluded.etag,
+                    last_modified = excluded.last_modified,
+                    last_checked = excluded.last_checked
+            ''', states)
     
     def categorize_news(self, text):
         """تصنيف الأخبار حسب المحتوى"""
@@ -151,9 +199,33 @@ class NewsSystem:
         else:
             return 'medium'
     
+    def _complete(self, messages, max_tokens, temperature):
+        """استدعاء OpenAI بمهلة لكل محاولة وإعادة المحاولة مع تأخير متزايد"""
+        for attempt in range(self.ai_retries + 1):
+            try:
+                response = self.openai_client.chat.completions.create(
+                    model="gpt-4o-mini",
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    timeout=self.ai_timeout
+                )
+                return response.choices[0].message.content.strip()
+            except Exception as e:
+                if attempt == self.ai_retries:
+                    raise
+                delay = 2 ** attempt
+                logger.warning(f"AI request failed ({e}), retrying in {delay}s")
+                time.sleep(delay)
+    
     def summarize_with_ai(self, title, content, target_language='ar'):
         """تلخيص الخبر باستخدام الذكاء الاصطناعي"""
         try:
+            source_text = f"{title}\n{content}"
+            cached = self.content_cache.get('summary', target_language, SUMMARY_PROMPT_VERSION, source_text)
+            if cached is not None:
+                return cached
+            
             prompt = f"""
             قم بتلخيص هذا الخبر الأمني باللغة {target_language}:
             
@@ -169,9 +241,8 @@ class NewsSystem:
             اجعل الملخص مفهوماً للمبتدئين في الأمن السيبراني.
             """
             
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
+            summary = self._complete(
+                [
                     {"role": "system", "content": "أنت خبير في الأمن السيبراني متخصص في تلخيص الأخبار الأمنية."},
                     {"role": "user", "content": prompt}
                 ],
@@ -179,7 +250,8 @@ class NewsSystem:
                 temperature=0.3
             )
             
-            return response.choices[0].message.content.strip()
+            self.content_cache.put('summary', target_language, SUMMARY_PROMPT_VERSION, source_text, summary)
+            return summary
             
         except Exception as e:
             logger.error(f"Error summarizing with AI: {e}")
@@ -188,14 +260,17 @@ class NewsSystem:
     def translate_content(self, content, target_language):
         """ترجمة المحتوى"""
         try:
+            cached = self.content_cache.get('translation', target_language, TRANSLATION_PROMPT_VERSION, content)
+            if cached is not None:
+                return cached
+            
             if target_language == 'ar':
                 prompt = f"ترجم هذا النص إلى العربية مع الحفاظ على المصطلحات التقنية:\n\n{content}"
             else:
                 prompt = f"Translate this text to English while preserving technical terms:\n\n{content}"
             
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
+            translation = self._complete(
+                [
                     {"role": "system", "content": "أنت مترجم متخصص في المصطلحات التقنية والأمن السيبراني."},
                     {"role": "user", "content": prompt}
                 ],
@@ -203,73 +278,165 @@ class NewsSystem:
                 temperature=0.2
             )
             
-            return response.choices[0].message.content.strip()
+            self.content_cache.put('translation', target_language, TRANSLATION_PROMPT_VERSION, content, translation)
+            return translation
             
         except Exception as e:
             logger.error(f"Error translating content: {e}")
             return content
     
     def collect_daily_news(self):
-        """جمع الأخبار اليومية من جميع المصادر"""
+        """جمع الأخبار اليومية من جميع المصادر بالتوازي"""
         all_news = []
+        feed_states = self.get_feed_states()
         
+        futures = {}
         for source_name, rss_url in self.news_sources.items():
             logger.info(f"Fetching news from {source_name}")
-            news_items = self.fetch_rss_news(source_name, rss_url)
+            saved = feed_states.get(source_name)
+            # الحالة المحفوظة صالحة فقط إذا لم يتغير رابط المصدر
+            state = saved[1:] if saved and saved[0] == rss_url else None
+            future = self._fetch_pool.submit(self.fetch_rss_news, source_name, rss_url, 5, state)
+            futures[future] = (source_name, rss_url)
+        
+        # مدة الجمع بقدر أبطأ مصدر، والمصادر المتأخرة عن المهلة تُتجاهل في هذه الدورة
+        done, not_done = wait(futures, timeout=self.fetch_timeout * 2)
+        for future in not_done:
+            logger.warning(f"Timed out fetching news from {futures[future][0]}")
+        
+        new_states = []
+        for future in done:
+            source_name, rss_url = futures[future]
+            news_items, new_state = future.result()
             all_news.extend(news_items)
+            if new_state:
+                new_states.append((source_name, rss_url) + new_state)
+        
+        self.save_feed_states(new_states)
         
-        # ترتيب الأخبار حسب الأهمية والتاريخ
-        all_news.sort(key=lambda x: (
+        # دمج الخبر المنشور في عدة مصادر في قصة واحدة
+        stories = self.clusterer.cluster(all_news)
+        
+        # ترتيب الأخبار حسب الأهمية ثم عدد المصادر التي نشرتها ثم التاريخ
+        stories.sort(key=lambda x: (
             0 if x['category'] == 'critical' else 1 if x['category'] == 'vulnerability' else 2,
+            -x['cluster_size'],
             -x['published_date'].timestamp()
         ))
         
-        return all_news[:10]  # أهم 10 أخبار
+        return stories[:10]  # أهم 10 أخبار
     
-    def save_news_to_db(self, news_items):
-        """حفظ الأخبار في قاعدة البيانات"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        
-        for news in news_items:
-            try:
-                # التحقق من وجود الخبر
-                cursor.execute('SELECT id FROM news WHERE source_url = ?', (news['url'],))
-                if cursor.fetchone():
-                    continue
-                
-                # تلخيص وترجمة المحتوى
-                summary_ar = self.summarize_with_ai(news['title'], news['content'], 'ar')
-                summary_en = self.summarize_with_ai(news['title'], news['content'], 'en')
-                
-                # ترجمة العنوان
-                title_ar = self.translate_content(news['title'], 'ar')
-                title_en = news['title']  # العنوان الأصلي عادة بالإنجليزية
-                
-                severity = self.get_severity_level(news['category'], news['content'])
-                
-                cursor.execute('''
-                    INSERT INTO news (title_ar, title_en, content_ar, content_en, 
-                                    source_url, category, severity, published_date)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (title_ar, title_en, summary_ar, summary_en, 
-                      news['url'], news['category'], severity, news['published_date']))
-                
-            except Exception as e:
-                logger.error(f"Error saving news to DB: {e}")
+    def filter_new_news(self, stories):
+        """فصل القصص الجديدة عن المحفوظة مسبقاً
+        
+        المصادر المحفوظة روابطها تُستبعد، والقصة التي يطابق أحد روابطها أو بصمتها خبراً من
+        الأيام الأخيرة تُربط مصادرها الجديدة به دون استدعاء الذكاء الاصطناعي.
+        يعيد (new_stories, attachments) حيث attachments صفوف (news_id, source_name, url, published_date)
+        """
+        urls = list({url for story in stories for _, url, _ in story['sources']})
+        if not urls:
+            return [], []
+        
+        cutoff = datetime.now() - timedelta(days=self.cluster_window_days)
+        placeholders = ','.join('?' * len(urls))
+        with self.db.connection() as conn:
+            rows = conn.execute(
+                f'SELECT source_url, news_id FROM news_sources WHERE source_url IN ({placeholders})', urls
+            ).fetchall()
+            recent = conn.execute('''
+                SELECT id, minhash, cve_ids FROM news
+                WHERE published_date >= ? AND minhash IS NOT NULL
+            ''', (cutoff.strftime('%Y-%m-%d %H:%M:%S'),)).fetchall()
+        stored = {row['source_url']: row['news_id'] for row in rows}
+        recent = [{
+            'id': row['id'],
+            'minhash': load_signature(row['minhash']),
+            'cve_ids': frozenset(filter(None, (row['cve_ids'] or '').split(',')))
+        } for row in recent]
+        
+        new_stories = []
+        attachments = []
+        seen = set()
+        for story in stories:
+            sources = [source for source in story['sources'] if source[1] not in stored and source[1] not in seen]
+            if not sources:
                 continue
+            seen.update(url for _, url, _ in sources)
+            
+            news_id = next((stored[url] for _, url, _ in story['sources'] if url in stored), None)
+            if news_id is None:
+                news_id = next((row['id'] for row in recent if self.clusterer.is_duplicate(story, row)), None)
+            
+            if news_id is not None:
+                attachments.extend((news_id,) + source for source in sources)
+            else:
+                story['sources'] = sources
+                new_stories.append(story)
         
-        conn.commit()
-        conn.close()
+        return new_stories, attachments
+    
+    def enrich_news(self, news_items):
+        """تلخيص وترجمة الأخبار بالتوازي؛ كل مهمة تعيد محتوى بديلاً عند الفشل"""
+        jobs = []
+        for news in news_items:
+            jobs.append((
+                self._ai_pool.submit(self.summarize_with_ai, news['title'], news['content'], 'ar'),
+                self._ai_pool.submit(self.summarize_with_ai, news['title'], news['content'], 'en'),
+                self._ai_pool.submit(self.translate_content, news['title'], 'ar')
+            ))
+        
+        rows = []
+        for news, (summary_ar_job, summary_en_job, title_ar_job) in zip(news_items, jobs):
+            summary_ar = summary_ar_job.result()
+            summary_en = summary_en_job.result()
+            title_ar = title_ar_job.result()
+            title_en = news['title']  # العنوان الأصلي عادة بالإنجليزية
+            
+            severity = self.get_severity_level(news['category'], news['content'])
+            rows.append((title_ar, title_en, summary_ar, summary_en,
+                         news['url'], news['category'], severity, news['published_date'],
+                         news['minhash'].tobytes(), ','.join(sorted(news['cve_ids'])), len(news['sources'])))
+        return rows
+    
+    def save_news_to_db(self, stories):
+        """حفظ القصص الجديدة في قاعدة البيانات وربط المصادر الإضافية بالأخبار الموجودة"""
+        new_stories, attachments = self.filter_new_news(stories)
+        if not new_stories and not attachments:
+            return 0
+        
+        # استدعاءات الذكاء الاصطناعي تتم كلها قبل فتح معاملة الكتابة
+        rows = self.enrich_news(new_stories)
+        
+        with self.db.transaction() as conn:
+            sources = list(attachments)
+            for story, row in zip(new_stories, rows):
+                news_id = conn.execute('''
+                    INSERT INTO news (title_ar, title_en, content_ar, content_en,
+                                    source_url, category, severity, published_date,
+                                    minhash, cve_ids, cluster_size)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', row).lastrowid
+                sources.extend((news_id,) + source for source in story['sources'])
+            
+            conn.executemany('''
+                INSERT OR IGNORE INTO news_sources (news_id, source_name, source_url, published_date)
+                VALUES (?, ?, ?, ?)
+            ''', sources)
+            # حجم المجموعة للأخبار الموجودة يُعاد حسابه من جدول المصادر
+            conn.executemany('''
+                UPDATE news SET cluster_size = (SELECT COUNT(*) FROM news_sources WHERE news_id = ?)
+                WHERE id = ?
+            ''', [(news_id, news_id) for news_id in {row[0] for row in attachments}])
+        
+        if attachments:
+            logger.info(f"Linked {len(attachments)} duplicate reports to existing news")
+        return len(rows)
     
     def get_latest_news(self, user_id, limit=5, category=None):
         """الحصول على آخر الأخبار"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        
         query = '''
             SELECT id, title_ar, title_en, content_ar, content_en, 
-                   source_url, category, severity, published_date
+                   source_url, category, severity, published_date, cluster_size
             FROM news 
         '''
         params = []
@@ -281,11 +448,8 @@ class NewsSystem:
         query += ' ORDER BY published_date DESC LIMIT ?'
         params.append(limit)
         
-        cursor.execute(query, params)
-        news_items = cursor.fetchall()
-        conn.close()
-        
-        return news_items
+        with self.db.connection() as conn:
+            return conn.execute(query, params).fetchall()
     
     def create_news_menu(self, user_id):
         """إنشاء قائمة الأخبار"""
@@ -314,8 +478,7 @@ class NewsSystem:
             keyboard = [[InlineKeyboardButton(self.get_text(user_id, 'back_to_news'), callback_data='news')]]
             return text, InlineKeyboardMarkup(keyboard)
         
-        user_info = self.db.get_user_info(user_id)
-        lang = user_info[4] if user_info else 'ar'
+        lang = self.db.get_user_language(user_id)
         
         text = f"{self.get_text(user_id, 'latest_news')}\n\n"
         keyboard = []
@@ -331,7 +494,10 @@ class NewsSystem:
             
             # تقصير العنوان للعرض
             display_title = title[:50] + "..." if len(title) > 50 else title
-            text += f"{severity_emoji} {display_title}\n"
+            text += f"{severity_emoji} {display_title}"
+            if news[9] > 1:
+                text += f" ({self.format_text(user_id, 'reported_by', news[9])})"
+            text += "\n"
             
             # إضافة زر للخبر
             keyboard.append([InlineKeyboardButton(f"📖 {i+1}", callback_data=f"news_read_{news[0]}")])
@@ -344,21 +510,22 @@ class NewsSystem:
         """الحصول على تفاصيل خبر معين"""
         from telegram import InlineKeyboardButton, InlineKeyboardMarkup
         
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT title_ar, title_en, content_ar, content_en, 
-                   source_url, category, severity, published_date
-            FROM news WHERE id = ?
-        ''', (news_id,))
-        news = cursor.fetchone()
-        conn.close()
+        with self.db.connection() as conn:
+            news = conn.execute('''
+                SELECT title_ar, title_en, content_ar, content_en, 
+                       source_url, category, severity, published_date, cluster_size
+                FROM news WHERE id = ?
+            ''', (news_id,)).fetchone()
+            other_sources = conn.execute('''
+                SELECT source_url FROM news_sources
+                WHERE news_id = ? AND source_url IS NOT ?
+                ORDER BY published_date
+            ''', (news_id, news[4] if news else None)).fetchall()
         
         if not news:
             return None, None
         
-        user_info = self.db.get_user_info(user_id)
-        lang = user_info[4] if user_info else 'ar'
+        lang = self.db.get_user_language(user_id)
         
         title = news[0] if lang == 'ar' else news[1]
         content = news[2] if lang == 'ar' else news[3]
@@ -378,6 +545,10 @@ class NewsSystem:
         text += f"{content}\n\n"
         text += f"📅 {self.get_text(user_id, 'published')} {formatted_date}\n"
         text += f"🔗 {self.get_text(user_id, 'source')}: {news[4]}"
+        if news[8] > 1:
+            text += f"\n\n📡 {self.format_text(user_id, 'reported_by', news[8])}"
+            for (url,) in other_sources:
+                text += f"\n• {url}"
         
         keyboard = [
             [InlineKeyboardButton(self.get_text(user_id, 'back_to_news'), callback_data='news_latest')]
@@ -389,34 +560,49 @@ class NewsSystem:
         """إنشاء النشرة الإخبارية اليومية"""
         logger.info("Generating daily newsletter...")
         
-        # جمع الأخبار
-        news_items = self.collect_daily_news()
-        
-        if news_items:
-            # حفظ في قاعدة البيانات
-            self.save_news_to_db(news_items)
-            logger.info(f"Saved {len(news_items)} news items to database")
+        with self._collect_lock:
+            # جمع الأخبار
+            news_items = self.collect_daily_news()
+            
+            if news_items:
+                # حفظ في قاعدة البيانات
+                saved = self.save_news_to_db(news_items)
+                logger.info(f"Saved {saved} new news items to database")
         
         return len(news_items)
     
-    def start_news_scheduler(self):
-        """بدء جدولة جمع الأخبار"""
-        # جدولة جمع الأخبار كل 6 ساعات
-        schedule.every(6).hours.do(self.generate_daily_newsletter)
-        
-        # جدولة النشرة اليومية في الساعة 8 مساءً
-        schedule.every().day.at("20:00").do(self.generate_daily_newsletter)
-        
-        def run_scheduler():
-            while True:
-                schedule.run_pending()
-                time.sleep(60)  # فحص كل دقيقة
-        
-        # تشغيل الجدولة في خيط منفصل
-        scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-        scheduler_thread.start()
-        
-        logger.info("News scheduler started")
+    def create_newsletter_messages(self, limit=10):
+        """نص النشرة اليومية بكل لغة مدعومة {اللغة: النص} من أخبار آخر 24 ساعة
+
+        الأخبار تُقرأ من القاعدة لا من نتيجة آخر جمع (المصادر التي جُمعت في دورة سابقة تعيد 304).
+        يعيد {} إذا لم تُحفظ أخبار في آخر 24 ساعة.
+        """
+        with self.db.connection() as conn:
+            rows = conn.execute('''
+                SELECT title_ar, title_en, severity, cluster_size FROM news
+                WHERE published_date >= ?
+                ORDER BY cluster_size DESC, published_date DESC
+                LIMIT ?
+            ''', (datetime.now() - timedelta(days=1), limit)).fetchall()
+        if not rows:
+            return {}
+        
+        messages = {}
+        for lang in catalog.languages:
+            text = f"{catalog.get_text(lang, 'news', 'daily_news')}\n\n"
+            for row in rows:
+                severity_emoji = {
+                    'critical': '🚨',
+                    'high': '🔴',
+                    'medium': '🟡',
+                    'low': '🟢'
+                }.get(row['severity'], '📰')
+                text += f"{severity_emoji} {row['title_ar'] if lang == 'ar' else row['title_en']}"
+                if row['cluster_size'] > 1:
+                    text += f" ({catalog.format(lang, 'news', 'reported_by', row['cluster_size'])})"
+                text += "\n"
+            messages[lang] = text
+        return messages
 
 # إنشاء مثيل من نظام الأخبار
 news_system = NewsSystem()
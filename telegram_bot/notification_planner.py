@@ -0,0 +1,138 @@
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# أنواع الإشعارات؛ ترتيبها يحدد رقم البت في type_mask ولا يجوز تغييره (يُضاف الجديد في النهاية)
+NOTIFICATION_TYPES = ('general', 'security', 'lesson', 'news', 'shop', 'achievement', 'reminder', 'broadcast')
+DEFAULT_NOTIFICATION_TYPES = ('general', 'security', 'achievement', 'reminder', 'broadcast')
+
+def type_bit(notification_type):
+    return 1 << NOTIFICATION_TYPES.index(notification_type)
+
+def types_to_mask(types):
+    mask = 0
+    for notification_type in types:
+        if notification_type in NOTIFICATION_TYPES:
+            mask |= type_bit(notification_type)
+    return mask
+
+def mask_to_types(mask):
+    return [notification_type for notification_type in NOTIFICATION_TYPES if mask & type_bit(notification_type)]
+
+DEFAULT_TYPE_MASK = types_to_mask(DEFAULT_NOTIFICATION_TYPES)
+
+def parse_clock(value):
+    """تحويل وقت بصيغة HH:MM (أو HH:MM:SS) إلى دقائق منذ منتصف الليل"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, int):
+        return value % 1440
+    hour, minute = (int(part) for part in str(value).split(':')[:2])
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"Invalid time: {value!r}")
+    return hour * 60 + minute
+
+def format_clock(minutes):
+    if minutes is None:
+        return None
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+class DeliveryPlanner:
+    """تحديد مستلمي دفعة إشعارات وموعد الإرسال لكل منهم في استعلام واحد
+
+    - نوع الإشعار يُطابق مع type_mask (بت لكل نوع) دون قراءة تفضيلات كل مستخدم على حدة
+    - فرق التوقيت يُحسب مرة لكل منطقة زمنية مميزة لدى من حدد ساعات الهدوء (وليس لكل مستخدم)
+    - من يقع الموعد ضمن ساعات هدوئه يُعاد له defer_until = نهاية ساعات الهدوء بتوقيته، وإلا NULL
+    """
+
+    def __init__(self, default_timezone='UTC'):
+        self.default_timezone = default_timezone
+
+    @staticmethod
+    def validate_timezone(name):
+        try:
+            ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError) as e:
+            raise ValueError(f"Unknown timezone: {name!r}") from e
+        return name
+
+    def _timezone_offsets(self, conn, at):
+        """فرق التوقيت بالدقائق عند اللحظة at لكل منطقة زمنية مستخدمة مع ساعات الهدوء"""
+        rows = conn.execute('''
+            SELECT DISTINCT COALESCE(timezone, ?) FROM user_notification_preferences
+            WHERE quiet_hours_start IS NOT NULL
+        ''', (self.default_timezone,)).fetchall()
+        moment = datetime.fromtimestamp(at, timezone.utc)
+        offsets = []
+        for (name,) in rows:
+            try:
+                offset = moment.astimezone(ZoneInfo(name)).utcoffset()
+            except (ZoneInfoNotFoundError, ValueError):
+                logger.warning(f"Ignoring unknown timezone {name!r} in notification preferences")
+                continue
+            offsets.append((name, int(offset.total_seconds() // 60)))
+        return offsets
+
+    def recipients_query(self, conn, at, notification_type=None, where='1', params=(), after_user_id=0, limit=None):
+        """استعلام (sql, params) يعيد user_id و language و defer_until للمستلمين مرتبين حسب user_id
+
+        where شرط إضافي على جدول المستخدمين (بالاسم المستعار u)؛ at وقت الإرسال المطلوب (epoch)
+        """
+        at_minute = int(at // 60)
+        offsets = self._timezone_offsets(conn, at)
+
+        # المعاملات بترتيب ظهورها في الاستعلام: CTE ثم SELECT الخارجي ثم الداخلي ثم الشروط
+        cte_params, inner_params = [], []
+        if offsets:
+            values = ', '.join('(?, ?)' for _ in offsets)
+            cte = f'WITH tz (timezone, utc_offset) AS (VALUES {values})'
+            for offset in offsets:
+                cte_params.extend(offset)
+            local_minute = '((? + tz.utc_offset) % 1440 + 1440) % 1440'
+            timezone_join = 'LEFT JOIN tz ON tz.timezone = COALESCE(p.timezone, ?)'
+            inner_params.extend((at_minute, self.default_timezone))
+        else:
+            cte = ''
+            local_minute = 'NULL'
+            timezone_join = ''
+
+        conditions = ['u.user_id > ?', 'u.blocked_at IS NULL', f'({where})']
+        inner_params.append(after_user_id)
+        inner_params.extend(params)
+        if notification_type in NOTIFICATION_TYPES:
+            conditions.append('(COALESCE(p.type_mask, ?) & ?) != 0')
+            inner_params.extend((DEFAULT_TYPE_MASK, type_bit(notification_type)))
+
+        limit_clause = ''
+        if limit is not None:
+            limit_clause = 'LIMIT ?'
+            inner_params.append(limit)
+
+        sql = f'''
+            {cte}
+            SELECT user_id, language,
+                   CASE WHEN local_minute IS NULL OR quiet_start = quiet_end THEN NULL
+                        WHEN (quiet_start < quiet_end AND local_minute >= quiet_start AND local_minute < quiet_end)
+                          OR (quiet_start > quiet_end AND (local_minute >= quiet_start OR local_minute < quiet_end))
+                        THEN (? + (quiet_end - local_minute + 1440) % 1440) * 60
+                   END AS defer_until
+            FROM (
+                SELECT u.user_id, u.language, p.quiet_hours_start AS quiet_start, p.quiet_hours_end AS quiet_end,
+                       CASE WHEN p.quiet_hours_start IS NOT NULL AND p.quiet_hours_end IS NOT NULL
+                            THEN {local_minute} END AS local_minute
+                FROM users u
+                LEFT JOIN user_notification_preferences p ON p.user_id = u.user_id
+                {timezone_join}
+                WHERE {' AND '.join(conditions)}
+                ORDER BY u.user_id
+                {limit_clause}
+            )
+            ORDER BY user_id
+        '''
+        return sql, cte_params + [at_minute] + inner_params
+
+# مخطط الإرسال المشترك
+delivery_planner = DeliveryPlanner(os.getenv('NOTIFICATION_DEFAULT_TIMEZONE', 'UTC'))
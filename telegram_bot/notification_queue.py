@@ -0,0 +1,204 @@
+import asyncio
+import json
+import random
+import time
+import logging
+from datetime import datetime
+
+from broadcast import SENT, BLOCKED, RETRY
+
+logger = logging.getLogger(__name__)
+
+class NotificationQueue:
+    """طابور إرسال دائم فوق جدول notifications
+
+    - العامل يحجز دفعة من الإشعارات المستحقة (leased_until = الآن + مهلة الحجز) في معاملة واحدة؛
+      إذا توقف البوت قبل إكمالها تعود للطابور تلقائياً بعد انتهاء المهلة
+    - نتائج الدفعة تُحفظ بـ executemany في معاملة واحدة
+    - الأخطاء المؤقتة تُعاد بعد تأخير يتضاعف مع كل محاولة، وبعد max_attempts محاولات
+      يُعلَّم الإشعار failed (طابور الرسائل الميتة) مع آخر خطأ
+    """
+
+    def __init__(self, async_database, engine, formatter, batch_size=50, visibility_timeout=120,
+                 max_attempts=5, base_delay=30, max_delay=3600):
+        self.async_db = async_database
+        self.engine = engine
+        self.formatter = formatter
+        self.batch_size = batch_size
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._wakeup = asyncio.Event()
+        self._loop = None
+        self._worker = None
+        self._started_at = None
+
+        self.counters = {
+            'batches': 0, 'leased': 0, 'sent': 0, 'retried': 0,
+            'dead_lettered': 0, 'blocked': 0, 'expired_leases': 0
+        }
+
+    def _lease(self, now):
+        """حجز دفعة من الإشعارات المستحقة"""
+        with self.async_db.db.transaction() as conn:
+            # الإشعارات المؤجلة من بث جماعي تأخذ نصها من سجل البث بلغة المستخدم
+            rows = conn.execute('''
+                SELECT n.id, n.user_id, n.title, n.message, n.notification_type, n.priority, n.attempts,
+                       n.leased_until, n.broadcast_id, b.messages, b.parse_mode, u.language
+                FROM notifications n
+                LEFT JOIN broadcasts b ON b.id = n.broadcast_id
+                LEFT JOIN users u ON u.user_id = n.user_id AND n.broadcast_id IS NOT NULL
+                WHERE n.sent = FALSE AND n.failed = FALSE AND n.available_at <= ?
+                  AND (n.leased_until IS NULL OR n.leased_until <= ?)
+                ORDER BY n.available_at, n.id
+                LIMIT ?
+            ''', (now, now, self.batch_size)).fetchall()
+            conn.executemany('''
+                UPDATE notifications SET leased_until = ?, attempts = attempts + 1 WHERE id = ?
+            ''', [(now + self.visibility_timeout, row['id']) for row in rows])
+        self.counters['expired_leases'] += sum(1 for row in rows if row['leased_until'] is not None)
+        return rows
+
+    def _backoff(self, attempts):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * random.uniform(0.8, 1.2)
+
+    def _complete(self, rows, outcomes, now):
+        """حفظ نتائج الدفعة: مرسل، إعادة جدولة، أو طابور الرسائل الميتة"""
+        sent, retried, dead, blocked_users = [], [], [], []
+        for row in rows:
+            outcome = outcomes[row['id']]
+            attempts = row['attempts'] + 1
+            if outcome == SENT:
+                sent.append((datetime.fromtimestamp(now), row['id']))
+            elif outcome == RETRY and attempts < self.max_attempts:
+                retried.append((now + self._backoff(attempts), outcome, row['id']))
+            else:
+                dead.append((outcome, row['id']))
+                if outcome == BLOCKED:
+                    blocked_users.append((row['user_id'],))
+
+        with self.async_db.db.transaction() as conn:
+            conn.executemany('''
+                UPDATE notifications SET sent = TRUE, sent_at = ?, leased_until = NULL
+                WHERE id = ?
+            ''', sent)
+            conn.executemany('''
+                UPDATE notifications SET available_at = ?, error_message = ?, leased_until = NULL WHERE id = ?
+            ''', retried)
+            conn.executemany('''
+                UPDATE notifications SET failed = TRUE, error_message = ?, leased_until = NULL WHERE id = ?
+            ''', dead)
+            # المستخدم حظر البوت: إيقاف إرسال النشرة والبث إليه
+            conn.executemany('''
+                UPDATE users SET blocked_at = CURRENT_TIMESTAMP, newsletter_subscribed = FALSE
+                WHERE user_id = ? AND blocked_at IS NULL
+            ''', blocked_users)
+
+        self.counters['sent'] += len(sent)
+        self.counters['retried'] += len(retried)
+        self.counters['dead_lettered'] += len(dead)
+        self.counters['blocked'] += len(blocked_users)
+
+    async def _deliver(self, row):
+        if row['broadcast_id'] is not None:
+            text = self.engine.pick_message(json.loads(row['messages']), row['language'])
+            parse_mode = row['parse_mode']
+        else:
+            text = self.formatter(row['title'], row['message'], row['notification_type'], row['priority'])
+            parse_mode = 'Markdown'
+        try:
+            # إعادة المحاولة بعد الأخطاء المؤقتة تتم عبر الطابور بدلاً من حجز المرسل
+            return await self.engine.send(row['user_id'], text, parse_mode=parse_mode, max_attempts=1)
+        except Exception as e:
+            logger.error(f"Failed to deliver notification {row['id']}: {e}")
+            return RETRY
+
+    async def process_batch(self):
+        """إرسال دفعة واحدة؛ يعيد عدد الإشعارات التي حُجزت"""
+        rows = await self.async_db.run(self._lease, time.time())
+        if not rows:
+            return 0
+
+        outcomes = await asyncio.gather(*(self._deliver(row) for row in rows))
+        await self.async_db.run(self._complete, rows, dict(zip((row['id'] for row in rows), outcomes)), time.time())
+
+        self.counters['batches'] += 1
+        self.counters['leased'] += len(rows)
+        return len(rows)
+
+    async def drain(self):
+        """إرسال كل الإشعارات المستحقة الآن"""
+        total = 0
+        while True:
+            count = await self.process_batch()
+            total += count
+            if count < self.batch_size:
+                return total
+
+    async def _next_due_in(self):
+        row = await self.async_db.fetchone('''
+            SELECT MIN(COALESCE(MAX(available_at, leased_until), available_at)) AS due FROM notifications
+            WHERE sent = FALSE AND failed = FALSE
+        ''')
+        if row is None or row['due'] is None:
+            return None
+        return max(0.0, row['due'] - time.time())
+
+    def wake(self):
+        """تنبيه العامل بوجود إشعارات جديدة (آمن من أي خيط)"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self):
+        while True:
+            try:
+                self._wakeup.clear()
+                await self.drain()
+                # النوم حتى أقرب موعد إرسال (إشعار مجدول أو إعادة محاولة) أو حتى إضافة إشعار جديد
+                delay = await self._next_due_in()
+                await asyncio.wait_for(self._wakeup.wait(), timeout=min(delay if delay is not None else 300, 300))
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Notification queue error: {e}")
+                await asyncio.sleep(5)
+
+    def start(self):
+        if self._worker is None:
+            self._loop = asyncio.get_running_loop()
+            self._started_at = time.time()
+            self._worker = asyncio.create_task(self._run(), name='notification-queue')
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+
+    def requeue_dead_letters(self, notification_ids=None):
+        """إعادة الإشعارات الفاشلة (عدا من حظر البوت) إلى الطابور؛ يعيد عددها"""
+        query = '''
+            UPDATE notifications SET failed = FALSE, attempts = 0, available_at = ?, error_message = NULL
+            WHERE failed = TRUE AND sent = FALSE AND COALESCE(error_message, '') != ?
+        '''
+        params = [time.time(), BLOCKED]
+        if notification_ids:
+            query += f" AND id IN ({','.join('?' * len(notification_ids))})"
+            params.extend(notification_ids)
+        with self.async_db.db.transaction() as conn:
+            count = conn.execute(query, params).rowcount
+        self.wake()
+        return count
+
+    def stats(self):
+        uptime = time.time() - self._started_at if self._started_at else 0
+        return dict(
+            self.counters,
+            throughput=round(self.counters['sent'] / uptime, 2) if uptime else 0.0,
+            running=self._worker is not None and not self._worker.done()
+        )
@@ -1,8 +1,14 @@
 import sqlite3
 from datetime import datetime, timedelta
 import asyncio
+import json
+import os
 import logging
 from database import db
+from async_database import async_db
+from broadcast import broadcast_engine
+from notification_queue import NotificationQueue
+from notification_planner import DEFAULT_TYPE_MASK, format_clock, mask_to_types, parse_clock, types_to_mask
 
 logger = logging.getLogger(__name__)
 
@@ -10,162 +16,93 @@ class NotificationSystem:
     def __init__(self, bot_application=None):
         self.db = db
         self.bot_application = bot_application
+        self.engine = broadcast_engine
+        self.queue = NotificationQueue(
+            async_db,
+            broadcast_engine,
+            self.format_notification_message,
+            batch_size=int(os.getenv('NOTIFICATION_BATCH_SIZE', 50)),
+            visibility_timeout=int(os.getenv('NOTIFICATION_LEASE_TIMEOUT', 120)),
+            max_attempts=int(os.getenv('NOTIFICATION_MAX_ATTEMPTS', 5)),
+            base_delay=int(os.getenv('NOTIFICATION_RETRY_DELAY', 30))
+        )
+        self.engine.on_deferred = self.queue.wake
     
     def create_notification(self, user_id, title, message, notification_type='general', priority='normal', scheduled_time=None):
-        """إنشاء إشعار جديد"""
+        """إنشاء إشعار جديد (لا يُنشأ إذا عطّل المستخدم هذا النوع)"""
+        return self.create_notifications([user_id], title, message, notification_type, priority, scheduled_time) or None
+    
+    def create_notifications(self, user_ids, title, message, notification_type='general', priority='normal', scheduled_time=None):
+        """إنشاء الإشعار نفسه لمجموعة مستخدمين في استعلام واحد
+        
+        المستخدمون الذين عطّلوا هذا النوع يُستبعدون، ومن يقع موعد الإرسال ضمن ساعات هدوئه
+        يُؤجل إشعاره إلى نهايتها. يعيد معرّف الإشعار لمستخدم واحد أو عدد الإشعارات المُنشأة
+        """
         try:
-            conn = self.db.get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO notifications (user_id, title, message, notification_type, 
-                                         priority, scheduled_time, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (user_id, title, message, notification_type, priority, 
-                  scheduled_time or datetime.now(), datetime.now()))
-            
-            notification_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
+            with self.db.transaction() as conn:
+                created, notification_id = self.insert_notifications(
+                    conn, user_ids, title, message, notification_type, priority, scheduled_time
+                )
             
-            # إرسال فوري إذا لم يكن مجدولاً
-            if not scheduled_time:
-                asyncio.create_task(self.send_notification(notification_id))
+            # إرسال فوري إذا لم يكن مجدولاً (الطابور يرسل المجدول والمؤجل في موعده)
+            if created and not scheduled_time:
+                self.queue.wake()
             
-            return notification_id
+            if len(user_ids) == 1:
+                return notification_id if created else None
+            return created
             
         except Exception as e:
             logger.error(f"Error creating notification: {e}")
             return None
     
-    def create_broadcast_notification(self, title, message, target_criteria=None, scheduled_time=None):
-        """إنشاء إشعار جماعي"""
+    def insert_notifications(self, conn, user_ids, title, message, notification_type='general', priority='normal',
+                             scheduled_time=None):
+        """إدراج الإشعارات داخل معاملة قائمة (ليُحفظ الإشعار مع الحدث الذي سببه)؛ يعيد (العدد، آخر معرّف)
+        
+        الإرسال الفوري يحتاج queue.wake() بعد حفظ المعاملة
+        """
+        send_at = scheduled_time or datetime.now()
+        recipients_sql, recipients_params = self.engine.planner.recipients_query(
+            conn, send_at.timestamp(), notification_type,
+            'u.user_id IN (SELECT value FROM json_each(?))', [json.dumps(list(user_ids))]
+        )
+        cursor = conn.execute(f'''
+            INSERT INTO notifications (user_id, title, message, notification_type, 
+                                     priority, scheduled_time, created_at, available_at)
+            SELECT user_id, ?, ?, ?, ?, ?, ?, COALESCE(defer_until, ?)
+            FROM ({recipients_sql})
+        ''', [title, message, notification_type, priority, send_at, datetime.now(), send_at.timestamp()]
+           + recipients_params)
+        return cursor.rowcount, cursor.lastrowid
+    
+    def create_broadcast_notification(self, title, message, target_criteria=None, scheduled_time=None,
+                                      notification_type='broadcast'):
+        """إنشاء إشعار جماعي: سجل بث واحد يُرسل للمستلمين على دفعات مهما كان عددهم"""
         try:
-            conn = self.db.get_connection()
-            cursor = conn.cursor()
-            
-            # تحديد المستخدمين المستهدفين
-            if target_criteria:
-                query = "SELECT user_id FROM users WHERE "
-                conditions = []
-                params = []
-                
-                if target_criteria.get('level'):
-                    conditions.append("level = ?")
-                    params.append(target_criteria['level'])
-                
-                if target_criteria.get('is_vip') is not None:
-                    conditions.append("is_vip = ?")
-                    params.append(target_criteria['is_vip'])
-                
-                if target_criteria.get('min_points'):
-                    conditions.append("points >= ?")
-                    params.append(target_criteria['min_points'])
-                
-                if target_criteria.get('language'):
-                    conditions.append("language = ?")
-                    params.append(target_criteria['language'])
-                
-                if conditions:
-                    query += " AND ".join(conditions)
-                    cursor.execute(query, params)
-                else:
-                    cursor.execute("SELECT user_id FROM users")
-            else:
-                cursor.execute("SELECT user_id FROM users")
-            
-            target_users = [row[0] for row in cursor.fetchall()]
-            
-            # إنشاء إشعار لكل مستخدم
-            notification_ids = []
-            for user_id in target_users:
-                cursor.execute('''
-                    INSERT INTO notifications (user_id, title, message, notification_type, 
-                                             priority, scheduled_time, created_at, is_broadcast)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (user_id, title, message, 'broadcast', 'normal', 
-                      scheduled_time or datetime.now(), datetime.now(), True))
-                
-                notification_ids.append(cursor.lastrowid)
-            
-            conn.commit()
-            conn.close()
-            
-            # إرسال فوري إذا لم يكن مجدولاً
+            formatted_message = self.format_notification_message(title, message, notification_type, 'normal')
+            broadcast_id = self.engine.add_broadcast(
+                'notification',
+                formatted_message,
+                audience=dict(target_criteria or {}, notification_type=notification_type),
+                parse_mode='Markdown',
+                scheduled_at=scheduled_time.timestamp() if scheduled_time else None
+            )
+            
+            # إرسال فوري إذا لم يكن مجدولاً (وإلا يبدأ عند معالجة الإشعارات المعلقة في موعده)
             if not scheduled_time:
-                for notification_id in notification_ids:
-                    asyncio.create_task(self.send_notification(notification_id))
+                try:
+                    asyncio.get_running_loop()
+                except RuntimeError:
+                    pass
+                else:
+                    asyncio.create_task(self.engine.run(broadcast_id))
             
-            return notification_ids
+            return broadcast_id
             
         except Exception as e:
             logger.error(f"Error creating broadcast notification: {e}")
-            return []
-    
-    async def send_notification(self, notification_id):
-        """إرسال إشعار محدد"""
-        try:
-            if not self.bot_application:
-                logger.warning("Bot application not set, cannot send notification")
-                return False
-            
-            conn = self.db.get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT user_id, title, message, notification_type, priority
-                FROM notifications 
-                WHERE id = ? AND sent = FALSE
-            ''', (notification_id,))
-            
-            notification = cursor.fetchone()
-            if not notification:
-                conn.close()
-                return False
-            
-            user_id, title, message, notification_type, priority = notification
-            
-            # تنسيق الرسالة
-            formatted_message = self.format_notification_message(title, message, notification_type, priority)
-            
-            # إرسال الإشعار
-            try:
-                await self.bot_application.bot.send_message(
-                    chat_id=user_id,
-                    text=formatted_message,
-                    parse_mode='Markdown'
-                )
-                
-                # تحديث حالة الإرسال
-                cursor.execute('''
-                    UPDATE notifications 
-                    SET sent = TRUE, sent_at = ?
-                    WHERE id = ?
-                ''', (datetime.now(), notification_id))
-                
-                conn.commit()
-                conn.close()
-                
-                logger.info(f"Notification {notification_id} sent to user {user_id}")
-                return True
-                
-            except Exception as e:
-                logger.error(f"Failed to send notification {notification_id} to user {user_id}: {e}")
-                
-                # تسجيل فشل الإرسال
-                cursor.execute('''
-                    UPDATE notifications 
-                    SET failed = TRUE, error_message = ?
-                    WHERE id = ?
-                ''', (str(e), notification_id))
-                
-                conn.commit()
-                conn.close()
-                return False
-                
-        except Exception as e:
-            logger.error(f"Error sending notification {notification_id}: {e}")
-            return False
+            return None
     
     def format_notification_message(self, title, message, notification_type, priority):
         """تنسيق رسالة الإشعار"""
@@ -279,25 +216,23 @@ class NotificationSystem:
         return self.create_broadcast_notification(
             title=notification_title,
             message=message,
-            scheduled_time=None
+            scheduled_time=None,
+            notification_type='security'
         )
     
     def get_pending_notifications(self):
         """الحصول على الإشعارات المعلقة"""
         try:
-            conn = self.db.get_connection()
-            cursor = conn.cursor()
+            with self.db.connection() as conn:
+                rows = conn.execute('''
+                    SELECT id, user_id, title, message, notification_type, priority, scheduled_time, attempts
+                    FROM notifications 
+                    WHERE sent = FALSE AND failed = FALSE 
+                    AND available_at <= ?
+                    ORDER BY available_at
+                ''', (datetime.now().timestamp(),)).fetchall()
             
-            cursor.execute('''
-                SELECT id, user_id, title, message, notification_type, priority, scheduled_time
-                FROM notifications 
-                WHERE sent = FALSE AND failed = FALSE 
-                AND scheduled_time <= ?
-                ORDER BY priority DESC, scheduled_time ASC
-            ''', (datetime.now(),))
-            
-            notifications = [dict(row) for row in cursor.fetchall()]
-            conn.close()
+            notifications = [dict(row) for row in rows]
             
             return notifications
             
@@ -306,65 +241,52 @@ class NotificationSystem:
             return []
     
     async def process_pending_notifications(self):
-        """معالجة الإشعارات المعلقة"""
-        pending = self.get_pending_notifications()
-        
-        for notification in pending:
-            await self.send_notification(notification['id'])
-            # تأخير قصير لتجنب حدود التيليجرام
-            await asyncio.sleep(0.1)
+        """معالجة الإشعارات المعلقة والإشعارات الجماعية التي حان موعدها"""
+        await self.engine.run_due()
+        await self.queue.drain()
     
     def get_user_notification_preferences(self, user_id):
         """الحصول على تفضيلات الإشعارات للمستخدم"""
         try:
-            conn = self.db.get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT notification_types, quiet_hours_start, quiet_hours_end
-                FROM user_notification_preferences 
-                WHERE user_id = ?
-            ''', (user_id,))
-            
-            result = cursor.fetchone()
-            conn.close()
-            
-            if result:
-                return {
-                    'notification_types': result[0].split(',') if result[0] else [],
-                    'quiet_hours_start': result[1],
-                    'quiet_hours_end': result[2]
-                }
-            else:
-                # إعدادات افتراضية
-                return {
-                    'notification_types': ['general', 'security', 'achievement', 'reminder'],
-                    'quiet_hours_start': None,
-                    'quiet_hours_end': None
-                }
-                
+            with self.db.connection() as conn:
+                result = conn.execute('''
+                    SELECT type_mask, quiet_hours_start, quiet_hours_end, timezone
+                    FROM user_notification_preferences 
+                    WHERE user_id = ?
+                ''', (user_id,)).fetchone()
         except Exception as e:
             logger.error(f"Error getting notification preferences: {e}")
+            result = None
+        
+        if result:
             return {
-                'notification_types': ['general', 'security', 'achievement', 'reminder'],
-                'quiet_hours_start': None,
-                'quiet_hours_end': None
+                'notification_types': mask_to_types(result['type_mask']),
+                'quiet_hours_start': format_clock(result['quiet_hours_start']),
+                'quiet_hours_end': format_clock(result['quiet_hours_end']),
+                'timezone': result['timezone'] or self.engine.planner.default_timezone
             }
+        # إعدادات افتراضية
+        return {
+            'notification_types': mask_to_types(DEFAULT_TYPE_MASK),
+            'quiet_hours_start': None,
+            'quiet_hours_end': None,
+            'timezone': self.engine.planner.default_timezone
+        }
     
-    def update_user_notification_preferences(self, user_id, notification_types, quiet_hours_start=None, quiet_hours_end=None):
-        """تحديث تفضيلات الإشعارات للمستخدم"""
+    def update_user_notification_preferences(self, user_id, notification_types, quiet_hours_start=None, quiet_hours_end=None,
+                                             timezone=None):
+        """تحديث تفضيلات الإشعارات للمستخدم (الأوقات بصيغة HH:MM بتوقيت المستخدم)"""
         try:
-            conn = self.db.get_connection()
-            cursor = conn.cursor()
+            if timezone:
+                self.engine.planner.validate_timezone(timezone)
             
-            cursor.execute('''
-                INSERT OR REPLACE INTO user_notification_preferences 
-                (user_id, notification_types, quiet_hours_start, quiet_hours_end)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, ','.join(notification_types), quiet_hours_start, quiet_hours_end))
-            
-            conn.commit()
-            conn.close()
+            with self.db.transaction() as conn:
+                conn.execute('''
+                    INSERT OR REPLACE INTO user_notification_preferences 
+                    (user_id, type_mask, quiet_hours_start, quiet_hours_end, timezone)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (user_id, types_to_mask(notification_types), parse_clock(quiet_hours_start),
+                      parse_clock(quiet_hours_end), timezone))
             
             return True
             
@@ -375,35 +297,39 @@ class NotificationSystem:
     def get_notification_stats(self, days=30):
         """إحصائيات الإشعارات"""
         try:
-            conn = self.db.get_connection()
-            cursor = conn.cursor()
-            
             start_date = datetime.now() - timedelta(days=days)
             
-            # إجمالي الإشعارات
-            cursor.execute('''
-                SELECT 
-                    COUNT(*) as total,
-                    COUNT(CASE WHEN sent = TRUE THEN 1 END) as sent,
-                    COUNT(CASE WHEN failed = TRUE THEN 1 END) as failed
-                FROM notifications 
-                WHERE created_at >= ?
-            ''', (start_date,))
-            
-            stats = dict(cursor.fetchone())
-            
-            # الإشعارات حسب النوع
-            cursor.execute('''
-                SELECT notification_type, COUNT(*) as count
-                FROM notifications 
-                WHERE created_at >= ?
-                GROUP BY notification_type
-                ORDER BY count DESC
-            ''', (start_date,))
+            with self.db.connection() as conn:
+                cursor = conn.cursor()
+                
+                # إجمالي الإشعارات
+                cursor.execute('''
+                    SELECT 
+                        COUNT(*) as total,
+                        COUNT(CASE WHEN sent = TRUE THEN 1 END) as sent,
+                        COUNT(CASE WHEN failed = TRUE THEN 1 END) as failed,
+                        COUNT(CASE WHEN sent = FALSE AND failed = FALSE THEN 1 END) as pending,
+                        COUNT(CASE WHEN attempts > 1 THEN 1 END) as retried
+                    FROM notifications 
+                    WHERE created_at >= ?
+                ''', (start_date,))
+                
+                stats = dict(cursor.fetchone())
+                
+                # الإشعارات حسب النوع
+                cursor.execute('''
+                    SELECT notification_type, COUNT(*) as count
+                    FROM notifications 
+                    WHERE created_at >= ?
+                    GROUP BY notification_type
+                    ORDER BY count DESC
+                ''', (start_date,))
+                
+                stats['by_type'] = [dict(row) for row in cursor.fetchall()]
             
-            stats['by_type'] = [dict(row) for row in cursor.fetchall()]
+            # عدادات طابور الإرسال منذ تشغيل البوت
+            stats['queue'] = self.queue.stats()
             
-            conn.close()
             return stats
             
         except Exception as e:
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# نتائج قيد النقاط
+APPLIED = 'applied'
+DUPLICATE = 'duplicate'
+INSUFFICIENT = 'insufficient'
+UNKNOWN_USER = 'unknown_user'
+
+class LedgerEntry:
+    """قيد في دفتر النقاط: موجب عند الكسب وسالب عند الصرف
+
+    idempotency_key اختياري ويضمن تطبيق القيد مرة واحدة مهما تكرر إرساله
+    (مثل 'lesson:<user>:<lesson>' أو 'referral:<referred_user>')
+    history_id رقم سجل points_history بعد تطبيق القيد، يميّز التغيير عند إبلاغ المستمعين.
+    """
+
+    __slots__ = ('user_id', 'points', 'reason', 'idempotency_key', 'history_id')
+
+    def __init__(self, user_id, points, reason, idempotency_key=None):
+        self.user_id = user_id
+        self.points = points
+        self.reason = reason
+        self.idempotency_key = idempotency_key
+        self.history_id = None
+
+    def __repr__(self):
+        return f"LedgerEntry(user_id={self.user_id!r}, points={self.points!r}, key={self.idempotency_key!r})"
+
+def spend_outcome(result):
+    """تحويل نتيجة قيد الصرف إلى (نجاح، رسالة) كما تعيدها spend_points"""
+    if result == APPLIED:
+        return True, "Points deducted successfully"
+    if result == INSUFFICIENT:
+        return False, "Insufficient points"
+    return False, "Duplicate transaction" if result == DUPLICATE else "User not found"
+
+def post_entries(conn, entries):
+    """تطبيق القيود داخل معاملة الكتابة الحالية؛ يعيد نتيجة لكل قيد
+
+    الرصيد يُعدَّل بتحديث شرطي واحد (لا يصبح سالباً)، فلا فجوة بين القراءة والكتابة عند الصرف المتزامن،
+    وسجلات points_history للدفعة تُدرج معاً بـ executemany.
+    """
+    results, history, applied, seen_keys = [], [], [], set()
+    for entry in entries:
+        key = entry.idempotency_key
+        if key is not None:
+            if key in seen_keys or conn.execute(
+                'SELECT 1 FROM points_history WHERE idempotency_key = ?', (key,)
+            ).fetchone():
+                results.append(DUPLICATE)
+                continue
+
+        updated = conn.execute('''
+            UPDATE users SET points = COALESCE(points, 0) + ?
+            WHERE user_id = ? AND COALESCE(points, 0) + ? >= 0
+        ''', (entry.points, entry.user_id, entry.points)).rowcount
+        if not updated:
+            exists = conn.execute('SELECT 1 FROM users WHERE user_id = ?', (entry.user_id,)).fetchone()
+            results.append(INSUFFICIENT if exists else UNKNOWN_USER)
+            continue
+
+        if key is not None:
+            seen_keys.add(key)
+        history.append((entry.user_id, entry.points, entry.reason,
+                        'earned' if entry.points >= 0 else 'spent', key))
+        applied.append(entry)
+        results.append(APPLIED)
+
+    if history:
+        conn.executemany('''
+            INSERT INTO points_history (user_id, points, reason, transaction_type, idempotency_key)
+            VALUES (?, ?, ?, ?, ?)
+        ''', history)
+        # صفوف الدفعة تأخذ أرقاماً متتالية داخل معاملة الكاتب الوحيد
+        first_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0] - len(history) + 1
+        for offset, entry in enumerate(applied):
+            entry.history_id = first_id + offset
+    return results
+
+def find_mismatches(conn, after_user_id=0, limit=1000):
+    """مقارنة users.points بمجموع points_history لدفعة من المستخدمين مرتبة بـ user_id
+
+    يعيد (آخر user_id فُحص أو None عند انتهاء الجدول، [(user_id، الرصيد، مجموع الدفتر)] المختلفة)
+    """
+    rows = conn.execute('''
+        SELECT u.user_id, COALESCE(u.points, 0) AS balance,
+               COALESCE((SELECT SUM(h.points) FROM points_history h WHERE h.user_id = u.user_id), 0) AS ledger
+        FROM users u
+        WHERE u.user_id > ?
+        ORDER BY u.user_id
+        LIMIT ?
+    ''', (after_user_id, limit)).fetchall()
+    if not rows:
+        return None, []
+    return rows[-1][0], [tuple(row) for row in rows if row[1] != row[2]]
+
+class PointsLedger:
+    """خدمة دفتر النقاط: كل تغيير في النقاط يمر عبرها
+
+    post() يطبق دفعة قيود في معاملة واحدة ثم يبلغ مستمعي النقاط. العمليات التي تغيّر بيانات أخرى
+    مع النقاط (إكمال درس، تسجيل مستخدم) تستدعي post_entries() داخل معاملتها ثم committed().
+    """
+
+    def __init__(self, database):
+        self.db = database
+
+    def post(self, entries):
+        with self.db.transaction() as conn:
+            results = post_entries(conn, entries)
+        self.committed(entries, results)
+        return results
+
+    def committed(self, entries, results, lessons=None):
+        """إبطال الملفات المخزنة وإبلاغ المستمعين بالقيود المطبقة بعد حفظ المعاملة"""
+        for entry, result in zip(entries, results):
+            if result == APPLIED:
+                self.db.invalidate_user(entry.user_id)
+                self.db.points_changed(entry.user_id, entry.points, (lessons or {}).get(entry.user_id, 0),
+                                       entry.history_id)
+
+    def reconcile(self, chunk_size=1000, repair=False):
+        """فحص كل الأرصدة مقابل الدفتر على دفعات (قراءات قصيرة لا تحجز الكاتب)
+
+        عند repair يُصحَّح الرصيد إلى مجموع الدفتر فقط إذا لم يتغير منذ قراءته
+        """
+        checked, mismatches, repaired = 0, [], 0
+        after_user_id = 0
+        while True:
+            with self.db.connection() as conn:
+                last_user_id, chunk = find_mismatches(conn, after_user_id, chunk_size)
+            if last_user_id is None:
+                break
+            checked += 1
+            mismatches.extend(chunk)
+            after_user_id = last_user_id
+
+            if repair and chunk:
+                with self.db.transaction() as conn:
+                    repaired += sum(conn.execute(
+                        'UPDATE users SET points = ? WHERE user_id = ? AND COALESCE(points, 0) = ?',
+                        (ledger, user_id, balance)
+                    ).rowcount for user_id, balance, ledger in chunk)
+                self.db.invalidate_user(*[user_id for user_id, _, _ in chunk])
+
+        for user_id, balance, ledger in mismatches[:20]:
+            logger.warning(f"Points mismatch for user {user_id}: balance={balance} ledger={ledger}")
+        logger.info(f"Points reconciliation: {checked} chunks, {len(mismatches)} mismatches, {repaired} repaired")
+        return {'chunks': checked, 'mismatches': len(mismatches), 'repaired': repaired}
+
+class LedgerBatcher:
+    """تجميع القيود القادمة من المعالجات المتزامنة وحفظها في معاملة واحدة لكل دفعة
+
+    القيد ينتظر حتى window ثانية (أو حتى تمتلئ الدفعة) ثم تُحفظ الدفعة في خيط قاعدة البيانات
+    ويحصل كل مُرسل على نتيجة قيده.
+    """
+
+    def __init__(self, ledger, run, window=0.005, max_batch=200):
+        self.ledger = ledger
+        self.run = run
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = []
+        self._timer = None
+        self._commits = set()
+
+    async def submit(self, entry):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((entry, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._commit(batch))
+            self._commits.add(task)
+            task.add_done_callback(self._commits.discard)
+
+    async def _commit(self, batch):
+        try:
+            results = await self.run(self.ledger.post, [entry for entry, _ in batch])
+        except Exception as e:
+            logger.error(f"Failed to commit {len(batch)} ledger entries: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -1,5 +1,10 @@
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from database import db
+from leaderboard import leaderboards
+from achievements import ACHIEVEMENTS, EVENT_METRICS, achievement_engine
+from points_ledger import APPLIED, LedgerEntry, post_entries
+from referrals import creates_cycle, record_referral
+from i18n import catalog
 from datetime import datetime, timedelta
 
 class PointsSystem:
@@ -8,79 +13,19 @@ class PointsSystem:
     
     def get_text(self, user_id, key):
         """الحصول على النص حسب لغة المستخدم"""
-        user_info = self.db.get_user_info(user_id)
-        lang = user_info[4] if user_info else 'ar'
-        
-        texts = {
-            'ar': {
-                'points_menu': '⭐ النقاط والجوائز',
-                'current_points': 'نقاطك الحالية: {} نقطة',
-                'points_history': '📊 تاريخ النقاط',
-                'referral_system': '👥 نظام الإحالة',
-                'achievements': '🏆 الإنجازات',
-                'leaderboard': '🥇 لوحة المتصدرين',
-                'your_referral_code': 'كود الإحالة الخاص بك:',
-                'referral_instructions': 'شارك هذا الكود مع أصدقائك واحصل على 50 نقطة لكل صديق يسجل!',
-                'total_referrals': 'إجمالي الإحالات: {}',
-                'referral_earnings': 'النقاط من الإحالات: {}',
-                'recent_transactions': 'المعاملات الأخيرة:',
-                'no_transactions': 'لا توجد معاملات حتى الآن',
-                'earned': 'مكتسب',
-                'spent': 'مصروف',
-                'main_menu': '🏠 القائمة الرئيسية',
-                'back': '🔙 رجوع',
-                'achievement_unlocked': '🎉 تم فتح إنجاز جديد!',
-                'first_lesson': '📚 أول درس',
-                'first_lesson_desc': 'أكمل درسك الأول',
-                'five_lessons': '📚 خمسة دروس',
-                'five_lessons_desc': 'أكمل 5 دروس',
-                'first_referral': '👥 أول إحالة',
-                'first_referral_desc': 'احصل على أول إحالة',
-                'points_collector': '💰 جامع النقاط',
-                'points_collector_desc': 'اجمع 100 نقطة',
-                'week_streak': '🔥 أسبوع متواصل',
-                'week_streak_desc': 'ادخل لمدة 7 أيام متتالية'
-            },
-            'en': {
-                'points_menu': '⭐ Points & Rewards',
-                'current_points': 'Your current points: {} points',
-                'points_history': '📊 Points History',
-                'referral_system': '👥 Referral System',
-                'achievements': '🏆 Achievements',
-                'leaderboard': '🥇 Leaderboard',
-                'your_referral_code': 'Your referral code:',
-                'referral_instructions': 'Share this code with friends and get 50 points for each friend who registers!',
-                'total_referrals': 'Total referrals: {}',
-                'referral_earnings': 'Points from referrals: {}',
-                'recent_transactions': 'Recent transactions:',
-                'no_transactions': 'No transactions yet',
-                'earned': 'Earned',
-                'spent': 'Spent',
-                'main_menu': '🏠 Main Menu',
-                'back': '🔙 Back',
-                'achievement_unlocked': '🎉 New achievement unlocked!',
-                'first_lesson': '📚 First Lesson',
-                'first_lesson_desc': 'Complete your first lesson',
-                'five_lessons': '📚 Five Lessons',
-                'five_lessons_desc': 'Complete 5 lessons',
-                'first_referral': '👥 First Referral',
-                'first_referral_desc': 'Get your first referral',
-                'points_collector': '💰 Points Collector',
-                'points_collector_desc': 'Collect 100 points',
-                'week_streak': '🔥 Week Streak',
-                'week_streak_desc': 'Login for 7 consecutive days'
-            }
-        }
-        
-        return texts.get(lang, texts['ar']).get(key, key)
+        return catalog.get_text(self.db.get_user_language(user_id), 'points', key)
+    
+    def format_text(self, user_id, key, *args):
+        """النص حسب لغة المستخدم بعد ملء حقوله بالقالب المُحلَّل مسبقاً"""
+        return catalog.format(self.db.get_user_language(user_id), 'points', key, *args)
     
     def create_points_menu(self, user_id):
         """إنشاء قائمة النقاط والجوائز"""
-        user_info = self.db.get_user_info(user_id)
-        points = user_info[5] if user_info else 0
+        profile = self.db.get_user_profile(user_id)
+        points = profile.points if profile else 0
         
         text = f"{self.get_text(user_id, 'points_menu')}\n\n"
-        text += f"{self.get_text(user_id, 'current_points').format(points)}"
+        text += f"{self.format_text(user_id, 'current_points', points)}"
         
         keyboard = [
             [
@@ -98,17 +43,14 @@ class PointsSystem:
     
     def get_points_history(self, user_id, limit=10):
         """الحصول على تاريخ النقاط"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT points, reason, transaction_type, date 
-            FROM points_history 
-            WHERE user_id = ? 
-            ORDER BY date DESC 
-            LIMIT ?
-        ''', (user_id, limit))
-        history = cursor.fetchall()
-        conn.close()
+        with self.db.connection() as conn:
+            history = conn.execute('''
+                SELECT points, reason, transaction_type, date 
+                FROM points_history 
+                WHERE user_id = ? 
+                ORDER BY date DESC 
+                LIMIT ?
+            ''', (user_id, limit)).fetchall()
         
         if not history:
             return self.get_text(user_id, 'no_transactions')
@@ -140,27 +82,16 @@ class PointsSystem:
         return text, InlineKeyboardMarkup(keyboard)
     
     def get_referral_info(self, user_id):
-        """الحصول على معلومات الإحالة"""
-        user_info = self.db.get_user_info(user_id)
-        referral_code = user_info[8] if user_info else None
-        
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        
-        # عدد الإحالات
-        cursor.execute('SELECT COUNT(*) FROM referrals WHERE referrer_id = ?', (user_id,))
-        total_referrals = cursor.fetchone()[0]
-        
-        # النقاط من الإحالات
-        cursor.execute('SELECT SUM(points_awarded) FROM referrals WHERE referrer_id = ?', (user_id,))
-        referral_points = cursor.fetchone()[0] or 0
-        
-        conn.close()
+        """الحصول على معلومات الإحالة (عدادات مجمّعة في ملف المستخدم المخزن)"""
+        profile = self.db.get_user_profile(user_id)
+        if profile is None:
+            return {'referral_code': None, 'total_referrals': 0, 'referral_points': 0, 'referral_network': 0}
         
         return {
-            'referral_code': referral_code,
-            'total_referrals': total_referrals,
-            'referral_points': referral_points
+            'referral_code': profile.referral_code,
+            'total_referrals': profile.referral_count,
+            'referral_points': profile.referral_points,
+            'referral_network': profile.referral_network
         }
     
     def create_referral_menu(self, user_id):
@@ -171,8 +102,9 @@ class PointsSystem:
         text += f"{self.get_text(user_id, 'your_referral_code')}\n"
         text += f"`{referral_info['referral_code']}`\n\n"
         text += f"{self.get_text(user_id, 'referral_instructions')}\n\n"
-        text += f"{self.get_text(user_id, 'total_referrals').format(referral_info['total_referrals'])}\n"
-        text += f"{self.get_text(user_id, 'referral_earnings').format(referral_info['referral_points'])}"
+        text += f"{self.format_text(user_id, 'total_referrals', referral_info['total_referrals'])}\n"
+        text += f"{self.format_text(user_id, 'referral_earnings', referral_info['referral_points'])}\n"
+        text += f"{self.format_text(user_id, 'referral_network', referral_info['referral_network'])}"
         
         keyboard = [
             [InlineKeyboardButton(self.get_text(user_id, 'back'), callback_data='points')]
@@ -181,46 +113,20 @@ class PointsSystem:
         return text, InlineKeyboardMarkup(keyboard)
     
     def get_achievements(self, user_id):
-        """الحصول على الإنجازات"""
-        user_info = self.db.get_user_info(user_id)
-        total_lessons = user_info[10] if user_info else 0
-        points = user_info[5] if user_info else 0
-        
-        referral_info = self.get_referral_info(user_id)
-        total_referrals = referral_info['total_referrals']
+        """الحصول على الإنجازات (المفتوحة محفوظة عند حدوثها، فالعرض قراءة واحدة)"""
+        unlocked = achievement_engine.get_unlocked(user_id)
         
-        achievements = [
-            {
-                'id': 'first_lesson',
-                'name': self.get_text(user_id, 'first_lesson'),
-                'description': self.get_text(user_id, 'first_lesson_desc'),
-                'unlocked': total_lessons >= 1,
-                'emoji': '📚'
-            },
-            {
-                'id': 'five_lessons',
-                'name': self.get_text(user_id, 'five_lessons'),
-                'description': self.get_text(user_id, 'five_lessons_desc'),
-                'unlocked': total_lessons >= 5,
-                'emoji': '📚'
-            },
+        return [
             {
-                'id': 'first_referral',
-                'name': self.get_text(user_id, 'first_referral'),
-                'description': self.get_text(user_id, 'first_referral_desc'),
-                'unlocked': total_referrals >= 1,
-                'emoji': '👥'
-            },
-            {
-                'id': 'points_collector',
-                'name': self.get_text(user_id, 'points_collector'),
-                'description': self.get_text(user_id, 'points_collector_desc'),
-                'unlocked': points >= 100,
-                'emoji': '💰'
+                'id': rule.id,
+                'name': self.get_text(user_id, rule.id),
+                'description': self.get_text(user_id, f'{rule.id}_desc'),
+                'unlocked': rule.id in unlocked,
+                'unlocked_at': unlocked.get(rule.id),
+                'emoji': rule.emoji
             }
+            for rule in ACHIEVEMENTS
         ]
-        
-        return achievements
     
     def create_achievements_menu(self, user_id):
         """إنشاء قائمة الإنجازات"""
@@ -239,80 +145,109 @@ class PointsSystem:
         
         return text, InlineKeyboardMarkup(keyboard)
     
-    def get_leaderboard(self, user_id, limit=10):
-        """الحصول على لوحة المتصدرين"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT user_id, first_name, points, total_lessons_completed
-            FROM users 
-            ORDER BY points DESC, total_lessons_completed DESC
-            LIMIT ?
-        ''', (limit,))
-        leaderboard = cursor.fetchall()
-        conn.close()
-        
-        return leaderboard
+    def _with_names(self, entries):
+        """إضافة الأسماء لسجلات اللوحة في استعلام واحد"""
+        if not entries:
+            return []
+        user_ids = [entry[1] for entry in entries]
+        with self.db.connection() as conn:
+            names = dict(conn.execute(
+                f"SELECT user_id, first_name FROM users WHERE user_id IN ({','.join('?' * len(user_ids))})",
+                user_ids
+            ).fetchall())
+        return [(rank, uid, names.get(uid) or '', points, lessons) for rank, uid, points, lessons in entries]
+    
+    def get_leaderboard(self, user_id, limit=10, board='all'):
+        """الحصول على لوحة المتصدرين: [(الترتيب، user_id، الاسم، النقاط، الدروس)]"""
+        return self._with_names(leaderboards.top(board, limit))
     
-    def create_leaderboard_menu(self, user_id):
+    def get_leaderboard_position(self, user_id, board='all', radius=2):
+        """ترتيب المستخدم في اللوحة (None إن لم يكن فيها) ومن حوله"""
+        return leaderboards.rank(board, user_id), self._with_names(leaderboards.around(board, user_id, radius))
+    
+    def create_leaderboard_menu(self, user_id, board='all'):
         """إنشاء قائمة لوحة المتصدرين"""
-        leaderboard = self.get_leaderboard(user_id)
+        leaderboard = self.get_leaderboard(user_id, board=board)
+        rank, neighbors = self.get_leaderboard_position(user_id, board)
         
-        text = f"{self.get_text(user_id, 'leaderboard')}\n\n"
+        text = f"{self.get_text(user_id, 'leaderboard')} - {self.get_text(user_id, f'leaderboard_{board}')}\n\n"
         
         medals = ["🥇", "🥈", "🥉"]
         
-        for i, (uid, name, points, lessons) in enumerate(leaderboard):
-            rank = i + 1
-            medal = medals[i] if i < 3 else f"{rank}."
+        def entry_line(position, uid, name, points):
+            medal = medals[position - 1] if position <= 3 else f"{position}."
             
             # إخفاء الأسماء الطويلة
             display_name = name[:15] + "..." if len(name) > 15 else name
+            line = self.format_text(user_id, 'leaderboard_entry', medal, display_name, points)
             
             # تمييز المستخدم الحالي
-            if uid == user_id:
-                text += f"👤 {medal} {display_name} - {points} نقطة\n"
-            else:
-                text += f"{medal} {display_name} - {points} نقطة\n"
+            return f"👤 {line}\n" if uid == user_id else f"{line}\n"
+        
+        for position, uid, name, points, lessons in leaderboard:
+            text += entry_line(position, uid, name, points)
+        
+        if not leaderboard:
+            text += f"{self.get_text(user_id, 'leaderboard_empty')}\n"
+        
+        # المستخدم خارج القائمة الأولى: عرض ترتيبه ومن حوله
+        if rank is not None and rank > len(leaderboard):
+            text += "...\n"
+            for position, uid, name, points, lessons in neighbors:
+                if position > len(leaderboard):
+                    text += entry_line(position, uid, name, points)
+        
+        if rank is not None:
+            text += f"\n{self.format_text(user_id, 'your_rank', rank, leaderboards.size(board))}"
+        else:
+            text += f"\n{self.get_text(user_id, 'not_ranked')}"
         
         keyboard = [
+            [
+                InlineKeyboardButton(self.get_text(user_id, 'leaderboard_all'), callback_data='leaderboard'),
+                InlineKeyboardButton(self.get_text(user_id, 'leaderboard_weekly'), callback_data='leaderboard_weekly'),
+                InlineKeyboardButton(self.get_text(user_id, 'leaderboard_monthly'), callback_data='leaderboard_monthly')
+            ],
             [InlineKeyboardButton(self.get_text(user_id, 'back'), callback_data='points')]
         ]
         
         return text, InlineKeyboardMarkup(keyboard)
     
     def check_new_achievements(self, user_id):
-        """فحص الإنجازات الجديدة"""
-        # هذه الدالة يمكن استخدامها لإشعار المستخدم بالإنجازات الجديدة
-        # يمكن تطويرها لاحقاً لحفظ الإنجازات المفتوحة في قاعدة البيانات
-        pass
+        """فحص كل قواعد الإنجازات للمستخدم (الأحداث تفحص عادةً القواعد المتأثرة فقط)؛ يعيد الجديد منها"""
+        unlocked = []
+        for event in EVENT_METRICS:
+            unlocked.extend(achievement_engine.handle(event, user_id))
+        return unlocked
     
     def process_referral(self, referral_code, new_user_id):
         """معالجة الإحالة"""
         referrer_id = self.db.get_user_by_referral_code(referral_code)
         
         if referrer_id and referrer_id != new_user_id:
-            # تحديث المستخدم الجديد
-            conn = self.db.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('UPDATE users SET referred_by = ? WHERE user_id = ?', 
-                          (referrer_id, new_user_id))
-            
-            # إضافة سجل الإحالة
-            cursor.execute('''
-                INSERT INTO referrals (referrer_id, referred_id, points_awarded)
-                VALUES (?, ?, ?)
-            ''', (referrer_id, new_user_id, 50))
-            
-            # إضافة نقاط للمحيل
-            cursor.execute('UPDATE users SET points = points + 50 WHERE user_id = ?', (referrer_id,))
-            cursor.execute('''
-                INSERT INTO points_history (user_id, points, reason, transaction_type)
-                VALUES (?, ?, ?, ?)
-            ''', (referrer_id, 50, f'Referral bonus for user {new_user_id}', 'earned'))
+            with self.db.transaction() as conn:
+                cursor = conn.cursor()
+                
+                # لا يُحال المستخدم من داخل شجرة إحالاته
+                if creates_cycle(conn, referrer_id, new_user_id):
+                    return False
+                
+                # إضافة نقاط للمحيل؛ المستخدم الواحد يُحتسب كإحالة مرة واحدة فقط
+                entries = [LedgerEntry(referrer_id, 50, f'Referral bonus for user {new_user_id}', f'referral:{new_user_id}')]
+                results = post_entries(conn, entries)
+                if results[0] != APPLIED:
+                    return False
+                
+                # إضافة سجل الإحالة وتحديث عدادات المحيل وشجرته
+                upline = record_referral(conn, referrer_id, new_user_id, 50)
+                
+                # تحديث المستخدم الجديد
+                cursor.execute('UPDATE users SET referred_by = ? WHERE user_id = ?', 
+                              (referrer_id, new_user_id))
             
-            conn.commit()
-            conn.close()
+            self.db.invalidate_user(new_user_id, *upline)
+            self.db.ledger.committed(entries, results)
+            self.db.emit_event('referral_added', referrer_id)
             
             return True
         
@@ -0,0 +1,132 @@
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:  # العدّ التقريبي يكفي إذا لم تكن المكتبة مثبتة
+    tiktoken = None
+
+# رموز إضافية يضيفها تنسيق المحادثة لكل رسالة
+MESSAGE_OVERHEAD_TOKENS = 4
+
+class TokenCounter:
+    """عدّ الرموز باستخدام tiktoken إن وجد، وإلا بتقدير حسب طول النص"""
+
+    def __init__(self, model='gpt-4o-mini'):
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding('cl100k_base')
+        self.count = lru_cache(maxsize=4096)(self._count)
+
+    def _count(self, text):
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text))
+        # تقدير محافظ: النص العربي يستهلك رموزاً أكثر لكل حرف
+        return max(1, len(text) // 3)
+
+    def count_message(self, content):
+        return self.count(content) + MESSAGE_OVERHEAD_TOKENS
+
+class PromptBuilder:
+    """بناء رسائل الطلب ضمن ميزانية رموز، مع تلخيص الرسائل الأقدم في ملخص متراكم
+
+    الرسائل الأحدث تُضاف كما هي حتى تنفد الميزانية، وما يسقط منها يُدمج في ملخص
+    لكل مستخدم يُحدَّث في الخلفية ويُرسل بدلاً منها في الطلبات التالية.
+    """
+
+    def __init__(self, model='gpt-4o-mini', token_budget=2500, summary_max_tokens=250, max_summaries=10000):
+        self.counter = TokenCounter(model)
+        self.token_budget = token_budget
+        self.summary_max_tokens = summary_max_tokens
+        self.max_summaries = max_summaries
+
+        self._system_prompts = {}
+        # user_id -> (summary, timestamp of the last summarized message)
+        self._summaries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def system_prompt(self, language, level, factory):
+        """prompt النظام لكل (لغة، مستوى) يُبنى مرة واحدة ثم يُعاد من الذاكرة"""
+        key = (language, level)
+        prompt = self._system_prompts.get(key)
+        if prompt is None:
+            prompt = factory(language, level)
+            self._system_prompts[key] = prompt
+        return prompt
+
+    def get_summary(self, user_id):
+        with self._lock:
+            entry = self._summaries.get(user_id)
+            if entry is None:
+                return None, None
+            self._summaries.move_to_end(user_id)
+            return entry
+
+    def set_summary(self, user_id, summary, summarized_until):
+        with self._lock:
+            self._summaries[user_id] = (summary, summarized_until)
+            self._summaries.move_to_end(user_id)
+            while len(self._summaries) > self.max_summaries:
+                self._summaries.popitem(last=False)
+
+    def clear(self, user_id):
+        with self._lock:
+            self._summaries.pop(user_id, None)
+
+    def build(self, user_id, system_prompt, history, question, summary_label='Summary of the earlier conversation'):
+        """إرجاع (messages, overflow) حيث overflow الرسائل التي لم تتسع ولم تُلخص بعد
+
+        history: رسائل سابقة بصيغة dict (role, content, timestamp) من الأقدم للأحدث دون السؤال الحالي
+        """
+        summary, summarized_until = self.get_summary(user_id)
+
+        used = self.counter.count_message(system_prompt) + self.counter.count_message(question)
+        if summary:
+            used += self.counter.count_message(summary)
+
+        # الرسائل المغطاة بالملخص لا تُرسل مرة أخرى
+        if summarized_until is not None:
+            history = [msg for msg in history if msg["timestamp"] > summarized_until]
+
+        # إضافة الرسائل من الأحدث للأقدم حتى تنفد الميزانية
+        included = []
+        for msg in reversed(history):
+            cost = self.counter.count_message(msg["content"])
+            if used + cost > self.token_budget:
+                break
+            used += cost
+            included.append(msg)
+        included.reverse()
+        overflow = history[:len(history) - len(included)]
+
+        messages = [{"role": "system", "content": system_prompt}]
+        if summary:
+            messages.append({"role": "system", "content": f"{summary_label}:\n{summary}"})
+        messages.extend({"role": msg["role"], "content": msg["content"]} for msg in included)
+        messages.append({"role": "user", "content": question})
+        return messages, overflow
+
+    def summary_request(self, user_id, overflow, language):
+        """رسائل طلب تحديث الملخص المتراكم بدمج الرسائل التي خرجت من الميزانية"""
+        summary, _ = self.get_summary(user_id)
+        transcript = '\n'.join(f'{msg["role"]}: {msg["content"]}' for msg in overflow)
+        instruction = (
+            f"Update the running summary of this cybersecurity tutoring conversation. "
+            f"Keep the user's goals, facts they shared and what was already explained. "
+            f"Reply with the summary only, in {'Arabic' if language == 'ar' else 'English'}, "
+            f"under {self.summary_max_tokens} tokens."
+        )
+        content = f"Current summary:\n{summary or '(none)'}\n\nNew messages:\n{transcript}"
+        return [
+            {"role": "system", "content": instruction},
+            {"role": "user", "content": content}
+        ]
@@ -0,0 +1,74 @@
+"""شجرة الإحالات: عدادات مجمّعة في صف المستخدم وجدول إغلاق (closure table) للمستويات المتعددة
+
+referral_count و referral_points للإحالات المباشرة، و referral_network لكل من في شجرة المستخدم
+(إحالاته وإحالات إحالاته...)، فشاشة الإحالة قراءة لصف واحد. referral_tree يحفظ لكل مستخدم
+كل أسلافه مع العمق، فاستعلامات المستويات لا تحتاج استعلاماً تكرارياً.
+"""
+
+# أقصى عمق يُعرض أو يُبنى (حماية من الحلقات في البيانات القديمة)
+MAX_DEPTH = 64
+
+def creates_cycle(conn, referrer_id, referred_id):
+    """هل المحيل هو المستخدم نفسه أو ضمن شجرته؟"""
+    return referrer_id == referred_id or conn.execute(
+        'SELECT 1 FROM referral_tree WHERE descendant_id = ? AND ancestor_id = ?', (referrer_id, referred_id)
+    ).fetchone() is not None
+
+def record_referral(conn, referrer_id, referred_id, points_awarded=50):
+    """تسجيل إحالة وتحديث العدادات وجدول الإغلاق داخل معاملة الكتابة الحالية
+
+    على المستدعي رفض الإحالات التي تصنع حلقة (creates_cycle). يعيد قائمة المستخدمين الذين
+    تغيرت عداداتهم (المحيل وأسلافه) لإبطال ملفاتهم المخزنة.
+    """
+    conn.execute('''
+        INSERT INTO referrals (referrer_id, referred_id, points_awarded)
+        VALUES (?, ?, ?)
+    ''', (referrer_id, referred_id, points_awarded))
+    conn.execute('''
+        UPDATE users SET referral_count = COALESCE(referral_count, 0) + 1,
+                         referral_points = COALESCE(referral_points, 0) + ?
+        WHERE user_id = ?
+    ''', (points_awarded, referrer_id))
+
+    # المستخدم الجديد ينتقل إلى شجرة المحيل مع من أحالهم (إن وُجدوا)
+    ancestors = [(referrer_id, 0)] + conn.execute(
+        'SELECT ancestor_id, depth FROM referral_tree WHERE descendant_id = ?', (referrer_id,)
+    ).fetchall()
+    descendants = [(referred_id, 0)] + conn.execute(
+        'SELECT descendant_id, depth FROM referral_tree WHERE ancestor_id = ?', (referred_id,)
+    ).fetchall()
+    conn.executemany('''
+        INSERT OR IGNORE INTO referral_tree (ancestor_id, descendant_id, depth) VALUES (?, ?, ?)
+    ''', [
+        (ancestor_id, descendant_id, ancestor_depth + descendant_depth + 1)
+        for ancestor_id, ancestor_depth in ancestors
+        for descendant_id, descendant_depth in descendants
+    ])
+    conn.executemany(
+        'UPDATE users SET referral_network = COALESCE(referral_network, 0) + ? WHERE user_id = ?',
+        [(len(descendants), ancestor_id) for ancestor_id, _ in ancestors]
+    )
+    return [ancestor_id for ancestor_id, _ in ancestors]
+
+def referral_upline(conn, user_id):
+    """سلسلة المحيلين فوق المستخدم [(user_id، العمق)] من الأقرب إلى الأبعد"""
+    return [tuple(row) for row in conn.execute('''
+        SELECT ancestor_id, depth FROM referral_tree
+        WHERE descendant_id = ? ORDER BY depth
+    ''', (user_id,))]
+
+def referral_levels(conn, user_id, max_depth=3):
+    """عدد المستخدمين في كل مستوى من شجرة المستخدم {العمق: العدد} حتى max_depth"""
+    return dict(conn.execute('''
+        SELECT depth, COUNT(*) FROM referral_tree
+        WHERE ancestor_id = ? AND depth <= ?
+        GROUP BY depth
+    ''', (user_id, min(max_depth, MAX_DEPTH))).fetchall())
+
+def referral_members(conn, user_id, depth, limit=50, offset=0):
+    """المستخدمون في مستوى معين من شجرة المستخدم (1 = الإحالات المباشرة)"""
+    return [row[0] for row in conn.execute('''
+        SELECT descendant_id FROM referral_tree
+        WHERE ancestor_id = ? AND depth = ?
+        ORDER BY descendant_id LIMIT ? OFFSET ?
+    ''', (user_id, depth, limit, offset))]
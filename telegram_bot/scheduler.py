@@ -0,0 +1,251 @@
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+from async_database import async_db
+import logging
+
+logger = logging.getLogger(__name__)
+
+class CronSpec:
+    """مواصفة cron من خمسة حقول: الدقيقة الساعة يوم-الشهر الشهر يوم-الأسبوع (0 = الأحد)
+
+    يدعم كل حقل: * و n و a-b و a,b و */n و a-b/n
+    """
+
+    _RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Invalid cron expression: {expression!r}")
+        self.expression = expression
+        parsed = [self._parse_field(field, low, high) for field, (low, high) in zip(fields, self._RANGES)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        # 7 تعني الأحد أيضاً
+        self.weekdays = frozenset(day % 7 for day in weekdays)
+        # عند تقييد يوم الشهر ويوم الأسبوع معاً يكفي تطابق أحدهما (سلوك cron المعتاد)
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    @classmethod
+    def daily_at(cls, time_text):
+        """مواصفة يومية من وقت بصيغة HH:MM"""
+        hour, minute = (int(part) for part in time_text.split(':'))
+        return cls(f'{minute} {hour} * * *')
+
+    @staticmethod
+    def _parse_field(field, low, high):
+        values = set()
+        for part in field.split(','):
+            step = 1
+            if '/' in part:
+                part, step_text = part.split('/')
+                step = int(step_text)
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = (int(value) for value in part.split('-'))
+            else:
+                start = end = int(part)
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError(f"Invalid cron field: {field!r}")
+            values.update(range(start, end + 1, step))
+        return tuple(sorted(values))
+
+    def _day_matches(self, moment):
+        day_match = moment.day in self.days
+        weekday_match = (moment.weekday() + 1) % 7 in self.weekdays
+        if self._any_day:
+            return weekday_match
+        if self._any_weekday:
+            return day_match
+        return day_match or weekday_match
+
+    def next_after(self, moment):
+        """أول وقت مطابق بعد moment (بدقة الدقيقة)"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # خمس سنوات تكفي لأي مواصفة صالحة (مثل 29 فبراير)
+        for _ in range(366 * 5):
+            if candidate.month in self.months and self._day_matches(candidate):
+                for hour in self.hours:
+                    if hour < candidate.hour:
+                        continue
+                    for minute in self.minutes:
+                        if hour == candidate.hour and minute < candidate.minute:
+                            continue
+                        return candidate.replace(hour=hour, minute=minute)
+            candidate = (candidate + timedelta(days=1)).replace(hour=0, minute=0)
+        raise ValueError(f"Cron expression never matches: {self.expression!r}")
+
+    def __repr__(self):
+        return f'CronSpec({self.expression!r})'
+
+class ScheduledJob:
+    """مهمة مجدولة: الدالة قد تكون غير متزامنة أو متزامنة (تُنفذ في خيط منفصل)"""
+
+    def __init__(self, name, spec, func, jitter=0, misfire_grace=3600, timeout=None):
+        self.name = name
+        self.spec = spec if isinstance(spec, CronSpec) else CronSpec(spec)
+        self.func = func
+        self.jitter = jitter
+        self.misfire_grace = misfire_grace
+        self.timeout = timeout
+
+        self.next_run_at = None
+        self.task = None
+        self.runs = 0
+        self.skipped = 0
+        self.failures = 0
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+class JobScheduler:
+    """مجدول مهام داخل حلقة أحداث البوت
+
+    - كل مهمة تنتظر حتى وقتها التالي بالضبط (مع تأخير عشوائي اختياري لتوزيع الحمل)
+    - لا تبدأ المهمة إذا كان تشغيلها السابق لم ينته بعد
+    - وقت آخر تشغيل يُحفظ في جدول scheduled_jobs، وبعد إعادة التشغيل تُنفذ المهمة الفائتة
+      مرة واحدة إذا كان تأخرها ضمن misfire_grace وإلا تُتجاهل حتى موعدها التالي
+    """
+
+    def __init__(self, async_database):
+        self.async_db = async_database
+        self.jobs = {}
+        self._loops = []
+
+    def add_job(self, name, spec, func, **options):
+        if name in self.jobs:
+            raise ValueError(f"Job already registered: {name}")
+        job = ScheduledJob(name, spec, func, **options)
+        self.jobs[name] = job
+        return job
+
+    async def start(self):
+        """بدء حلقات المهام؛ يُستدعى من داخل حلقة أحداث التطبيق"""
+        if self._loops:
+            return
+        states = await self._load_states()
+        for job in self.jobs.values():
+            self._loops.append(asyncio.create_task(self._job_loop(job, states.get(job.name)), name=f'job-{job.name}'))
+        logger.info(f"Scheduler started with {len(self.jobs)} jobs")
+
+    async def stop(self):
+        """إيقاف الحلقات وإلغاء المهام الجارية"""
+        tasks = self._loops + [job.task for job in self.jobs.values() if job.running]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._loops = []
+
+    async def _load_states(self):
+        rows = await self.async_db.fetchall('SELECT name, last_scheduled_at FROM scheduled_jobs')
+        return {row['name']: row['last_scheduled_at'] for row in rows}
+
+    async def _job_loop(self, job, last_scheduled_at):
+        try:
+            if last_scheduled_at is not None:
+                self._catch_up(job, datetime.fromtimestamp(last_scheduled_at))
+
+            while True:
+                fire_at = job.spec.next_after(datetime.now())
+                job.next_run_at = fire_at
+                run_at = fire_at + timedelta(seconds=random.uniform(0, job.jitter))
+                await self._sleep_until(run_at)
+                self._launch(job, fire_at)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Scheduler loop for {job.name} stopped: {e}")
+
+    def _catch_up(self, job, last_scheduled):
+        """تشغيل آخر موعد فائت أثناء توقف البوت (مرة واحدة مهما تعددت المواعيد الفائتة)"""
+        now = datetime.now()
+        first_missed = job.spec.next_after(last_scheduled)
+        if first_missed > now:
+            return
+
+        latest = None
+        candidate = job.spec.next_after(max(last_scheduled, now - timedelta(seconds=job.misfire_grace)))
+        while candidate <= now:
+            latest = candidate
+            candidate = job.spec.next_after(candidate)
+
+        if latest is not None:
+            logger.info(f"Running missed job {job.name} scheduled at {latest}")
+            self._launch(job, latest)
+        else:
+            logger.warning(f"Skipping missed job {job.name} scheduled at {first_missed} (outside misfire grace)")
+
+    @staticmethod
+    async def _sleep_until(moment):
+        # النوم على دفعات قصيرة يعيد حساب المدة من ساعة النظام (تغيير الوقت أو إيقاف الجهاز)
+        while True:
+            delay = (moment - datetime.now()).total_seconds()
+            if delay <= 0:
+                return
+            await asyncio.sleep(min(delay, 60))
+
+    def _launch(self, job, fire_at):
+        if job.running:
+            job.skipped += 1
+            logger.warning(f"Skipping {job.name} at {fire_at}: previous run still in progress")
+            return
+        job.task = asyncio.create_task(self._run(job, fire_at), name=f'run-{job.name}')
+
+    async def _run(self, job, fire_at):
+        started = time.time()
+        # تسجيل الموعد قبل التنفيذ حتى لا يتكرر بعد إعادة تشغيل مفاجئة
+        await self._save_state(job.name, fire_at.timestamp(), started, None, 'running', None)
+
+        status, error = 'ok', None
+        try:
+            if asyncio.iscoroutinefunction(job.func):
+                call = job.func()
+            else:
+                call = asyncio.to_thread(job.func)
+            await asyncio.wait_for(call, timeout=job.timeout)
+            job.runs += 1
+        except asyncio.CancelledError:
+            status = 'cancelled'
+            raise
+        except Exception as e:
+            job.failures += 1
+            status, error = 'error', str(e)
+            logger.error(f"Scheduled job {job.name} failed: {e}")
+        finally:
+            finished = time.time()
+            logger.info(f"Job {job.name} finished with status {status} in {finished - started:.1f}s")
+            await asyncio.shield(self._save_state(job.name, fire_at.timestamp(), started, finished, status, error))
+
+    async def _save_state(self, name, scheduled_at, started_at, finished_at, status, error):
+        try:
+            await self.async_db.execute('''
+                INSERT INTO scheduled_jobs (name, last_scheduled_at, last_started_at, last_finished_at, last_status, last_error)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    last_scheduled_at = excluded.last_scheduled_at,
+                    last_started_at = excluded.last_started_at,
+                    last_finished_at = excluded.last_finished_at,
+                    last_status = excluded.last_status,
+                    last_error = excluded.last_error
+            ''', (name, scheduled_at, started_at, finished_at, status, error))
+        except Exception as e:
+            logger.error(f"Failed to save state of job {name}: {e}")
+
+    def stats(self):
+        return {
+            name: {
+                'next_run_at': job.next_run_at,
+                'running': job.running,
+                'runs': job.runs,
+                'skipped': job.skipped,
+                'failures': job.failures
+            }
+            for name, job in self.jobs.items()
+        }
+
+# المجدول المشترك للبوت
+job_scheduler = JobScheduler(async_db)
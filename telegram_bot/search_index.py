@@ -0,0 +1,158 @@
+import re
+import unicodedata
+
+# الجداول المفهرسة؛ لكل جدول فهرس FTS5 باسم <table>_fts يطابق rowid فيه معرّف الصف الأصلي
+SEARCH_TABLES = ('news', 'lessons')
+SEARCH_COLUMNS = ('title_ar', 'title_en', 'content_ar', 'content_en')
+
+# وزن العناوين أعلى من المحتوى في ترتيب النتائج (bm25 بترتيب SEARCH_COLUMNS)
+_RANK = '10.0, 10.0, 1.0, 1.0'
+_DATE_COLUMNS = {'news': 'published_date', 'lessons': 'created_date'}
+
+_TOKEN = re.compile(r'\w+')
+# كلمات النص الأصلي مع تشكيلها (حركات التشكيل ليست من \w)
+_TEXT_WORD = re.compile(r'[\w\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]+')
+_ARABIC_WORD = re.compile(r'[\u0621-\u064a]')
+_ARABIC_ARTICLES = ('وال', 'بال', 'فال', 'كال', 'لل', 'ال')
+MAX_QUERY_TERMS = 8
+# البحث بالبادئة للكلمات القصيرة جداً يمر على جزء كبير من الفهرس
+MIN_PREFIX_LENGTH = 3
+SNIPPET_WORDS = 16
+
+# التطويل والحركات والشدة والسكون والألف الخنجرية تُحذف، وأشكال الألف والياء والتاء المربوطة توحَّد.
+# القائمة قصيرة لأن القوادح تطبقها بدوال replace متداخلة (محلل SQLite يرفض التداخل العميق)
+_REMOVED_CHARS = '\u0640' + ''.join(map(chr, range(0x064b, 0x0653))) + '\u0670'
+_REPLACED_CHARS = {'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ى': 'ي', 'ة': 'ه', 'ؤ': 'و', 'ئ': 'ي'}
+_NORMALIZE = str.maketrans({**dict.fromkeys(_REMOVED_CHARS), **_REPLACED_CHARS})
+
+def normalize_search_text(text):
+    """النص كما يُخزن في الفهرس: دون تشكيل أو تطويل وبأشكال موحدة للألف والياء والتاء المربوطة"""
+    if text is None:
+        return None
+    return unicodedata.normalize('NFKC', text).translate(_NORMALIZE)
+
+def normalize_sql(expression):
+    """تعبير SQL يوحّد النص مثل normalize_search_text (دون NFKC) بدوال replace المدمجة
+
+    القوادح تستخدمه بدل دالة مخصصة، فالكتابة في news و lessons تعمل من أي اتصال
+    (سطر أوامر sqlite3، السكربتات، الاستعادة من نسخة احتياطية).
+    """
+    for char in _REMOVED_CHARS:
+        expression = f"replace({expression}, char({ord(char)}), '')"
+    for char, replacement in _REPLACED_CHARS.items():
+        expression = f"replace({expression}, char({ord(char)}), char({ord(replacement)}))"
+    return expression
+
+def _strip_article(term):
+    for article in _ARABIC_ARTICLES:
+        if term.startswith(article) and len(term) - len(article) >= 2:
+            return term[len(article):]
+    return term
+
+def _term_query(term):
+    if not _ARABIC_WORD.match(term):
+        return f'"{term}"*' if len(term) >= MIN_PREFIX_LENGTH else f'"{term}"'
+
+    # الكلمة العربية تُطابق مع أل التعريف وما يسبقها أو بدونها (أمن، الأمن، للأمن...)
+    term = _strip_article(term)
+    suffix = '*' if len(term) >= MIN_PREFIX_LENGTH else ''
+    variants = [f'"{term}"{suffix}'] + [f'"{article}{term}"{suffix}' for article in _ARABIC_ARTICLES]
+    return f"({' OR '.join(variants)})"
+
+def query_terms(text, max_terms=MAX_QUERY_TERMS):
+    """كلمات البحث الموحّدة كما تُطابق في الفهرس"""
+    return _TOKEN.findall(normalize_search_text(text).lower())[:max_terms]
+
+def build_match_query(text, max_terms=MAX_QUERY_TERMS):
+    """تحويل نص المستخدم إلى استعلام MATCH آمن: كلمات مقتبسة يجب أن تتوفر كلها"""
+    return ' AND '.join(_term_query(term) for term in query_terms(text, max_terms))
+
+def _word_matches(word, term):
+    """هل تطابق كلمة النص (موحّدة) كلمة البحث بنفس قواعد _term_query؟"""
+    if _ARABIC_WORD.match(term):
+        term = _strip_article(term)
+        forms = [word] + [word[len(article):] for article in _ARABIC_ARTICLES if word.startswith(article)]
+    else:
+        forms = [word]
+    if len(term) >= MIN_PREFIX_LENGTH:
+        return any(form.startswith(term) for form in forms)
+    return term in forms
+
+def build_snippet(texts, terms, highlight=('«', '»'), words=SNIPPET_WORDS):
+    """مقتطف من النص الأصلي حول أول كلمة مطابقة مع تمييز الكلمات المطابقة
+
+    texts تُفحص بالترتيب ويُستخدم أول نص فيه تطابق (الفهرس يحفظ نصاً موحّداً لا يصلح للعرض).
+    """
+    for text in texts:
+        if not text:
+            continue
+        spans = [match.span() for match in _TEXT_WORD.finditer(text)]
+        matched = [
+            any(_word_matches(normalize_search_text(text[start:end]).lower(), term) for term in terms)
+            for start, end in spans
+        ]
+        if not any(matched):
+            continue
+
+        first = matched.index(True)
+        begin = max(0, min(first - words // 4, len(spans) - words))
+        end = min(len(spans), begin + words)
+        parts, position = [], spans[begin][0]
+        for (start, stop), hit in zip(spans[begin:end], matched[begin:end]):
+            if hit:
+                parts.append(f'{text[position:start]}{highlight[0]}{text[start:stop]}{highlight[1]}')
+                position = stop
+        parts.append(text[position:spans[end - 1][1]])
+        prefix = '…' if begin > 0 else ''
+        suffix = '…' if end < len(spans) else ''
+        return prefix + ''.join(parts) + suffix
+    return ''
+
+def search(conn, text, kind=None, page=1, per_page=5, highlight=('«', '»')):
+    """بحث مرتب حسب الصلة في الأخبار والدروس مع مقتطف من النص المطابق
+
+    kind: 'news' أو 'lessons' أو None للبحث في الاثنين
+    يعيد {'results', 'total', 'page', 'pages'}
+    """
+    page = max(1, int(page))
+    per_page = max(1, min(int(per_page), 50))
+    tables = [kind] if kind else list(SEARCH_TABLES)
+    if any(table not in SEARCH_TABLES for table in tables):
+        raise ValueError(f"Unknown search kind: {kind}")
+
+    terms = query_terms(text)
+    match = ' AND '.join(_term_query(term) for term in terms)
+    if not match:
+        return {'results': [], 'total': 0, 'page': page, 'pages': 0}
+
+    total = 0
+    for table in tables:
+        total += conn.execute(f'SELECT COUNT(*) FROM {table}_fts WHERE {table}_fts MATCH ?', (match,)).fetchone()[0]
+
+    selects = []
+    params = []
+    for table in tables:
+        selects.append(f'''
+            SELECT '{table}' AS kind, t.id, t.title_ar, t.title_en, t.content_ar, t.content_en,
+                   t.{_DATE_COLUMNS[table]} AS date, bm25({table}_fts, {_RANK}) AS score
+            FROM {table}_fts JOIN {table} t ON t.id = {table}_fts.rowid
+            WHERE {table}_fts MATCH ?
+        ''')
+        params.append(match)
+
+    rows = conn.execute(
+        ' UNION ALL '.join(selects) + ' ORDER BY score, date DESC LIMIT ? OFFSET ?',
+        params + [per_page, (page - 1) * per_page]
+    ).fetchall()
+
+    results = [{
+        'kind': row['kind'],
+        'id': row['id'],
+        'title_ar': row['title_ar'],
+        'title_en': row['title_en'],
+        'snippet': build_snippet(
+            (row['content_ar'], row['content_en'], row['title_ar'], row['title_en']), terms, highlight
+        ),
+        'date': row['date']
+    } for row in rows]
+    return {'results': results, 'total': total, 'page': page, 'pages': (total + per_page - 1) // per_page}
@@ -1,7 +1,9 @@
 import stripe
 import os
 from database import db
-from datetime import datetime, timedelta
+from analytics_rollups import record_purchase
+from i18n import catalog
+from datetime import datetime, timedelta, timezone
 import uuid
 import logging
 
@@ -15,80 +17,18 @@ class ShopSystem:
         
     def get_text(self, user_id, key):
         """الحصول على النص حسب لغة المستخدم"""
-        user_info = self.db.get_user_info(user_id)
-        lang = user_info[4] if user_info else 'ar'
-        
-        texts = {
-            'ar': {
-                'shop_menu': '🛒 المتجر',
-                'browse_items': '🛍️ تصفح المنتجات',
-                'my_purchases': '📦 مشترياتي',
-                'vip_subscription': '👑 اشتراك VIP',
-                'points_packages': '💎 حزم النقاط',
-                'premium_courses': '📚 الدورات المميزة',
-                'certificates': '🏆 الشهادات',
-                'current_points': 'نقاطك الحالية: {} نقطة',
-                'insufficient_points': '❌ نقاطك غير كافية',
-                'purchase_successful': '✅ تم الشراء بنجاح!',
-                'purchase_failed': '❌ فشل في الشراء',
-                'confirm_purchase': 'تأكيد الشراء',
-                'cancel': 'إلغاء',
-                'price_points': 'السعر: {} نقطة',
-                'price_usd': 'السعر: ${} دولار',
-                'buy_with_points': '💰 شراء بالنقاط',
-                'buy_with_card': '💳 شراء بالبطاقة',
-                'item_description': 'الوصف:',
-                'back_to_shop': '🔙 العودة للمتجر',
-                'main_menu': '🏠 القائمة الرئيسية',
-                'vip_benefits': 'مميزات VIP:\n• استخدام الذكاء الاصطناعي بلا حدود\n• دروس حصرية\n• أولوية في الدعم\n• شارات خاصة',
-                'already_vip': '👑 أنت عضو VIP بالفعل!',
-                'vip_expires': 'ينتهي اشتراك VIP في: {}',
-                'processing_payment': '⏳ جاري معالجة الدفع...',
-                'payment_link': '🔗 رابط الدفع',
-                'no_purchases': 'لا توجد مشتريات حتى الآن'
-            },
-            'en': {
-                'shop_menu': '🛒 Shop',
-                'browse_items': '🛍️ Browse Items',
-                'my_purchases': '📦 My Purchases',
-                'vip_subscription': '👑 VIP Subscription',
-                'points_packages': '💎 Points Packages',
-                'premium_courses': '📚 Premium Courses',
-                'certificates': '🏆 Certificates',
-                'current_points': 'Your current points: {} points',
-                'insufficient_points': '❌ Insufficient points',
-                'purchase_successful': '✅ Purchase successful!',
-                'purchase_failed': '❌ Purchase failed',
-                'confirm_purchase': 'Confirm Purchase',
-                'cancel': 'Cancel',
-                'price_points': 'Price: {} points',
-                'price_usd': 'Price: ${} USD',
-                'buy_with_points': '💰 Buy with Points',
-                'buy_with_card': '💳 Buy with Card',
-                'item_description': 'Description:',
-                'back_to_shop': '🔙 Back to Shop',
-                'main_menu': '🏠 Main Menu',
-                'vip_benefits': 'VIP Benefits:\n• Unlimited AI usage\n• Exclusive lessons\n• Priority support\n• Special badges',
-                'already_vip': '👑 You are already a VIP member!',
-                'vip_expires': 'VIP subscription expires: {}',
-                'processing_payment': '⏳ Processing payment...',
-                'payment_link': '🔗 Payment Link',
-                'no_purchases': 'No purchases yet'
-            }
-        }
-        
-        return texts.get(lang, texts['ar']).get(key, key)
+        return catalog.get_text(self.db.get_user_language(user_id), 'shop', key)
+    
+    def format_text(self, user_id, key, *args):
+        """النص حسب لغة المستخدم بعد ملء حقوله بالقالب المُحلَّل مسبقاً"""
+        return catalog.format(self.db.get_user_language(user_id), 'shop', key, *args)
     
     def init_shop_items(self):
         """إنشاء منتجات المتجر الافتراضية"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        
-        # التحقق من وجود منتجات
-        cursor.execute('SELECT COUNT(*) FROM shop_items')
-        if cursor.fetchone()[0] > 0:
-            conn.close()
-            return
+        with self.db.connection() as conn:
+            # التحقق من وجود منتجات
+            if conn.execute('SELECT COUNT(*) FROM shop_items').fetchone()[0] > 0:
+                return
         
         default_items = [
             {
@@ -147,26 +87,24 @@ class ShopSystem:
             }
         ]
         
-        for item in default_items:
-            cursor.execute('''
+        with self.db.transaction() as conn:
+            conn.executemany('''
                 INSERT INTO shop_items (name_ar, name_en, description_ar, description_en,
                                       price_points, price_usd, category)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (item['name_ar'], item['name_en'], item['description_ar'], 
-                  item['description_en'], item['price_points'], item['price_usd'], item['category']))
-        
-        conn.commit()
-        conn.close()
+            ''', [(item['name_ar'], item['name_en'], item['description_ar'], 
+                   item['description_en'], item['price_points'], item['price_usd'], item['category'])
+                  for item in default_items])
     
     def create_shop_menu(self, user_id):
         """إنشاء قائمة المتجر الرئيسية"""
         from telegram import InlineKeyboardButton, InlineKeyboardMarkup
         
-        user_info = self.db.get_user_info(user_id)
-        points = user_info[5] if user_info else 0
+        profile = self.db.get_user_profile(user_id)
+        points = profile.points if profile else 0
         
         text = f"{self.get_text(user_id, 'shop_menu')}\n\n"
-        text += f"{self.get_text(user_id, 'current_points').format(points)}"
+        text += f"{self.format_text(user_id, 'current_points', points)}"
         
         keyboard = [
             [
@@ -193,26 +131,21 @@ class ShopSystem:
     
     def get_items_by_category(self, category):
         """الحصول على المنتجات حسب الفئة"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT id, name_ar, name_en, description_ar, description_en,
-                   price_points, price_usd, category
-            FROM shop_items 
-            WHERE category = ? AND is_available = TRUE
-            ORDER BY price_usd ASC
-        ''', (category,))
-        items = cursor.fetchall()
-        conn.close()
-        return items
+        with self.db.connection() as conn:
+            return conn.execute('''
+                SELECT id, name_ar, name_en, description_ar, description_en,
+                       price_points, price_usd, category
+                FROM shop_items 
+                WHERE category = ? AND is_available = TRUE
+                ORDER BY price_usd ASC
+            ''', (category,)).fetchall()
     
     def create_category_menu(self, user_id, category):
         """إنشاء قائمة منتجات الفئة"""
         from telegram import InlineKeyboardButton, InlineKeyboardMarkup
         
         items = self.get_items_by_category(category)
-        user_info = self.db.get_user_info(user_id)
-        lang = user_info[4] if user_info else 'ar'
+        lang = self.db.get_user_language(user_id)
         
         text = f"{self.get_text(user_id, 'browse_items')} - {category.title()}\n\n"
         
@@ -240,16 +173,12 @@ class ShopSystem:
     
     def get_item_details(self, item_id):
         """الحصول على تفاصيل منتج"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT id, name_ar, name_en, description_ar, description_en,
-                   price_points, price_usd, category
-            FROM shop_items WHERE id = ?
-        ''', (item_id,))
-        item = cursor.fetchone()
-        conn.close()
-        return item
+        with self.db.connection() as conn:
+            return conn.execute('''
+                SELECT id, name_ar, name_en, description_ar, description_en,
+                       price_points, price_usd, category
+                FROM shop_items WHERE id = ?
+            ''', (item_id,)).fetchone()
     
     def create_item_details_menu(self, user_id, item_id):
         """إنشاء قائمة تفاصيل المنتج"""
@@ -259,8 +188,7 @@ class ShopSystem:
         if not item:
             return None, None
         
-        user_info = self.db.get_user_info(user_id)
-        lang = user_info[4] if user_info else 'ar'
+        lang = self.db.get_user_language(user_id)
         
         name = item[1] if lang == 'ar' else item[2]
         description = item[3] if lang == 'ar' else item[4]
@@ -272,14 +200,14 @@ class ShopSystem:
         
         # أزرار الشراء
         if item[5] > 0:  # price_points
-            text += f"{self.get_text(user_id, 'price_points').format(item[5])}\n"
+            text += f"{self.format_text(user_id, 'price_points', item[5])}\n"
             keyboard.append([InlineKeyboardButton(
                 f"{self.get_text(user_id, 'buy_with_points')} ({item[5]} نقطة)",
                 callback_data=f"shop_buy_points_{item_id}"
             )])
         
         if item[6] > 0:  # price_usd
-            text += f"{self.get_text(user_id, 'price_usd').format(item[6])}\n"
+            text += f"{self.format_text(user_id, 'price_usd', item[6])}\n"
             keyboard.append([InlineKeyboardButton(
                 f"{self.get_text(user_id, 'buy_with_card')} (${item[6]})",
                 callback_data=f"shop_buy_card_{item_id}"
@@ -287,8 +215,8 @@ class ShopSystem:
         
         # التحقق من اشتراك VIP للمنتجات ذات الصلة
         if item[7] == 'vip':
-            is_vip = user_info[11] if len(user_info) > 11 else False
-            if is_vip:
+            profile = self.db.get_user_profile(user_id)
+            if profile and profile.is_vip:
                 text += f"\n{self.get_text(user_id, 'already_vip')}"
                 keyboard = []  # إزالة أزرار الشراء
         
@@ -305,15 +233,15 @@ class ShopSystem:
         if not item:
             return None, None
         
-        user_info = self.db.get_user_info(user_id)
-        lang = user_info[4] if user_info else 'ar'
+        profile = self.db.get_user_profile(user_id)
+        lang = profile.language if profile else 'ar'
         
         name = item[1] if lang == 'ar' else item[2]
         
         if payment_method == 'points':
             price = item[5]
             currency = 'نقطة'
-            user_points = user_info[5]
+            user_points = profile.points if profile else 0
             
             text = f"💰 {self.get_text(user_id, 'confirm_purchase')}\n\n"
             text += f"📦 {name}\n"
@@ -383,8 +311,7 @@ class ShopSystem:
             if not item:
                 return None
             
-            user_info = self.db.get_user_info(user_id)
-            lang = user_info[4] if user_info else 'ar'
+            lang = self.db.get_user_language(user_id)
             
             name = item[1] if lang == 'ar' else item[2]
             price = int(item[6] * 100)  # تحويل لسنت
@@ -420,19 +347,17 @@ class ShopSystem:
     
     def create_purchase_record(self, user_id, item_id, payment_method, amount_points=0, amount_usd=0):
         """إنشاء سجل الشراء"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        
         purchase_id = str(uuid.uuid4())
+        purchase_date = datetime.now(timezone.utc).replace(tzinfo=None)
         
-        cursor.execute('''
-            INSERT INTO purchases (id, user_id, item_id, payment_method, 
-                                 amount_points, amount_usd, status)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (purchase_id, user_id, item_id, payment_method, amount_points, amount_usd, 'completed'))
-        
-        conn.commit()
-        conn.close()
+        with self.db.transaction() as conn:
+            conn.execute('''
+                INSERT INTO purchases (id, user_id, item_id, payment_method, 
+                                     amount_points, amount_usd, status, purchase_date)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (purchase_id, user_id, item_id, payment_method, amount_points, amount_usd, 'completed',
+                  purchase_date.strftime('%Y-%m-%d %H:%M:%S')))
+            record_purchase(conn, item_id, amount_usd, amount_points, purchase_date)
         
         return purchase_id
     
@@ -449,9 +374,6 @@ class ShopSystem:
         
         elif category == 'vip':
             # تفعيل VIP
-            conn = self.db.get_connection()
-            cursor = conn.cursor()
-            
             # تحديد مدة الاشتراك
             if 'شهري' in item[1] or 'Monthly' in item[2]:
                 vip_duration = 30
@@ -462,38 +384,32 @@ class ShopSystem:
             
             vip_expires = datetime.now() + timedelta(days=vip_duration)
             
-            cursor.execute('''
-                UPDATE users 
-                SET is_vip = TRUE, vip_expires = ?
-                WHERE user_id = ?
-            ''', (vip_expires, user_id))
-            
-            conn.commit()
-            conn.close()
+            with self.db.transaction() as conn:
+                conn.execute('''
+                    UPDATE users 
+                    SET is_vip = TRUE, vip_expires = ?
+                    WHERE user_id = ?
+                ''', (vip_expires, user_id))
+            self.db.invalidate_user(user_id)
     
     def get_user_purchases(self, user_id):
         """الحصول على مشتريات المستخدم"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT p.id, s.name_ar, s.name_en, p.payment_method,
-                   p.amount_points, p.amount_usd, p.purchase_date, p.status
-            FROM purchases p
-            JOIN shop_items s ON p.item_id = s.id
-            WHERE p.user_id = ?
-            ORDER BY p.purchase_date DESC
-        ''', (user_id,))
-        purchases = cursor.fetchall()
-        conn.close()
-        return purchases
+        with self.db.connection() as conn:
+            return conn.execute('''
+                SELECT p.id, s.name_ar, s.name_en, p.payment_method,
+                       p.amount_points, p.amount_usd, p.purchase_date, p.status
+                FROM purchases p
+                JOIN shop_items s ON p.item_id = s.id
+                WHERE p.user_id = ?
+                ORDER BY p.purchase_date DESC
+            ''', (user_id,)).fetchall()
     
     def create_purchases_menu(self, user_id):
         """إنشاء قائمة المشتريات"""
         from telegram import InlineKeyboardButton, InlineKeyboardMarkup
         
         purchases = self.get_user_purchases(user_id)
-        user_info = self.db.get_user_info(user_id)
-        lang = user_info[4] if user_info else 'ar'
+        lang = self.db.get_user_language(user_id)
         
         if not purchases:
             text = self.get_text(user_id, 'no_purchases')
@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import OrderedDict
+
+class UserProfile:
+    """سجل بيانات المستخدم بحقول مسماة بدلاً من الفهارس الرقمية مثل user_info[4]"""
+
+    __slots__ = ('user_id', 'username', 'first_name', 'last_name', 'language', 'points', 'level',
+                 'registration_date', 'referral_code', 'referred_by', 'is_vip', 'vip_expires',
+                 'total_lessons_completed', 'streak_days', 'last_activity_date',
+                 'referral_count', 'referral_points', 'referral_network')
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_row(cls, row):
+        """إنشاء السجل من صف جدول users (يعمل مع اختلاف أعمدة المخططين)"""
+        profile = cls(**{key: row[key] for key in row.keys() if key in cls.__slots__})
+        profile.language = profile.language or 'ar'
+        profile.points = profile.points or 0
+        profile.level = profile.level or 'beginner'
+        profile.is_vip = bool(profile.is_vip)
+        profile.total_lessons_completed = profile.total_lessons_completed or 0
+        profile.streak_days = profile.streak_days or 0
+        profile.referral_count = profile.referral_count or 0
+        profile.referral_points = profile.referral_points or 0
+        profile.referral_network = profile.referral_network or 0
+        return profile
+
+    def __repr__(self):
+        return f"UserProfile(user_id={self.user_id!r}, language={self.language!r}, points={self.points!r})"
+
+class UserProfileCache:
+    """ذاكرة مؤقتة LRU بمدة صلاحية لملفات المستخدمين مع إبطال صريح"""
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        """إرجاع الملف المخزن إن كان صالحاً، وإلا None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, profile = entry
+            if expires_at < now:
+                del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return profile
+
+    def get_or_load(self, user_id, loader):
+        """إرجاع الملف من الذاكرة أو تحميله عبر loader وتخزينه"""
+        profile = self.get(user_id)
+        if profile is not None:
+            return profile
+
+        # رمز التحميل يمنع تخزين نتيجة قديمة إذا أُبطل المستخدم أثناء القراءة
+        token = object()
+        with self._lock:
+            self._loading[user_id] = token
+
+        try:
+            profile = loader(user_id)
+        finally:
+            with self._lock:
+                current = self._loading.get(user_id)
+                if current is token:
+                    del self._loading[user_id]
+
+        if profile is not None and current is token:
+            self.put(user_id, profile)
+        return profile
+
+    def put(self, user_id, profile):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, profile)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *user_ids):
+        """إزالة مستخدم أو أكثر بعد تعديل بياناتهم"""
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+                self._loading.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._loading.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# وحدات البوت تُستورد بأسمائها المباشرة كما في telegram_bot/main_bot.py
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'telegram_bot'))
+
+# database.py ينشئ قاعدة cyberbot.db المشتركة في المجلد الحالي عند استيراده؛ الاختبارات تعمل في مجلد مؤقت
+os.chdir(tempfile.mkdtemp(prefix='cyberbot-tests-'))
@@ -0,0 +1,57 @@
+import time
+
+import pytest
+
+from ai_cache import AnswerCache
+
+@pytest.fixture
+def database(tmp_path):
+    from database import DatabaseManager
+    database = DatabaseManager(str(tmp_path / 'cache.db'))
+    yield database
+    database.close()
+
+@pytest.fixture
+def cache(database):
+    cache = AnswerCache(database)
+    cache.put('en', 'beginner', 'What is phishing?', 'phishing answer')
+    cache.put('en', 'beginner', 'Is it safe to use public wifi?', 'safe answer')
+    cache.put('en', 'beginner', 'How do I enable two-factor authentication?', 'enable answer')
+    cache.put('ar', 'beginner', 'ما هو التصيد الاحتيالي؟', 'إجابة التصيد')
+    return cache
+
+@pytest.mark.parametrize('question', [
+    'What is vishing',
+    'Is it unsafe to use public wifi',
+    'Is it not safe to use public wifi?',
+    'How do I disable two-factor authentication?',
+])
+def test_different_meaning_is_not_reused(cache, question):
+    assert cache.get('en', 'beginner', question) is None
+
+@pytest.mark.parametrize('language, question, answer', [
+    ('en', 'what is PHISHING', 'phishing answer'),
+    ('en', 'Phishing, what is it?', 'phishing answer'),
+    ('en', "What's phishing", 'phishing answer'),
+    ('en', 'is it safe to use public WIFI', 'safe answer'),
+    ('ar', 'ماهو التصيّد الإحتيالي', 'إجابة التصيد'),
+])
+def test_same_question_is_reused(cache, language, question, answer):
+    assert cache.get(language, 'beginner', question) == answer
+
+def test_hits_are_saved_in_batches(cache, database):
+    for _ in range(3):
+        cache.get('en', 'beginner', 'What is phishing?')
+    with database.connection() as conn:
+        query = "SELECT hits FROM ai_answer_cache WHERE question_key = 'what is phishing'"
+        assert conn.execute(query).fetchone()[0] == 0
+        assert cache.flush_hits() == 1
+        assert conn.execute(query).fetchone()[0] == 3
+    assert cache.stats()['hits'] == 3
+
+def test_purge_expired_removes_rows(cache, database):
+    with database.transaction() as conn:
+        conn.execute("UPDATE ai_answer_cache SET created_at = ? WHERE language = 'ar'", (time.time() - cache.ttl - 1,))
+    assert cache.purge_expired() == 1
+    with database.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM ai_answer_cache').fetchone()[0] == 3
@@ -0,0 +1,85 @@
+import math
+import random
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from analytics_rollups import HyperLogLog, rebuild_rollups, record_activity, record_purchase
+
+LEVELS = {1: 'beginner', 2: 'beginner', 3: 'advanced', 4: 'expert', 5: 'advanced'}
+
+@pytest.fixture
+def database(tmp_path):
+    from database import DatabaseManager
+    database = DatabaseManager(str(tmp_path / 'analytics.db'))
+    with database.transaction() as conn:
+        conn.executemany('INSERT INTO users (user_id, username, level) VALUES (?, ?, ?)',
+                         [(user_id, f'user{user_id}', level) for user_id, level in LEVELS.items()])
+    yield database
+    database.close()
+
+def _rollups(database):
+    with database.connection() as conn:
+        activity = {tuple(row[:4]): (row[4], bytes(row[5])) for row in conn.execute('''
+            SELECT granularity, bucket, activity_type, level, events, users FROM activity_rollups
+        ''')}
+        revenue = {tuple(row[:2]): tuple(row[2:]) for row in conn.execute('''
+            SELECT day, item_id, revenue, points, sales FROM revenue_rollups
+        ''')}
+    return activity, revenue
+
+def test_incremental_rollups_match_rebuild(database):
+    rng = random.Random(25)
+    start = datetime(2026, 3, 1, 8)
+    with database.transaction() as conn:
+        # كما في AnalyticsSystem.track_user_activity و ShopSystem.create_purchase_record
+        for _ in range(500):
+            user_id = rng.choice(list(LEVELS))
+            activity_type = rng.choice(['lesson', 'quiz', 'ai_chat'])
+            timestamp = start + timedelta(minutes=rng.randrange(3 * 24 * 60))
+            conn.execute('INSERT INTO user_activities (user_id, activity_type, timestamp) VALUES (?, ?, ?)',
+                         (user_id, activity_type, timestamp))
+            record_activity(conn, user_id, activity_type, LEVELS[user_id], timestamp)
+        for _ in range(60):
+            item_id = rng.choice(['vip_month', 'hint_pack'])
+            amount_usd, amount_points = rng.choice([(4.99, 0), (0, 150)])
+            timestamp = start + timedelta(minutes=rng.randrange(3 * 24 * 60))
+            conn.execute('''
+                INSERT INTO purchases (id, user_id, item_id, payment_method, amount_points, amount_usd,
+                                       status, purchase_date)
+                VALUES (?, ?, ?, 'test', ?, ?, 'completed', ?)
+            ''', (str(uuid.uuid4()), rng.choice(list(LEVELS)), item_id, amount_points, amount_usd,
+                  timestamp.strftime('%Y-%m-%d %H:%M:%S')))
+            record_purchase(conn, item_id, amount_usd, amount_points, timestamp)
+
+    incremental_activity, incremental_revenue = _rollups(database)
+    with database.transaction() as conn:
+        rebuild_rollups(conn.cursor())
+    rebuilt_activity, rebuilt_revenue = _rollups(database)
+
+    assert incremental_activity == rebuilt_activity
+    assert incremental_revenue.keys() == rebuilt_revenue.keys()
+    for key, (revenue, points, sales) in rebuilt_revenue.items():
+        assert incremental_revenue[key] == (pytest.approx(revenue), points, sales)
+
+    # المستخدمون النشطون في يوم واحد قليلون فالتقدير دقيق
+    day_users = HyperLogLog.union([users for key, (_, users) in rebuilt_activity.items() if key[0] == 'day'])
+    assert day_users.count() == len(LEVELS)
+
+@pytest.mark.parametrize('count', [10, 1000, 50000])
+def test_hyperloglog_error_bounds(count):
+    sketch = HyperLogLog()
+    for user_id in range(count):
+        sketch.add(user_id)
+    # ثلاثة أضعاف الخطأ المعياري 1.04/sqrt(m)
+    tolerance = 3 * 1.04 / math.sqrt(HyperLogLog.size)
+    assert abs(sketch.count() - count) <= max(1, tolerance * count)
+
+def test_hyperloglog_union_matches_single_sketch():
+    parts = [HyperLogLog() for _ in range(4)]
+    whole = HyperLogLog()
+    for user_id in range(20000):
+        parts[user_id % 4].add(user_id)
+        whole.add(user_id)
+    assert HyperLogLog.union([part.to_bytes() for part in parts]).to_bytes() == whole.to_bytes()
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('telegram')
+
+from telegram.error import Forbidden, TimedOut
+
+from broadcast import BroadcastEngine
+from notification_planner import DeliveryPlanner
+
+class FakeBot:
+    def __init__(self, errors):
+        self.errors = errors
+        self.sent = []
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        if chat_id in self.errors:
+            raise self.errors[chat_id]
+        self.sent.append(chat_id)
+
+@pytest.fixture
+def engine(tmp_path):
+    from async_database import AsyncDatabaseManager
+    from database import DatabaseManager
+    database = DatabaseManager(str(tmp_path / 'broadcast.db'))
+    with database.transaction() as conn:
+        conn.executemany('INSERT INTO users (user_id, username) VALUES (?, ?)',
+                         [(user_id, f'user{user_id}') for user_id in range(1, 8)])
+    engine = BroadcastEngine(AsyncDatabaseManager(database), DeliveryPlanner(), rate=1000, per_chat_interval=0,
+                             concurrency=2, page_size=5, checkpoint_size=2, max_attempts=1, retry_delay=60)
+    engine.bot = FakeBot({3: TimedOut(), 5: Forbidden('bot was blocked by the user')})
+    yield engine
+    database.close()
+
+def test_progress_is_saved_per_chunk_and_retries_are_queued(engine, monkeypatch):
+    checkpoints = []
+    save = engine._checkpoint
+
+    async def checkpoint(broadcast, last_user_id, totals, blocked, deferred):
+        checkpoints.append(last_user_id)
+        await save(broadcast, last_user_id, totals, blocked, deferred)
+
+    monkeypatch.setattr(engine, '_checkpoint', checkpoint)
+    woken = []
+    engine.on_deferred = lambda: woken.append(1)
+
+    broadcast_id = engine.add_broadcast('announcement', 'hello')
+    totals = asyncio.run(engine.run(broadcast_id))
+
+    # صفحتان (5 + 2) مقسمتان إلى دفعات من مستلمَين
+    assert checkpoints == [2, 4, 5, 7]
+    assert totals == {'sent': 5, 'blocked': 1, 'failed': 0, 'deferred': 1}
+    assert woken == [1]
+    with engine.async_db.db.connection() as conn:
+        queued = conn.execute('SELECT user_id, available_at, broadcast_id, sent, failed FROM notifications').fetchall()
+        broadcast = conn.execute('SELECT * FROM broadcasts WHERE id = ?', (broadcast_id,)).fetchone()
+        blocked_at = conn.execute('SELECT blocked_at FROM users WHERE user_id = 5').fetchone()[0]
+    assert [(row['user_id'], row['broadcast_id'], row['sent'], row['failed']) for row in queued] == \
+        [(3, broadcast_id, 0, 0)]
+    assert queued[0]['available_at'] > broadcast['started_at'] + 50
+    assert (broadcast['status'], broadcast['last_user_id'], broadcast['failed']) == ('completed', 7, 0)
+    assert blocked_at is not None
+
+def test_resume_skips_checkpointed_recipients(engine):
+    broadcast_id = engine.add_broadcast('announcement', 'hello')
+    with engine.async_db.db.transaction() as conn:
+        # توقف البث بعد حفظ الدفعة الأولى
+        conn.execute("UPDATE broadcasts SET status = 'running', last_user_id = 2, sent = 2 WHERE id = ?",
+                     (broadcast_id,))
+    totals = asyncio.run(engine.run(broadcast_id))
+    assert sorted(engine.bot.sent) == [4, 6, 7]
+    assert totals['sent'] == 5
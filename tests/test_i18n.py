@@ -0,0 +1,28 @@
+import pytest
+
+from i18n import Template, catalog
+
+def test_templates_match_str_format():
+    for language in catalog.languages:
+        translator = catalog.translator(language, 'points')
+        text = translator.get('leaderboard_entry')
+        assert translator.format('leaderboard_entry', '🥇', 'Ali', 120) == text.format('🥇', 'Ali', 120)
+
+@pytest.mark.parametrize('text, args, kwargs', [
+    ('{} / {}', (3, 7), {}),
+    ('No fields', (), {}),
+    ('{0} and {0}', ('x',), {}),
+    ('{name}: {}', (1,), {'name': 'n'}),
+    ('{:>4}', (5,), {}),
+])
+def test_template_format(text, args, kwargs):
+    assert Template(text).format(*args, **kwargs) == text.format(*args, **kwargs)
+
+def test_missing_arguments_raise():
+    with pytest.raises(IndexError):
+        Template('{} {}').format(1)
+
+def test_catalog_format_falls_back():
+    # لغة غير مدعومة تستخدم اللغة الافتراضية، والمفتاح المفقود يعاد كما هو
+    assert catalog.format('xx', 'main', 'points', 5) == catalog.format('ar', 'main', 'points', 5)
+    assert catalog.format('en', 'main', 'missing_key', 5) == 'missing_key'
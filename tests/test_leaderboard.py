@@ -0,0 +1,88 @@
+import random
+
+import pytest
+
+from leaderboard import IndexableSkipList, Leaderboard, LeaderboardService
+from points_ledger import LedgerEntry
+
+@pytest.fixture
+def database(tmp_path):
+    from database import DatabaseManager
+    database = DatabaseManager(str(tmp_path / 'leaderboard.db'))
+    for user_id in (1, 2, 3):
+        database.register_user(user_id, f'user{user_id}', 'Test', None)
+    yield database
+    database.close()
+
+def test_skip_list_matches_sorted_list():
+    rng = random.Random(21)
+    skip_list, expected = IndexableSkipList(), []
+    for _ in range(3000):
+        if expected and rng.random() < 0.4:
+            key = rng.choice(expected)
+            skip_list.remove(key)
+            expected.remove(key)
+        else:
+            key = rng.randrange(100000)
+            if key in expected:
+                continue
+            skip_list.insert(key)
+            expected.append(key)
+        expected.sort()
+
+        assert len(skip_list) == len(expected)
+        if expected:
+            probe = rng.choice(expected)
+            assert skip_list.index(probe) == expected.index(probe)
+            start = rng.randrange(len(expected))
+            assert skip_list.slice(start, 7) == expected[start:start + 7]
+    assert skip_list.slice(0, len(expected)) == expected
+
+def test_leaderboard_ranks_match_sorted_scores():
+    rng = random.Random(5)
+    board, scores = Leaderboard(), {}
+    for _ in range(2000):
+        user_id = rng.randrange(200)
+        if user_id in scores and rng.random() < 0.2:
+            board.discard(user_id)
+            del scores[user_id]
+        else:
+            points, lessons = rng.randrange(-5, 20), rng.randrange(0, 2)
+            board.add(user_id, points, lessons)
+            old_points, old_lessons = scores.get(user_id, (0, 0))
+            scores[user_id] = (old_points + points, old_lessons + lessons)
+
+    expected = sorted(scores, key=lambda user_id: (-scores[user_id][0], -scores[user_id][1], user_id))
+    assert [user_id for _, user_id, _, _ in board.top(len(expected))] == expected
+    for rank, user_id in enumerate(expected, 1):
+        assert board.rank(user_id) == rank
+    assert [user_id for _, user_id, _, _ in board.entries(10, 5)] == expected[10:15]
+
+def test_change_counted_by_load_is_not_applied_again(database):
+    service = LeaderboardService(database)
+    service.load()
+    database.points_listeners.remove(service.record)
+
+    # الإشعار يتأخر حتى بعد إعادة البناء التي قرأت التغيير المحفوظ
+    earned = LedgerEntry(1, 30, 'test')
+    database.ledger.post([earned])
+    service.load()
+    base, weekly = service.top('all', 1)[0], service.top('weekly', 1)[0]
+    service.record(1, 30, 0, earned.history_id)
+    assert service.top('all', 1)[0] == base
+    assert service.top('weekly', 1)[0] == weekly
+
+    later = LedgerEntry(1, 5, 'test')
+    database.ledger.post([later])
+    service.record(1, 5, 0, later.history_id)
+    assert service.top('all', 1)[0][2] == base[2] + 5
+    assert service.top('weekly', 1)[0][2] == weekly[2] + 5
+
+def test_batch_entries_get_their_history_ids(database):
+    entries = [LedgerEntry(user_id, 10, 'batch') for user_id in (1, 2, 3)]
+    database.ledger.post(entries)
+    with database.connection() as conn:
+        for entry in entries:
+            row = conn.execute('SELECT user_id, points FROM points_history WHERE id = ?',
+                               (entry.history_id,)).fetchone()
+            assert tuple(row) == (entry.user_id, 10)
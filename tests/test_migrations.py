@@ -0,0 +1,106 @@
+import importlib.util
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+from migrations import MIGRATIONS, check_query_plans, run_migrations, schema_version
+
+BOT_DIR = os.path.join(os.path.dirname(__file__), '..', 'telegram_bot')
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    """قاعدة أنشأها database_updated.py (ينشئ cyberbot.db بجانب ملفه عند استيراده)"""
+    shutil.copy(os.path.join(BOT_DIR, 'database_updated.py'), tmp_path / 'database_updated.py')
+    spec = importlib.util.spec_from_file_location('legacy_database', tmp_path / 'database_updated.py')
+    spec.loader.exec_module(importlib.util.module_from_spec(spec))
+
+    path = tmp_path / 'cyberbot.db'
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO users (user_id, username, referral_code) VALUES (1, 'legacy', 'CB1')")
+    conn.execute("INSERT INTO users (user_id, username, referral_code) VALUES (2, 'friend', 'CB2')")
+    conn.execute('INSERT INTO referrals (referrer_id, referred_id, points_awarded) VALUES (1, 2, 50)')
+    conn.execute('''
+        INSERT INTO user_notification_preferences (user_id, notification_types, quiet_hours_start, quiet_hours_end)
+        VALUES (1, 'news,achievement', '22:30', '07:00')
+    ''')
+    conn.commit()
+    conn.close()
+    return str(path)
+
+def test_fresh_database_uses_indexes(tmp_path):
+    from database import DatabaseManager
+    database = DatabaseManager(str(tmp_path / 'fresh.db'))
+    try:
+        with database.connection() as conn:
+            assert schema_version(conn) == LATEST_VERSION
+            assert check_query_plans(conn) == []
+            assert {'vip_expires', 'last_activity', 'blocked_at'} <= _columns(conn, 'users')
+    finally:
+        database.close()
+
+def test_legacy_database_is_upgraded(legacy_db):
+    from database import DatabaseManager
+    database = DatabaseManager(legacy_db)
+    try:
+        with database.connection() as conn:
+            assert schema_version(conn) == LATEST_VERSION
+            assert check_query_plans(conn) == []
+            assert {'referred_by', 'streak_days', 'referral_count', 'blocked_at'} <= _columns(conn, 'users')
+            assert {'available_at', 'attempts'} <= _columns(conn, 'notifications')
+            assert conn.execute('''
+                SELECT quiet_hours_start, quiet_hours_end FROM user_notification_preferences WHERE user_id = 1
+            ''').fetchone()[:] == (22 * 60 + 30, 7 * 60)
+            assert conn.execute('SELECT referral_count FROM users WHERE user_id = 1').fetchone()[0] == 1
+            assert conn.execute('SELECT depth FROM referral_tree WHERE ancestor_id = 1 AND descendant_id = 2').fetchone()[0] == 1
+    finally:
+        database.close()
+
+def test_migrations_run_once(legacy_db):
+    from database import DatabaseManager
+    DatabaseManager(legacy_db).close()
+
+    conn = sqlite3.connect(legacy_db)
+    try:
+        tables = conn.execute('SELECT name, sql FROM sqlite_master ORDER BY name').fetchall()
+        assert run_migrations(conn.cursor()) == LATEST_VERSION
+        assert conn.execute('SELECT name, sql FROM sqlite_master ORDER BY name').fetchall() == tables
+    finally:
+        conn.close()
+
+def test_each_migration_upgrades_previous_version(legacy_db, tmp_path, monkeypatch):
+    # الترقية إصداراً بعد إصدار، كما لو شُغّل البوت عند إضافة كل ترحيل، تنتهي بالمخطط نفسه
+    import migrations
+    from database import DatabaseManager
+    fresh = tmp_path / 'fresh.db'
+    DatabaseManager(str(fresh)).close()
+    for count in range(1, len(MIGRATIONS) + 1):
+        monkeypatch.setattr(migrations, 'MIGRATIONS', MIGRATIONS[:count])
+        DatabaseManager(legacy_db).close()
+
+    conn = sqlite3.connect(legacy_db)
+    fresh_conn = sqlite3.connect(fresh)
+    try:
+        assert schema_version(conn) == LATEST_VERSION
+        assert check_query_plans(conn) == []
+        for table in ('users', 'news', 'notifications', 'user_notification_preferences'):
+            assert _columns(conn, table) >= _columns(fresh_conn, table), table
+    finally:
+        conn.close()
+        fresh_conn.close()
+
+def test_check_detects_full_scan(tmp_path):
+    from database import DatabaseManager
+    database = DatabaseManager(str(tmp_path / 'fresh.db'))
+    try:
+        with database.transaction() as conn:
+            conn.execute('DROP INDEX idx_points_history_user_date')
+        with database.connection() as conn:
+            assert [name for name, _ in check_query_plans(conn)] == ['points history']
+    finally:
+        database.close()
@@ -0,0 +1,68 @@
+from datetime import datetime
+
+from news_clustering import StoryClusterer, extract_cve_ids, load_signature
+
+BODY = ('Attackers are actively exploiting a remote code execution flaw in the VPN gateway '
+        'firmware, allowing unauthenticated access to corporate networks. Administrators '
+        'should apply the vendor patch released this week and rotate credentials.')
+
+def _news(title, content, source, url=None):
+    return {'title': title, 'content': content, 'source': source,
+            'url': url or f'https://{source}/story', 'published_date': datetime(2026, 10, 18)}
+
+def _clusters(stories):
+    return sorted(sorted(source for source, _, _ in story['sources']) for story in stories)
+
+def test_extract_cve_ids():
+    assert extract_cve_ids('Fix for cve-2026-1234 and CVE-2026-98765, not CVE-26-1') == \
+        frozenset({'CVE-2026-1234', 'CVE-2026-98765'})
+    assert extract_cve_ids(None) == frozenset()
+
+def test_shared_cve_groups_different_wording():
+    stories = StoryClusterer().cluster([
+        _news('Vendor patches CVE-2026-1234', 'A short advisory about the router bug.', 'a'),
+        _news('Routers under attack', 'Botnets now exploit cve-2026-1234 in the wild to take over devices.', 'b'),
+        _news('New phishing kit targets banks', 'A phishing campaign impersonates banks.', 'c'),
+    ])
+    assert _clusters(stories) == [['a', 'b'], ['c']]
+
+def test_cve_roundups_are_not_strong_keys():
+    # ملخص التحديثات الشهرية يذكر ثغرات كثيرة فلا يُدمج مع كل خبر يشاركه معرّفاً
+    roundup = ' '.join(f'CVE-2026-{1000 + i}' for i in range(5))
+    stories = StoryClusterer().cluster([
+        _news('Patch Tuesday roundup', f'This month fixes {roundup} across products.', 'a'),
+        _news('Mail server flaw exploited', 'Attackers exploit CVE-2026-1000 against mail servers.', 'b'),
+    ])
+    assert len(stories) == 2
+
+def test_minhash_groups_near_duplicates():
+    clusterer = StoryClusterer()
+    stories = clusterer.cluster([
+        _news('VPN gateway flaw exploited', BODY, 'a'),
+        _news('VPN gateway flaw exploited', BODY.replace('this week', 'on Monday'), 'b'),
+        _news('Ransomware hits hospital chain', 'A ransomware gang encrypted patient systems at a hospital chain.', 'c'),
+    ])
+    assert _clusters(stories) == [['a', 'b'], ['c']]
+
+    first, second = (clusterer.signature(text) for text in (BODY, BODY.replace('this week', 'on Monday')))
+    assert clusterer.similarity(first, second) >= clusterer.threshold
+    assert clusterer.similarity(first, clusterer.signature('Unrelated text about phishing kits')) < 0.2
+
+def test_canonical_story_and_sources():
+    stories = StoryClusterer().cluster([
+        _news('Flaw CVE-2026-5555', 'Short.', 'a', 'https://a/1'),
+        _news('CVE-2026-5555 exploited', 'A much longer write-up with details, also CVE-2026-6666.', 'b', 'https://b/1'),
+    ])
+    assert len(stories) == 1
+    story = stories[0]
+    assert story['source'] == 'b' and story['cluster_size'] == 2
+    assert [url for _, url, _ in story['sources']] == ['https://a/1', 'https://b/1']
+    assert story['cve_ids'] == frozenset({'CVE-2026-5555', 'CVE-2026-6666'})
+
+def test_signature_round_trip_and_stability():
+    clusterer = StoryClusterer()
+    signature = clusterer.signature(BODY)
+    assert len(signature) == clusterer.num_hashes
+    assert load_signature(signature.tobytes()) == signature
+    # المعاملات حتمية: مجمّع جديد يعطي البصمة نفسها فتبقى البصمات المحفوظة صالحة
+    assert StoryClusterer().signature(BODY) == signature
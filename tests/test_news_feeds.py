@@ -0,0 +1,105 @@
+import os
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip('feedparser')
+pytest.importorskip('newspaper')
+# عميل OpenAI يُنشأ عند الاستيراد ولا يُستدعى في هذه الاختبارات
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+
+from news_system import NewsSystem
+
+ETAG = '"feed-v1"'
+LAST_MODIFIED = 'Sat, 17 Oct 2026 18:00:00 GMT'
+FEED = b'''<?xml version="1.0"?>
+<rss version="2.0"><channel><title>Local</title>
+<item><title>Critical zero-day exploited in VPN appliances</title><link>http://local/1</link>
+<description>&lt;p&gt;Attackers exploit CVE-2026-1234.&lt;/p&gt;</description></item>
+<item><title>New phishing kit targets banks</title><link>http://local/2</link>
+<description>A phishing campaign.</description></item>
+</channel></rss>'''
+
+class FeedHandler(BaseHTTPRequestHandler):
+    validators = {'ETag': ETAG, 'Last-Modified': LAST_MODIFIED}
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(dict(self.headers))
+        etag = self.validators.get('ETag')
+        last_modified = self.validators.get('Last-Modified')
+        if (etag and self.headers.get('If-None-Match') == etag) or \
+                (not etag and last_modified and self.headers.get('If-Modified-Since') == last_modified):
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/rss+xml')
+        for name, value in self.validators.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(FEED)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def feed_server():
+    FeedHandler.validators = {'ETag': ETAG, 'Last-Modified': LAST_MODIFIED}
+    FeedHandler.requests = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FeedHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/feed'
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def news(tmp_path, feed_server):
+    from database import DatabaseManager
+    system = NewsSystem()
+    system.db = DatabaseManager(str(tmp_path / 'news.db'))
+    system.news_sources = {'local': feed_server}
+    yield system
+    system.db.close()
+
+def test_etag_revalidation(news, feed_server):
+    items, state = news.fetch_rss_news('local', feed_server)
+    assert [item['title'] for item in items][:1] == ['Critical zero-day exploited in VPN appliances']
+    assert items[0]['content'] == 'Attackers exploit CVE-2026-1234.'
+    assert state == (ETAG, LAST_MODIFIED)
+
+    assert news.fetch_rss_news('local', feed_server, state=state) == ([], None)
+    assert FeedHandler.requests[-1]['If-None-Match'] == ETAG
+    assert FeedHandler.requests[-1]['If-Modified-Since'] == LAST_MODIFIED
+
+def test_last_modified_revalidation(news, feed_server):
+    FeedHandler.validators = {'Last-Modified': LAST_MODIFIED}
+    items, state = news.fetch_rss_news('local', feed_server)
+    assert len(items) == 2 and state == (None, LAST_MODIFIED)
+
+    assert news.fetch_rss_news('local', feed_server, state=state) == ([], None)
+    assert 'If-None-Match' not in FeedHandler.requests[-1]
+
+    # المصدر تغير: التحقق القديم لا يطابق فيُعاد المحتوى
+    FeedHandler.validators = {'Last-Modified': 'Sun, 18 Oct 2026 06:00:00 GMT'}
+    items, state = news.fetch_rss_news('local', feed_server, state=state)
+    assert len(items) == 2 and state == (None, 'Sun, 18 Oct 2026 06:00:00 GMT')
+
+def test_collection_saves_state_and_newsletter_reads_saved_news(news, feed_server):
+    assert news.create_newsletter_messages() == {}
+    assert len(news.collect_daily_news()) == 2
+    assert news.get_feed_states() == {'local': (feed_server, ETAG, LAST_MODIFIED)}
+
+    # دورة الجمع التالية لا تجد جديداً، والنشرة تبقى مبنية من أخبار آخر 24 ساعة
+    assert news.collect_daily_news() == []
+    assert FeedHandler.requests[-1]['If-None-Match'] == ETAG
+    with news.db.transaction() as conn:
+        conn.execute('''
+            INSERT INTO news (title_ar, title_en, content_ar, content_en, severity, published_date)
+            VALUES ('ثغرة حرجة', 'Critical flaw', '', '', 'critical', ?)
+        ''', (datetime.now(),))
+    messages = news.create_newsletter_messages()
+    assert 'Critical flaw' in messages['en'] and 'ثغرة حرجة' in messages['ar']
@@ -0,0 +1,115 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip('telegram')
+
+from broadcast import BLOCKED, FAILED, RETRY, SENT
+from notification_queue import NotificationQueue
+
+class FakeEngine:
+    """يعيد لكل مستخدم النتيجة المحددة له ويسجل الرسائل المرسلة"""
+
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+        self.sent = []
+
+    async def send(self, user_id, text, parse_mode=None, max_attempts=1):
+        self.sent.append((user_id, text))
+        outcome = self.outcomes.get(user_id, SENT)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def pick_message(self, messages, language):
+        return messages.get(language) or messages['ar']
+
+@pytest.fixture
+def database(tmp_path):
+    from database import DatabaseManager
+    database = DatabaseManager(str(tmp_path / 'queue.db'))
+    with database.transaction() as conn:
+        conn.executemany('INSERT INTO users (user_id, username) VALUES (?, ?)',
+                         [(user_id, f'user{user_id}') for user_id in (1, 2, 3, 4)])
+    yield database
+    database.close()
+
+def _queue(database, outcomes, **options):
+    from async_database import AsyncDatabaseManager
+    return NotificationQueue(AsyncDatabaseManager(database), FakeEngine(outcomes),
+                             lambda title, message, kind, priority: f'{title}: {message}', **options)
+
+def _enqueue(database, *user_ids, available_at=None):
+    with database.transaction() as conn:
+        conn.executemany('''
+            INSERT INTO notifications (user_id, title, message, available_at) VALUES (?, 'Title', 'Body', ?)
+        ''', [(user_id, available_at or time.time() - 1) for user_id in user_ids])
+
+def _rows(database):
+    with database.connection() as conn:
+        return {row['user_id']: row for row in conn.execute('SELECT * FROM notifications')}
+
+def test_expired_lease_is_delivered_again(database):
+    queue = _queue(database, {}, visibility_timeout=60)
+    _enqueue(database, 1)
+    now = time.time()
+    assert len(queue._lease(now)) == 1
+    # العامل توقف قبل حفظ النتيجة: الإشعار محجوز حتى تنتهي المهلة
+    assert queue._lease(now + 30) == []
+    rows = queue._lease(now + 61)
+    assert len(rows) == 1 and rows[0]['attempts'] == 1
+    assert queue.counters['expired_leases'] == 1
+
+def test_future_notifications_wait(database):
+    queue = _queue(database, {})
+    _enqueue(database, 1, available_at=time.time() + 3600)
+    assert asyncio.run(queue.process_batch()) == 0
+
+def test_outcomes_backoff_and_dead_letters(database):
+    queue = _queue(database, {2: RETRY, 3: BLOCKED, 4: ConnectionError('down')},
+                   max_attempts=2, base_delay=30)
+    _enqueue(database, 1, 2, 3, 4)
+    before = time.time()
+    assert asyncio.run(queue.process_batch()) == 4
+
+    rows = _rows(database)
+    assert rows[1]['sent'] and rows[1]['leased_until'] is None
+    for user_id in (2, 4):
+        # المحاولة الأولى: تأخير base_delay مع تذبذب ±20%
+        assert not rows[user_id]['failed'] and rows[user_id]['error_message'] == RETRY
+        assert before + 30 * 0.8 <= rows[user_id]['available_at'] <= time.time() + 30 * 1.2
+    assert rows[3]['failed'] and rows[3]['error_message'] == BLOCKED
+    with database.connection() as conn:
+        assert conn.execute('SELECT blocked_at IS NOT NULL, newsletter_subscribed FROM users WHERE user_id = 3'
+                            ).fetchone()[:] == (1, 0)
+
+    # المحاولة الثانية تصل إلى max_attempts فتنتقل إلى طابور الرسائل الميتة
+    with database.transaction() as conn:
+        conn.execute('UPDATE notifications SET available_at = ? WHERE sent = FALSE AND failed = FALSE', (before,))
+    assert asyncio.run(queue.process_batch()) == 2
+    rows = _rows(database)
+    assert rows[2]['failed'] and rows[2]['attempts'] == 2
+    assert rows[4]['failed']
+    assert queue.counters == dict(queue.counters, sent=1, retried=2, dead_lettered=3, blocked=1)
+
+def test_permanent_failure_is_not_retried(database):
+    queue = _queue(database, {1: FAILED})
+    _enqueue(database, 1)
+    asyncio.run(queue.process_batch())
+    row = _rows(database)[1]
+    assert row['failed'] and row['attempts'] == 1 and row['error_message'] == FAILED
+
+def test_requeue_dead_letters_skips_blocked_users(database):
+    queue = _queue(database, {1: FAILED, 2: BLOCKED})
+    _enqueue(database, 1, 2)
+    asyncio.run(queue.process_batch())
+
+    assert queue.requeue_dead_letters() == 1
+    rows = _rows(database)
+    assert not rows[1]['failed'] and rows[1]['attempts'] == 0
+    assert rows[2]['failed']
+
+    queue.engine.outcomes = {}
+    asyncio.run(queue.drain())
+    assert _rows(database)[1]['sent']
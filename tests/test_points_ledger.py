@@ -0,0 +1,52 @@
+import pytest
+
+from points_ledger import APPLIED, DUPLICATE, INSUFFICIENT, UNKNOWN_USER, LedgerEntry, post_entries
+
+@pytest.fixture
+def database(tmp_path):
+    from database import DatabaseManager
+    database = DatabaseManager(str(tmp_path / 'ledger.db'))
+    for user_id in (1, 2):
+        database.register_user(user_id, f'user{user_id}', 'Test', None)
+    yield database
+    database.close()
+
+def _balance_and_ledger(database, user_id):
+    with database.connection() as conn:
+        balance = conn.execute('SELECT points FROM users WHERE user_id = ?', (user_id,)).fetchone()[0]
+        ledger = conn.execute(
+            'SELECT COALESCE(SUM(points), 0) FROM points_history WHERE user_id = ?', (user_id,)
+        ).fetchone()[0]
+    return balance, ledger
+
+def test_post_entries_results(database):
+    start, _ = _balance_and_ledger(database, 1)
+    with database.transaction() as conn:
+        results = post_entries(conn, [
+            LedgerEntry(1, 20, 'lesson', 'lesson:1:1'),
+            LedgerEntry(1, 20, 'lesson', 'lesson:1:1'),
+            LedgerEntry(1, -(start + 21), 'shop'),
+            LedgerEntry(99, 5, 'bonus'),
+        ])
+    assert results == [APPLIED, DUPLICATE, INSUFFICIENT, UNKNOWN_USER]
+
+    # المفتاح المحفوظ يبقى مكرراً في المعاملات التالية
+    assert database.ledger.post([LedgerEntry(1, 20, 'lesson', 'lesson:1:1')]) == [DUPLICATE]
+    assert database.ledger.post([LedgerEntry(1, -(start + 20), 'shop')]) == [APPLIED]
+    assert database.ledger.post([LedgerEntry(1, -1, 'shop')]) == [INSUFFICIENT]
+
+    balance, ledger = _balance_and_ledger(database, 1)
+    assert balance == ledger == 0
+
+def test_balance_matches_history_after_mixed_batches(database):
+    for round_number in range(20):
+        database.ledger.post([
+            LedgerEntry(1, 7, 'earn', f'earn:{round_number % 5}'),
+            LedgerEntry(1, -4, 'spend'),
+            LedgerEntry(2, -30, 'spend'),
+            LedgerEntry(2, 3, 'earn'),
+        ])
+    for user_id in (1, 2):
+        balance, ledger = _balance_and_ledger(database, user_id)
+        assert balance == ledger >= 0
+    assert database.ledger.reconcile()['mismatches'] == 0
@@ -0,0 +1,108 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from scheduler import CronSpec, JobScheduler
+
+@pytest.mark.parametrize('expression, moment, expected', [
+    ('*/15 * * * *', datetime(2026, 3, 2, 10, 7), datetime(2026, 3, 2, 10, 15)),
+    ('0 */6 * * *', datetime(2026, 3, 2, 18, 0), datetime(2026, 3, 3, 0, 0)),
+    ('30 9-17/4 * * *', datetime(2026, 3, 2, 13, 30), datetime(2026, 3, 2, 17, 30)),
+    ('0 20 * * *', datetime(2026, 12, 31, 21, 0), datetime(2027, 1, 1, 20, 0)),
+    # 2026-03-01 يوم أحد؛ 7 تعني الأحد أيضاً
+    ('0 8 * * 7', datetime(2026, 2, 27, 9, 0), datetime(2026, 3, 1, 8, 0)),
+    ('0 8 * * 1-5', datetime(2026, 2, 27, 9, 0), datetime(2026, 3, 2, 8, 0)),
+    # يوم الشهر ويوم الأسبوع معاً: يكفي تطابق أحدهما
+    ('0 0 15 * 1', datetime(2026, 3, 3, 0, 0), datetime(2026, 3, 9, 0, 0)),
+    ('0 0 29 2 *', datetime(2026, 3, 1), datetime(2028, 2, 29)),
+])
+def test_next_after(expression, moment, expected):
+    assert CronSpec(expression).next_after(moment) == expected
+
+def test_daily_at():
+    assert CronSpec.daily_at('20:05').expression == '5 20 * * *'
+
+@pytest.mark.parametrize('expression', ['* * * *', '60 * * * *', '* 24 * * *', '5-1 * * * *', '*/0 * * * *', 'a * * * *'])
+def test_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        CronSpec(expression)
+
+@pytest.fixture
+def scheduler(tmp_path):
+    from async_database import AsyncDatabaseManager
+    from database import DatabaseManager
+    database = DatabaseManager(str(tmp_path / 'scheduler.db'))
+    yield JobScheduler(AsyncDatabaseManager(database))
+    database.close()
+
+def _launches(scheduler, monkeypatch):
+    launched = []
+    monkeypatch.setattr(scheduler, '_launch', lambda job, fire_at: launched.append(fire_at))
+    return launched
+
+def test_catch_up_runs_latest_missed_once(scheduler, monkeypatch):
+    launched = _launches(scheduler, monkeypatch)
+    job = scheduler.add_job('every_minute', '* * * * *', lambda: None, misfire_grace=3600)
+    before = datetime.now()
+    scheduler._catch_up(job, before - timedelta(minutes=10))
+    assert len(launched) == 1
+    assert before - timedelta(minutes=1) < launched[0] <= datetime.now()
+
+def test_catch_up_skips_outside_grace(scheduler, monkeypatch):
+    launched = _launches(scheduler, monkeypatch)
+    missed = datetime.now() - timedelta(hours=2)
+    job = scheduler.add_job('daily', CronSpec.daily_at(missed.strftime('%H:%M')), lambda: None, misfire_grace=3600)
+    scheduler._catch_up(job, missed - timedelta(days=1))
+    assert launched == []
+
+def test_catch_up_without_missed_run(scheduler, monkeypatch):
+    launched = _launches(scheduler, monkeypatch)
+    job = scheduler.add_job('hourly', '0 * * * *', lambda: None)
+    scheduler._catch_up(job, datetime.now())
+    assert launched == []
+
+def test_duplicate_job_name(scheduler):
+    scheduler.add_job('job', '* * * * *', lambda: None)
+    with pytest.raises(ValueError):
+        scheduler.add_job('job', '* * * * *', lambda: None)
+
+def test_overlapping_run_is_skipped_and_state_saved(scheduler):
+    async def scenario():
+        release = asyncio.Event()
+        calls = []
+
+        async def slow():
+            calls.append(1)
+            await release.wait()
+
+        job = scheduler.add_job('slow', '* * * * *', slow)
+        fire_at = datetime.now().replace(second=0, microsecond=0)
+        scheduler._launch(job, fire_at)
+        await asyncio.sleep(0.05)
+        scheduler._launch(job, fire_at + timedelta(minutes=1))
+        assert job.skipped == 1 and job.running
+
+        release.set()
+        await job.task
+        assert calls == [1] and job.runs == 1
+        return await scheduler._load_states(), fire_at
+
+    states, fire_at = asyncio.run(scenario())
+    assert states == {'slow': fire_at.timestamp()}
+
+def test_failed_run_is_recorded(scheduler):
+    def broken():
+        raise RuntimeError('boom')
+
+    async def scenario():
+        job = scheduler.add_job('broken', '* * * * *', broken)
+        scheduler._launch(job, datetime.now().replace(second=0, microsecond=0))
+        await job.task
+        return job, await scheduler.async_db.fetchone(
+            "SELECT last_status, last_error FROM scheduled_jobs WHERE name = 'broken'"
+        )
+
+    job, row = asyncio.run(scenario())
+    assert job.failures == 1
+    assert tuple(row) == ('error', 'boom')
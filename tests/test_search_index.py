@@ -0,0 +1,57 @@
+import sqlite3
+
+import pytest
+
+from search_index import build_snippet, query_terms, search
+
+TITLE = 'مدرسةٌ إلكترونية تتعرض لهجوم'
+CONTENT = 'تعرضت مدرسةٌ في المدينة لهجوم فدية أَمْني أدى إلى إيقاف الأنظمة، وطالب المهاجمون بفدية كبيرة.'
+
+@pytest.fixture
+def db_path(tmp_path):
+    from database import DatabaseManager
+    path = str(tmp_path / 'search.db')
+    DatabaseManager(path).close()
+    return path
+
+def test_plain_connection_updates_index(db_path):
+    # اتصال دون أي دوال مسجلة، مثل سطر أوامر sqlite3 أو سكربت استعادة
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute('INSERT INTO news (title_ar, title_en, content_ar, content_en) VALUES (?, ?, ?, ?)',
+                     (TITLE, 'School hit by ransomware', CONTENT, 'A school was hit by ransomware.'))
+        conn.commit()
+        assert search(conn, 'مدرسه')['total'] == 1
+        assert search(conn, 'امني')['total'] == 1
+
+        conn.execute("UPDATE news SET content_ar = 'نص جديد عن التصيد'")
+        conn.commit()
+        assert search(conn, 'امني')['total'] == 0
+        assert search(conn, 'التصيّد')['total'] == 1
+
+        conn.execute('DELETE FROM news')
+        conn.commit()
+        assert search(conn, 'ransomware')['total'] == 0
+    finally:
+        conn.close()
+
+def test_snippet_keeps_original_text(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute('INSERT INTO news (title_ar, title_en, content_ar, content_en) VALUES (?, ?, ?, ?)',
+                     (TITLE, 'School hit', CONTENT, 'A school was hit.'))
+        conn.commit()
+        result = search(conn, 'مدرسة امني', highlight=('<mark>', '</mark>'))['results'][0]
+    finally:
+        conn.close()
+    assert '<mark>مدرسةٌ</mark>' in result['snippet']
+    assert '<mark>أَمْني</mark>' in result['snippet']
+    assert result['snippet'].replace('<mark>', '').replace('</mark>', '') in CONTENT
+
+def test_snippet_window_and_article_forms():
+    text = ' '.join(f'word{i}' for i in range(40)) + ' للأمن'
+    snippet = build_snippet([None, text], query_terms('الامن'), words=8)
+    assert snippet.startswith('…') and snippet.endswith('«للأمن»')
+    assert build_snippet([text], query_terms('phishing')) == ''